@@ -0,0 +1,3 @@
+from .bench_engine import main
+
+main()
@@ -0,0 +1,192 @@
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+from engine.Table import *
+import engine.sim as EngineSim
+
+
+# state of seeded game (greedy players) where predicate is true for the first time, searched over the first seeds
+def find_state(predicate, players_count: int = 2, seeds: int = 100) -> Table:
+    for seed in range(seeds):
+        table = Table([Player(f'p{i}', f'p{i}') for i in range(players_count)], seed=seed)
+        rng = random.Random(seed)
+        while True:
+            player_id, moves = table.legal_moves()
+            if not moves:
+                break
+            if predicate(table, player_id, moves):
+                return table
+            table.apply_event(EngineSim.greedy_policy(table, player_id, moves, rng))
+
+    raise LookupError("No game reaches the state")
+
+
+def defending(table: Table, player_id: str, moves: list) -> bool: # defender has to beat a card and can do it
+    return table.deck.cards_available() > 0 and any(m[0] == 'defend' for m in moves) and len(table.players[table.get_next_turn()].get_hand()) > 2
+
+
+def throwing(table: Table, player_id: str, moves: list) -> bool: # everything is beaten and attacker can throw another card
+    return table.deck.cards_available() > 0 and any(m[0] == 'throw_additional' for m in moves)
+
+
+def refilling(table: Table, player_id: str, moves: list) -> bool: # finishing ends the attack and hands are refilled from the deck
+    return (
+        table.deck.cards_available() > 6 and moves[-1][0] == 'finished' and not table.defender_takes
+        and len(table.finished_player_ids) == len(table.players) - 2 and len(table.attack_state) > 1
+    )
+
+
+def weak_card(table: Table, player: Player, allowed: list) -> Card: # card of player which isn't one of allowed moves
+    allowed_ids = {m[-1] for m in allowed}
+    for card in player.get_hand():
+        if card.get_id() not in allowed_ids:
+            return card
+    return next(c for c in CARDS_BY_ID if not player.have_card(c)) # every card is allowed, card not in hand is rejected too
+
+
+def rejected(method, *args): # call engine method which has to reject the move
+    try:
+        method(*args)
+    except ValueError:
+        return
+    raise AssertionError("Move was accepted")
+
+
+# name => function returning (function to time, number of operations one call makes)
+def micro_benchmarks() -> dict:
+    benchmarks = {}
+
+    card_names = [str(c) for c in CARDS_BY_ID]
+    benchmarks['card_from_string'] = lambda: (lambda: [Card.from_string(name) for name in card_names], len(card_names))
+
+    def serialization(method: str):
+        def setup():
+            table = find_state(lambda t, p, m: t.attacks_number >= 4 and len(t.attack_state) > 0, players_count=3)
+            if method == 'from_json':
+                data = table.to_json()
+                return (lambda: Table.from_json(data)), 1
+            if method == 'to_safejson':
+                player_id = table.players[0].get_id()
+                return (lambda: table.to_safejson(player_id)), 1
+            return (lambda: table.to_json()), 1
+        return setup
+
+    benchmarks['table_to_json'] = serialization('to_json')
+    benchmarks['table_from_json'] = serialization('from_json')
+    benchmarks['table_to_safejson'] = serialization('to_safejson')
+
+    def defend(): # accepted move is timed together with its undo (see Table.make_move), so the state stays the same
+        table = find_state(defending)
+        move = next(m for m in table.legal_moves()[1] if m[0] == 'defend')
+        return (lambda: table.unmake_move(table.make_move(move))), 1
+    benchmarks['defend_make_unmake'] = defend
+
+    def defend_rejected():
+        table = find_state(defending)
+        moves = [m for m in table.legal_moves()[1] if m[0] == 'defend']
+        bottom = Card.from_id(moves[0][1])
+        card = weak_card(table, table.players[table.get_next_turn()], [m for m in moves if m[1] == bottom.get_id()])
+        return (lambda: rejected(table.defend, bottom, card)), 1
+    benchmarks['defend_rejected'] = defend_rejected
+
+    def throw():
+        table = find_state(throwing)
+        move = next(m for m in table.legal_moves()[1] if m[0] == 'throw_additional')
+        return (lambda: table.unmake_move(table.make_move(move))), 1
+    benchmarks['throw_additional_make_unmake'] = throw
+
+    def throw_rejected():
+        table = find_state(throwing)
+        player_id, moves = table.legal_moves()
+        card = weak_card(table, table.search_player(player_id), moves[:-1])
+        return (lambda: rejected(table.throw_additional, player_id, card)), 1
+    benchmarks['throw_additional_rejected'] = throw_rejected
+
+    def refill(): # the last player finishes, cards are discarded and hands are refilled (and undone, see Table.make_move)
+        table = find_state(refilling)
+        move = table.legal_moves()[1][-1]
+        return (lambda: table.unmake_move(table.make_move(move))), 1
+    benchmarks['end_attack_refill'] = refill
+
+    return benchmarks
+
+
+def game_benchmarks(games: int) -> dict: # complete seeded games (random policy) for every players count
+    benchmarks = {}
+    for players_count in (2, 3, 4):
+        def setup(players_count=players_count):
+            return (lambda: [EngineSim.play_game(seed, ['random'], players_count) for seed in range(games)]), games
+        benchmarks[f'game_{players_count}_players'] = setup
+
+    return benchmarks
+
+
+def measure(setup, repeat: int) -> dict: # time of one operation (seconds), every repeat runs for at least 0.2 s
+    function, operations = setup()
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    times = [t / (number * operations) for t in timer.repeat(repeat, number)]
+
+    return {
+        'operations': number * operations * repeat,
+        'seconds_min': min(times),
+        'seconds_median': statistics.median(times),
+    }
+
+
+def git_commit() -> (str | None): # commit the results belong to (None outside of git repository)
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict): # add relative change of median time to every benchmark found in baseline
+    for name, result in results['benchmarks'].items():
+        old = baseline.get('benchmarks', {}).get(name)
+        if old is not None and old['seconds_median'] > 0:
+            result['change'] = result['seconds_median'] / old['seconds_median'] - 1 # e.g. 0.1 is 10% slower
+
+
+def main(argv=None): # python -m benchmarks --out results.json --compare previous.json
+    parser = argparse.ArgumentParser(description="Time engine operations and whole games and print results as json")
+    parser.add_argument('--out', default=None, help="file to write results to (stdout by default)")
+    parser.add_argument('--compare', default=None, help="results of previous run, relative change of every benchmark is added")
+    parser.add_argument('--filter', default=None, help="run only benchmarks containing this text in the name")
+    parser.add_argument('--repeat', type=int, default=5, help="number of timed runs of every benchmark")
+    parser.add_argument('--games', type=int, default=50, help="number of games in one run of game benchmarks")
+    args = parser.parse_args(argv)
+
+    benchmarks = micro_benchmarks() | game_benchmarks(args.games)
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'benchmarks': {},
+    }
+    for name, setup in benchmarks.items():
+        if args.filter is None or args.filter in name:
+            results['benchmarks'][name] = measure(setup, args.repeat)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+    text = json.dumps(results, indent=2) + '\n'
+    if args.out:
+        with open(args.out, 'w') as out:
+            out.write(text)
+    else: # stdout stays open
+        sys.stdout.write(text)
+
+
+if __name__ == '__main__':
+    main()
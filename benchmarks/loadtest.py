@@ -0,0 +1,164 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+from asgiref.sync import sync_to_async
+
+from core.asgi import application # sets django up
+from channels.testing import WebsocketCommunicator
+from django.db import connection
+from django.test import AsyncClient
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from durak.models import Player
+from durak.actors import actors, move_to_action
+from durak.persistence import writer
+
+
+# in-process load test: rooms are created through the index view, players go through the waiting room and game sockets
+# of core.asgi.application (in-memory channel layer) and play whole games with random legal moves.
+# Latency of an action is the time from sending it until every player of the room got the update.
+# Everything runs in a throwaway test database
+
+
+def cookie_header(player_id: str) -> list:
+    return [(b'cookie', f'player_id={player_id}'.encode())]
+
+
+async def receive_until(communicator: WebsocketCommunicator, condition, timeout: float) -> dict: # skip messages until condition is true
+    while True:
+        message = await communicator.receive_json_from(timeout)
+        if message.get('type') == 'player_mistake':
+            raise RuntimeError(f"Move was rejected: {message['message']}")
+        if condition(message):
+            return message
+
+
+async def create_room(room_index: int, players_count: int, timeout: float) -> list[str]: # ids of players of new room with started game
+    player_ids = []
+    clients = []
+    for i in range(players_count): # index puts players into the first waiting room, so rooms are filled one-by-one
+        client = AsyncClient()
+        response = await client.post('/', {'players_count': str(players_count), 'username': f'load-{room_index}-{i}'})
+        player_ids.append(response.cookies['player_id'].value)
+        clients.append(client)
+
+    waiting = [WebsocketCommunicator(application, '/ws/waiting_room/', headers=cookie_header(p)) for p in player_ids]
+    for communicator in waiting:
+        connected, _ = await communicator.connect(timeout)
+        if not connected:
+            raise RuntimeError("Waiting room refused connection")
+    for communicator in waiting: # the last player fills the room
+        await receive_until(communicator, lambda m: m.get('type') == 'start_game', timeout)
+        await communicator.disconnect(code=1000) # other codes remove player from the room
+
+    for client in clients: # every player opens the game page (table was dealt when the room filled)
+        await client.get('/durak/')
+
+    return player_ids
+
+
+async def play_room(player_ids: list[str], rng: random.Random, max_moves: int, timeout: float, latencies: list) -> bool: # True if game finished
+    room_id = await sync_to_async(Player.objects.values_list('room_id', flat=True).get)(id=player_ids[0])
+
+    communicators = {}
+    for player_id in player_ids:
+        communicator = WebsocketCommunicator(application, '/ws/durak_game/', headers=cookie_header(player_id))
+        connected, _ = await communicator.connect(timeout)
+        if not connected:
+            raise RuntimeError("Game socket refused connection")
+        await receive_until(communicator, lambda m: m.get('type') == 'game_state', timeout)
+        communicators[player_id] = communicator
+
+    actor = actors[room_id] # moves are chosen from the live table of the room
+    for _ in range(max_moves):
+        player_id, moves = actor.table.legal_moves()
+        if not moves:
+            return True
+
+        seq = actor.version + 1
+        started = time.perf_counter()
+        await communicators[player_id].send_json_to(move_to_action(rng.choice(moves)))
+        await asyncio.gather(*(
+            receive_until(c, lambda m: m.get('seq', -1) >= seq, timeout) for c in communicators.values()
+        ))
+        latencies.append(time.perf_counter() - started)
+
+    return False
+
+
+def percentile(values: list, fraction: float) -> float: # values have to be sorted
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+
+    started = time.perf_counter()
+    rooms = [await create_room(i, args.players, args.timeout) for i in range(args.rooms)]
+    setup_seconds = time.perf_counter() - started
+
+    latencies = []
+    semaphore = asyncio.Semaphore(args.concurrency or len(rooms))
+    async def play(player_ids: list[str], room_rng: random.Random) -> bool:
+        async with semaphore:
+            return await play_room(player_ids, room_rng, args.max_moves, args.timeout, latencies)
+
+    started = time.perf_counter()
+    finished = await asyncio.gather(*(play(p, random.Random(rng.random())) for p in rooms))
+    seconds = time.perf_counter() - started
+
+    await writer.flush(list(writer.dirty)) # nothing is left to write into removed database
+
+    latencies.sort()
+    return {
+        'rooms': args.rooms,
+        'players': args.players,
+        'concurrency': args.concurrency or args.rooms,
+        'games_finished': sum(finished),
+        'actions': len(latencies),
+        'setup_seconds': setup_seconds,
+        'seconds': seconds,
+        'actions_per_second': len(latencies) / seconds if seconds > 0 else None,
+        'latency_ms': None if not latencies else {
+            'p50': percentile(latencies, 0.50) * 1000,
+            'p95': percentile(latencies, 0.95) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+            'max': latencies[-1] * 1000,
+        },
+    }
+
+
+def main(argv=None): # python -m benchmarks.loadtest --rooms 50 --players 3
+    parser = argparse.ArgumentParser(description="Play games through websockets of the app in one process and print latency and throughput as json")
+    parser.add_argument('--rooms', type=int, default=20, help="number of rooms (games) to play")
+    parser.add_argument('--players', type=int, default=2, choices=(2, 3, 4), help="number of players in every room")
+    parser.add_argument('--concurrency', type=int, default=None, help="number of rooms playing at the same time (all by default)")
+    parser.add_argument('--max-moves', type=int, default=2000, help="moves after which a game is given up")
+    parser.add_argument('--timeout', type=float, default=10.0, help="seconds to wait for any message")
+    parser.add_argument('--seed', type=int, default=0, help="seed of moves choice")
+    parser.add_argument('--out', default=None, help="file to write results to (stdout by default)")
+    args = parser.parse_args(argv)
+
+    setup_test_environment() # allows test client's host
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    text = json.dumps(results, indent=2) + '\n'
+    if args.out:
+        with open(args.out, 'w') as out:
+            out.write(text)
+    else: # stdout stays open
+        sys.stdout.write(text)
+
+
+if __name__ == '__main__':
+    main()
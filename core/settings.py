@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -135,4 +136,28 @@ CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels.layers.InMemoryChannelLayer"
     }
-}
\ No newline at end of file
+}
+
+# Durak game settings
+DURAK_PERSIST_INTERVAL = 1.0 # seconds between batched writes of changed game states (see durak.persistence)
+DURAK_SNAPSHOT_EVERY = 20 # full game state is stored every this many moves, moves between snapshots are stored in moves log
+DURAK_RECONNECT_TIMEOUT = 5.0 # seconds disconnected player has to come back before bot takes his seat (see durak.presence)
+DURAK_PRESENCE_INTERVAL = 5.0 # seconds between bulk writes of Player.is_connected (connection state lives in durak.presence)
+DURAK_MATCHMAKING_BATCH = 16 # waiting rooms created with one query by the lobby (see durak.matchmaking)
+DURAK_METRICS = False # collect latency histograms and counters, exported at /metrics (see durak.metrics)
+
+# Sampling profiler of live game actions and the game page (see durak.profiling), can be turned on with DURAK_PROFILE=1
+DURAK_PROFILE = os.environ.get('DURAK_PROFILE', '') == '1'
+DURAK_PROFILE_RATE = float(os.environ.get('DURAK_PROFILE_RATE', 0.01)) # fraction of calls which are profiled
+DURAK_PROFILE_INTERVAL = 60.0 # seconds between writes of aggregated profiles (one file per action type and process)
+DURAK_PROFILE_DIR = BASE_DIR / 'profiles'
+
+# Bots taking seats of players who didn't reconnect and free seats of rooms which didn't fill (see durak.bots)
+DURAK_BOTS = True # False removes players who left from the game instead
+DURAK_BOT_MOVE_TIME = 1.0 # seconds bot thinks about one move (every search stops at this deadline)
+DURAK_BOT_SEARCH_WORKERS = 2 # processes searching one move together, playouts per second grow with them (about 4000 per process)
+DURAK_BOT_MAX_PLAYOUTS = None # playouts per move after which search stops before the deadline (None - only time is limited)
+DURAK_BOT_PROCESSES = None # size of the pool shared by bots of every room (number of cpus by default)
+DURAK_BOT_ROLLOUT = 'greedy' # policy playing moves after the search tree (see engine.sim.POLICIES)
+DURAK_BOT_ENDGAME_ENTRIES = 200_000 # transposition table size of exact solver of 2 player endgames (per process, see engine.endgame)
+DURAK_WAITING_BOTS_TIMEOUT = 30.0 # seconds the first player of a waiting room waits for others before bots take free seats (None - forever)
@@ -17,8 +17,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from durak.views import export_metrics
+
 urlpatterns = [
     path('', include('durak.urls')),
     path('users/', include('users.urls')),
     path('admin/', admin.site.urls),
+    path('metrics', export_metrics, name='metrics'), # see DURAK_METRICS
 ]
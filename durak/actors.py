@@ -0,0 +1,411 @@
+import asyncio
+import json
+import logging
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+
+from .models import Room
+from .persistence import writer
+from .deltas import diff_public_state, diff_hand
+from .bots import bots
+from .metrics import metrics, Gauge
+from .profiling import profiler
+
+import engine.Table as EngineTable
+import engine.Card as EngineCard
+
+logger = logging.getLogger(__name__)
+
+
+# applies one websocket action of the player to the table, returns description of the made action (sent to players as last_action)
+def apply_action(table: EngineTable.Table, player_id: str, data: dict) -> dict:
+    action = data['action']
+
+    if action == 'play_turn':
+        table.play_turn(EngineCard.Card.from_string(data['card'])) # make move in engine side
+        return {'type': 'play_turn'}
+
+    elif action == 'throw_additional':
+        table.throw_additional(player_id, EngineCard.Card.from_string(data['card'])) # call engine method to throw additional card
+        return {'type': 'throw_additional', 'player_id': player_id} # mark what action was made and by who
+
+    elif action == 'defend':
+        # call engine method to defend bottom card
+        table.defend(EngineCard.Card.from_string(data['bottom_card']), EngineCard.Card.from_string(data['top_card']))
+        return {'type': 'defend', 'player_id': player_id}
+
+    elif action == 'take_cards':
+        if player_id != table.players[table.get_next_turn()].get_id(): # validate if user is defender
+            raise ValueError("Only defender can take cards")
+
+        table.defender_take_cards()
+        return {'type': 'defender_take_cards'}
+
+    elif action == 'finished':
+        table.player_finished(player_id)
+        return {'type': 'finished', 'player_id': player_id}
+
+    elif action == 'remove_player': # not sent by clients, used when player didn't reconnect
+        table.remove_player(player_id)
+        return {'type': 'player_removed', 'player_id': player_id}
+
+    raise ValueError(f"Unknown action: {action}")
+
+
+# moves given player can make now (sent with every update, so client doesn't send moves engine would reject)
+def legal_moves(table: EngineTable.Table, player_id: str) -> dict:
+    moves = {
+        'attacks': [],
+        'throws': [str(c) for c in table.legal_throws(player_id)],
+        'defenses': {}, # bottom card => cards which can beat it
+        'can_take': False,
+    }
+    if len(table.players) < 2:
+        return moves
+
+    if table.players[table.get_turn()].get_id() == player_id:
+        moves['attacks'] = [str(c) for c in table.legal_attacks()]
+    elif table.players[table.get_next_turn()].get_id() == player_id:
+        moves['defenses'] = {str(b): [str(c) for c in table.legal_defenses(b)] for b, t in table.attack_state.items() if t is None}
+        moves['can_take'] = table.can_take()
+
+    return moves
+
+
+def move_to_action(move: tuple) -> dict: # engine move (see Table.legal_moves) as websocket action (e.g. to submit move of a bot)
+    action = move[0]
+    if action == 'play_turn':
+        return {'action': action, 'card': str(EngineCard.Card.from_id(move[1]))}
+    elif action == 'defend':
+        return {'action': action, 'bottom_card': str(EngineCard.Card.from_id(move[1])), 'top_card': str(EngineCard.Card.from_id(move[2]))}
+    elif action == 'throw_additional':
+        return {'action': action, 'card': str(EngineCard.Card.from_id(move[2]))}
+
+    return {'action': action} # take_cards and finished
+
+
+RELOAD = {'action': 'reload'} # internal queue message: saved state was changed by someone else, reload it
+
+
+# the only owner of the live game table of one room. Consumers of every player in the room put actions into the queue
+# and the actor applies them one-by-one, so moves made at the same moment can't overwrite each other
+class GameActor:
+    def __init__(self, room_id):
+        self.room_id = room_id
+        self.table: (EngineTable.Table | None) = None
+        self.channel_layer = get_channel_layer()
+        self.queue: asyncio.Queue = asyncio.Queue() # (player id, action data, future to resolve or None)
+        self.ready = asyncio.Event() # set when table is loaded from database
+        self.consumers_count = 0 # consumers using the actor (actor stops when it reaches zero)
+        self.task: (asyncio.Task | None) = None
+
+        self.version = 0 # number of moves applied to the table (doubles as sequence number of updates sent to players)
+        self.saved_version = 0 # version of the state stored in database
+        self.snapshot_version = 0 # version of the latest full state stored in database
+        self.unsaved_events: list = [] # moves (see engine.Table.apply_event) made after saved_version, replayed on fresh state after conflict
+        self.conflicted = False # database has other state than saved_version (e.g. written by another process)
+
+        self.last_public_state: (dict | None) = None # state players have seen (to send only changes of the next move)
+        self.last_hand_masks: dict = {} # player id => hand (bitset) player has seen
+
+        self.bot_ids: set[str] = set() # seats played by bots (see durak.bots)
+        self.bot_task: (asyncio.Task | None) = None # search of the move of a bot
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        previous = stopping_actors.get(self.room_id)
+        if previous is not None: # let previous actor of this room write its last state before reading it
+            try:
+                await asyncio.shield(previous.task)
+            except Exception: # its state is read as it was stored
+                logger.exception("Previous actor of room %s failed", self.room_id)
+
+        try:
+            started = metrics.start()
+            room, table = await database_sync_to_async(load_room)(self.room_id) # database is read only once for the whole game
+            metrics.observe('db_refresh', 'load', started)
+            if table is not None:
+                self.set_table(room, table)
+                self.remember_sent_state()
+                self.schedule_bot()
+        except Exception: # consumers see no table and close, the next connection starts new actor
+            logger.exception("Loading room %s failed", self.room_id)
+            self.table = None
+        self.ready.set()
+
+        if self.table is None: # room was deleted or game didn't start, nothing to manage
+            if actors.get(self.room_id) is self:
+                actors.pop(self.room_id)
+            return
+
+        while True:
+            player_id, data, future = await self.queue.get()
+            if data is None: # stop signal
+                break
+
+            try:
+                if data is RELOAD:
+                    await self.reload()
+                else:
+                    await self.handle(player_id, data, future)
+            except Exception as e: # e.g. database is locked, the actor keeps serving the room
+                logger.exception("Action %s of player %s in room %s failed", data, player_id, self.room_id)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            self.schedule_bot()
+
+        if self.bot_task is not None:
+            self.bot_task.cancel()
+        try:
+            await self.flush(snapshot=True)
+            while self.conflicted: # last state has to be written on top of the fresh one
+                await self.reload()
+                await self.flush(snapshot=True)
+        except Exception:
+            logger.exception("Last state of room %s wasn't written", self.room_id)
+        finally:
+            if stopping_actors.get(self.room_id) is self:
+                stopping_actors.pop(self.room_id)
+
+    async def handle(self, player_id: str, data: dict, future: (asyncio.Future | None)):
+        if data.get('bot_version', self.version) != self.version: # bot searched state which was changed meanwhile
+            return
+
+        if data['action'] == 'leave': # not sent by clients, player didn't reconnect
+            if bots.enabled() and self.table.search_player(player_id) is not None and not self.is_finished(): # bot plays instead of him
+                await database_sync_to_async(save_bot_ids)(self.room_id, self.bot_ids | {player_id})
+                self.bot_ids.add(player_id) # only after it's stored
+                future.set_result({'type': 'bot_took_seat', 'player_id': player_id})
+                return
+            data = {'action': 'remove_player'}
+
+        await self.apply(player_id, data, future)
+
+    async def apply(self, player_id: str, data: dict, future: (asyncio.Future | None)): # apply action and send it to players
+        action = data['action']
+        with profiler.profile(f'game_{action}'): # only the synchronous part (other tasks run during awaits)
+            try:
+                started = metrics.start()
+                last_action = apply_action(self.table, player_id, data)
+                metrics.observe('engine_apply', action, started)
+            except Exception as e: # if some error in validation occurred
+                error = e
+            else:
+                error = None
+                self.version += 1 # engine put the move into unsaved_events
+                public_state, messages = self.encode_changes(last_action, action)
+
+        if error is not None:
+            metrics.count(metrics.player_mistakes, (action,))
+            if future is not None:
+                future.set_exception(error)
+            else: # state didn't change, so only the message is sent
+                await self.channel_layer.group_send(f'player_{player_id}', {
+                    'type': 'player_mistake',
+                    "player_id": player_id,
+                    'message': str(error)
+                })
+            return
+
+        # players get updates right after engine accepted the move, database write goes in background
+        await self.send_all_changes(public_state, messages, action)
+        started = metrics.start()
+        self.save()
+        if self.is_finished(): # result of the game is written immediately
+            await self.flush(snapshot=True)
+        metrics.observe('save', action, started)
+
+        if future is not None:
+            future.set_result(last_action)
+
+    def seat_ids(self) -> list[str]: # everyone who watches the game (including winners)
+        return [p.get_id() for p in self.table.players + self.table.winners]
+
+    def is_empty(self) -> bool: # everyone left game (only bots are playing)
+        return all(player_id in self.bot_ids for player_id in self.seat_ids())
+
+    def is_finished(self) -> bool: # only durak (or nobody) left
+        return len(self.table.players) <= 1
+
+    # build game_state message for the player. The state without hands is the same for everyone, so it's encoded once
+    # by the caller and only player's own hand and moves are added here (client puts hand into its entry of state.players)
+    def encode_state(self, player, public_state: str, last_action: str = 'null') -> str:
+        return (
+            f'{{"type": "game_state", "player_id": {json.dumps(player.get_id())}, "seq": {self.version}, '
+            f'"last_action": {last_action}, "hand": {json.dumps([str(c) for c in player.get_hand()])}, '
+            f'"legal": {json.dumps(legal_moves(self.table, player.get_id()))}, "state": {public_state}}}'
+        )
+
+    def encode_player_state(self, player_id: str) -> (str | None): # full state for one player (e.g. on connect)
+        player = self.table.search_player(player_id) or self.table.search_winner(player_id)
+        if player is None:
+            return None
+
+        return self.encode_state(player, json.dumps(self.table.to_publicjson()))
+
+    def remember_sent_state(self, public_state: (dict | None) = None): # state every player has got now
+        self.last_public_state = public_state if public_state is not None else self.table.to_publicjson()
+        self.last_hand_masks = {p.get_id(): p.get_hand_mask() for p in self.table.players + self.table.winners}
+
+    # encode only changes made by the last move for everyone in the room, every update has sequence number (seq),
+    # so client can detect missed update and ask for full state (see GameConsumer.receive).
+    # Returns public state and group of the player => already encoded json
+    def encode_changes(self, last_action: dict, action: str = '') -> tuple[dict, dict]: # action is the type of player's action (for metrics)
+        started = metrics.start()
+        public_state = self.table.to_publicjson()
+        changes = json.dumps(diff_public_state(self.last_public_state, public_state)) # the same for every player, encoded once
+        last_action = json.dumps(last_action)
+
+        messages = {} # group of the player => already encoded json
+        for player in self.table.players + self.table.winners: # sends own hand changes to users one-by-one to avoid sensitive data leak
+            hand = diff_hand(self.last_hand_masks.get(player.get_id(), 0), player)
+            messages[f'player_{player.get_id()}'] = (
+                f'{{"type": "state_delta", "player_id": {json.dumps(player.get_id())}, "seq": {self.version}, '
+                f'"last_action": {last_action}, "hand": {json.dumps(hand)}, '
+                f'"legal": {json.dumps(legal_moves(self.table, player.get_id()))}, "changes": {changes}}}'
+            )
+        metrics.observe('serialization', action, started)
+        return public_state, messages
+
+    async def send_all_changes(self, public_state: dict, messages: dict, action: str = ''): # send messages of encode_changes
+        started = metrics.start()
+        for group, text in messages.items():
+            await self.channel_layer.group_send(group, {'type': 'encoded_message', 'text': text})
+        metrics.observe('group_send', action, started)
+
+        self.remember_sent_state(public_state)
+
+    # send full table state to everyone in the room
+    async def send_all_state(self, last_action: dict):
+        public_state = self.table.to_publicjson()
+        self.remember_sent_state(public_state)
+        public_state = json.dumps(public_state)
+        last_action = json.dumps(last_action)
+
+        for player in self.table.players + self.table.winners: # sends state to users one-by-one to avoid sensitive data leak to other players
+            await self.channel_layer.group_send(
+                f'player_{player.get_id()}',
+                {
+                    'type': 'encoded_message',
+                    'text': self.encode_state(player, public_state, last_action), # already encoded json
+                }
+            )
+
+    def save(self): # mark state as changed, writer saves it later together with other moves and rooms
+        if self.is_empty(): # room is deleted together with the last player
+            writer.discard(self.room_id)
+        else:
+            writer.mark_dirty(self)
+
+    async def flush(self, snapshot=False): # write state of this room right now
+        await writer.flush([self.room_id], snapshot)
+
+    def set_table(self, room: Room, table: EngineTable.Table): # start managing table loaded from database
+        self.table = table
+        self.table.event_listener = self.unsaved_events.append # every accepted move is recorded for the moves log
+        self.version = self.saved_version = room.version
+        self.snapshot_version = room.snapshot_version
+        self.bot_ids = set(room.bot_ids)
+
+    def saved(self, version: int, events_count: int, with_snapshot: bool): # writer stored moves up to given version
+        self.saved_version = version
+        if with_snapshot:
+            self.snapshot_version = version
+        del self.unsaved_events[:events_count]
+
+    def conflict(self): # writer couldn't store state, because stored version is not saved_version anymore
+        if not self.conflicted:
+            self.conflicted = True
+            self.queue.put_nowait((None, RELOAD, None))
+
+    async def reload(self): # get fresh state from database and replay moves that weren't saved on top of it
+        if not self.conflicted:
+            return
+        self.conflicted = False
+
+        started = metrics.start()
+        room, table = await database_sync_to_async(load_room)(self.room_id)
+        metrics.observe('db_refresh', 'reload', started)
+        if table is None: # room was deleted meanwhile
+            self.unsaved_events.clear()
+            return
+
+        events, self.unsaved_events = self.unsaved_events, []
+        self.set_table(room, table)
+        for event in events:
+            try:
+                self.table.apply_event(event) # successful move is recorded again
+            except Exception: # move is not valid in fresh state anymore, drop it
+                pass
+        self.version += len(self.unsaved_events)
+
+        await self.send_all_state({'type': 'reload'}) # players could see moves that were dropped
+        self.save()
+
+    def schedule_bot(self): # start searching the move if it's decision of a bot
+        if self.bot_task is not None or not self.bot_ids or self.table is None or self.is_empty():
+            return
+
+        player_id, moves = self.table.legal_moves()
+        if player_id in self.bot_ids:
+            self.bot_task = asyncio.create_task(self.play_bot(player_id, self.version))
+
+    async def play_bot(self, player_id: str, version: int):
+        try:
+            move = await bots.choose_move(self.table, player_id) if self.version == version else None
+        finally:
+            self.bot_task = None
+
+        if move is None: # table changed before search started
+            self.schedule_bot()
+        else: # applied in order with moves of players
+            self.submit(player_id, {**move_to_action(move), 'bot_version': version})
+
+    def submit(self, player_id: str, data: dict): # put action into queue without waiting for the result
+        self.queue.put_nowait((player_id, data, None))
+
+    async def call(self, player_id: str, data: dict) -> dict: # put action into queue and wait until it's applied
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((player_id, data, future))
+        return await future
+
+    def attach(self):
+        self.consumers_count += 1
+
+    def detach(self): # stop actor when nobody uses it anymore
+        self.consumers_count -= 1
+        if self.consumers_count <= 0 and actors.get(self.room_id) is self:
+            actors.pop(self.room_id)
+            stopping_actors[self.room_id] = self
+            self.queue.put_nowait((None, None, None))
+
+
+def save_bot_ids(room_id, bot_ids: set):
+    Room.objects.filter(id=room_id).update(bot_ids=sorted(bot_ids))
+
+
+def load_room(room_id) -> tuple: # get room and its table (None if room doesn't exist or game didn't start)
+    room = Room.objects.filter(id=room_id).first()
+    if room is None or not room.has_table():
+        return room, None
+
+    return room, room.load_table()
+
+
+actors: dict = {} # room id => running actor
+stopping_actors: dict = {} # room id => actor writing its last state
+metrics.register(Gauge('durak_active_rooms', "Rooms with a running game actor", lambda: len(actors)))
+
+
+def get_actor(room_id) -> GameActor: # get actor of the room (starting it if needed) and mark it as used
+    actor = actors.get(room_id)
+    if actor is None:
+        actor = GameActor(room_id)
+        actors[room_id] = actor
+        actor.start()
+
+    actor.attach()
+    return actor
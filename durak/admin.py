@@ -5,4 +5,5 @@ from .models import *
 # Register your models here.
 admin.site.register(AnonymousUser)
 admin.site.register(Player)
-admin.site.register(Room)
\ No newline at end of file
+admin.site.register(Room)
+admin.site.register(GameEvent)
\ No newline at end of file
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+import engine.Table as EngineTable
+import engine.ismcts as EngineSearch
+import engine.endgame as EngineEndgame
+import engine.sim as EngineSim
+
+logger = logging.getLogger(__name__)
+
+
+# server side players taking seats of players who left (see GameActor.handle). Moves are chosen by information set MCTS
+# (engine.ismcts) in a pool of processes, so the event loop never waits for the search. Every move is searched
+# by DURAK_BOT_SEARCH_WORKERS processes at once (each one with its own tree, visits of root moves are summed),
+# so playouts per second grow with them, and every search stops at the same deadline.
+# When the deck is empty in 2 player game, the exact endgame solver (engine.endgame) gets the first half of the time
+class BotPool:
+    def __init__(self):
+        self.executor: (ProcessPoolExecutor | None) = None
+        self.rng = random.Random()
+
+    @staticmethod
+    def enabled() -> bool: # bots take seats of players who left (otherwise players are removed from the game)
+        return getattr(settings, 'DURAK_BOTS', True)
+
+    @staticmethod
+    def move_time() -> float: # seconds bot thinks about one move
+        return getattr(settings, 'DURAK_BOT_MOVE_TIME', 1.0)
+
+    @staticmethod
+    def search_workers() -> int: # processes searching one move together
+        return getattr(settings, 'DURAK_BOT_SEARCH_WORKERS', 2)
+
+    @staticmethod
+    def max_playouts() -> (int | None): # playouts of one move (summed over workers) after which search stops before deadline
+        return getattr(settings, 'DURAK_BOT_MAX_PLAYOUTS', None)
+
+    @staticmethod
+    def rollout() -> str: # policy of moves after the tree (see engine.sim.POLICIES)
+        return getattr(settings, 'DURAK_BOT_ROLLOUT', 'greedy')
+
+    @staticmethod
+    def endgame_entries() -> int: # size of transposition table of endgame solver (in every process)
+        return getattr(settings, 'DURAK_BOT_ENDGAME_ENTRIES', 200_000)
+
+    def get_executor(self) -> ProcessPoolExecutor: # started with the first bot move
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=getattr(settings, 'DURAK_BOT_PROCESSES', None))
+        return self.executor
+
+    async def choose_move(self, table: EngineTable.Table, player_id: str) -> tuple: # move (see Table.apply_event) for the player whose decision it is
+        state = table.to_bytes() # table can change while search is running
+        deadline = time.time() + self.move_time()
+        workers = self.search_workers()
+        max_playouts = self.max_playouts()
+        if max_playouts is not None:
+            max_playouts = max(1, max_playouts // workers)
+
+        loop = asyncio.get_running_loop()
+        visits = {}
+        try:
+            if EngineEndgame.is_perfect_information(table):
+                move = await loop.run_in_executor(
+                    self.get_executor(), EngineEndgame.solve_move, state, player_id, deadline - self.move_time() / 2, self.endgame_entries()
+                )
+                if move is not None:
+                    return move
+
+            results = await asyncio.gather(*(
+                loop.run_in_executor(self.get_executor(), EngineSearch.search, state, player_id, deadline, max_playouts, self.rng.random(), self.rollout())
+                for _ in range(workers)
+            ))
+            for worker_visits, _ in results:
+                for move, count in worker_visits.items():
+                    visits[move] = visits.get(move, 0) + count
+        except BrokenProcessPool: # worker was killed, next move starts new pool
+            self.executor = None
+        except Exception: # search failed, the bot still moves (greedy, see below)
+            logger.exception("Search of move of %s failed", player_id)
+            visits = {}
+
+        move = EngineSearch.best_move(visits)
+        if move is None: # pool was too busy to make even one playout in time (or failed)
+            table = EngineTable.Table.from_bytes(state)
+            move = EngineSim.greedy_policy(table, player_id, table.legal_moves()[1], self.rng)
+
+        return move
+
+
+bots = BotPool()
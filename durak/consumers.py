@@ -1,80 +1,110 @@
 import json
-import asyncio
 
-from asgiref.sync import async_to_sync, sync_to_async
-from channels.generic.websocket import WebsocketConsumer, AsyncWebsocketConsumer
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
 from .models import Player
-
-import engine.Table as EngineTable
-import engine.Card as EngineCard
-
-# waiting room for players waiting until is full and game started
-class WaitingRoomConsumer(WebsocketConsumer):
+from .actors import get_actor
+from .metrics import metrics
+from .profiling import profiler
+from .presence import presence
+from .matchmaking import matchmaker, start_room
+
+# waiting room for players waiting until is full and game started. Players connected to every waiting room are counted
+# in memory (see Matchmaker.enter), so joins and leaves don't read the roster and the room starts exactly once
+class WaitingRoomConsumer(AsyncWebsocketConsumer):
     def __init__(self, *args, **kwargs): # define all later used fields
         super().__init__(args, kwargs)
         self.player = None
+        self.player_id = None
         self.room_id = None
         self.room_group_name = None
         self.room = None
-        self.players = None
-        
-    def connect(self):
+
+    async def connect(self):
         self.player = self.scope['user'] # get player data (see middleware.PlayerAuthMiddleware)
+        self.player_id = str(self.player.id)
         # extract related to player data for later use
         self.room = self.player.room
         self.room_id = self.room.id
-        self.room_group_name = f'waiting_room_{self.room_id}'
-        self.players = Player.objects.filter(room=self.room).all()
 
-        if self.room.max_players_count < len(self.players): # in case something go wrong and more users than possible connected
-            self.close(3003) # close connection
+        if not self.room.is_waiting or self.room_id in matchmaker.filled: # game of this room already started (e.g. page opened late)
+            await self.accept()
+            await self.start_game({'type': 'start_game', 'redirect_url': '/durak/'}) # only this socket goes to the game
             return
 
-        self.accept() # accept connection
+        self.room_group_name = f'waiting_room_{self.room_id}'
+        await self.accept() # accept connection
+        metrics.count(metrics.connects, ('waiting_room',))
 
-        async_to_sync(self.channel_layer.group_add)(
+        await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        
-        if self.room.max_players_count == len(self.players): #room is full, start the game            
-            self.room.is_waiting = False
-            self.room.save()
-            
-            async_to_sync(self.channel_layer.group_send)( # signal to start game (js should redirect user)
-                self.room_group_name,
-                {
-                    'type': 'start_game',
-                    'redirect_url': '/durak/'
-                }
-            )
-            
+
+        connected_count = matchmaker.enter(self.room_id, self.player_id)
+        if connected_count == self.room.max_players_count: # room is full, start the game (only the last player gets here)
+            matchmaker.start(self.room_id)
+            await self.deal()
+
         else:
-            async_to_sync(self.channel_layer.group_send)( # update the number of users waiting
-                self.room_group_name,
-                {
-                    'type': 'players_count',
-                    'connected_users_count': len(self.players)
-                }
-            )
-
-    def start_game(self, event):
-        self.send(text_data=json.dumps(event))
-    def players_count(self, event):
-        self.send(text_data=json.dumps(event))
-        
-    def disconnect(self, close_code):
-        async_to_sync(self.channel_layer.group_discard)(
+            matchmaker.wait_for_players(self.room_id, self.deal_with_bots) # bots take free seats if nobody comes in time
+            await self.send_players_count(connected_count)
+
+    async def deal(self, with_bots: bool = False):
+        await database_sync_to_async(start_room)(self.room_id, with_bots) # table is dealt before anyone opens the game page
+
+        await self.channel_layer.group_send( # signal to start game (js should redirect user)
+            self.room_group_name,
+            {
+                'type': 'start_game',
+                'redirect_url': '/durak/'
+            }
+        )
+
+    async def deal_with_bots(self):
+        await self.deal(with_bots=True)
+
+    async def send_players_count(self, connected_count: int): # update the number of users waiting
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'players_count',
+                'connected_users_count': connected_count
+            }
+        )
+
+    async def start_game(self, event):
+        await self.send(text_data=json.dumps(event))
+    async def players_count(self, event):
+        await self.send(text_data=json.dumps(event))
+
+    async def disconnect(self, close_code):
+        if self.room_group_name is None: # socket didn't enter the waiting room (its game had started), player stays in the game
+            return
+
+        metrics.count(metrics.disconnects, ('waiting_room',))
+        await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
 
         if close_code != 1000: # if something go wrong and connection is closing not because game is starting, then delete player with related data
-            self.player.delete()
+            # seat is given up before awaiting, so a player entering meanwhile doesn't count him (and fill the room with him)
+            connected_count = None
+            if matchmaker.is_waiting(self.room_id): # game didn't start, next player of the lobby gets his seat
+                connected_count = matchmaker.exit(self.room_id, self.player_id)
+                matchmaker.leave(self.room.max_players_count, self.room_id)
+
+            await database_sync_to_async(self.player.delete)()
+            if connected_count is not None:
+                await self.send_players_count(connected_count)
 
 
 # game consumer managing everything in game
 class GameConsumer(AsyncWebsocketConsumer):
+    client_actions = ('play_turn', 'throw_additional', 'defend', 'take_cards', 'finished') # actions players are allowed to send
+
     def __init__(self, *args, **kwargs): # define all later used fields
         super().__init__(args, kwargs)
         self.player = None
@@ -82,8 +112,7 @@ class GameConsumer(AsyncWebsocketConsumer):
         self.room_id = None
         self.game_group_name = None
         self.room = None
-        self.players = None
-        self.table = None
+        self.actor = None
 
     async def connect(self):
         self.player = self.scope['user']  # get player data (see middleware.PlayerAuthMiddleware)
@@ -92,9 +121,14 @@ class GameConsumer(AsyncWebsocketConsumer):
         self.room = self.player.room
         self.room_id = self.room.id
         self.game_group_name = f'game_{self.room_id}'
-        self.players = await sync_to_async(Player.objects.filter(room=self.room).all)()
 
-        self.table = EngineTable.Table.from_json(self.room.game_state) # get initial state of the game
+        self.actor = get_actor(self.room_id) # the live table of the room is shared by every player's consumer
+        await self.actor.ready.wait()
+        if self.actor.table is None: # game is not started or room doesn't exist anymore
+            self.actor.detach()
+            self.actor = None
+            await self.close()
+            return
 
         # add to group and accent connection
         await self.channel_layer.group_add(
@@ -107,18 +141,19 @@ class GameConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         await self.accept()
-
-        self.player.is_connected = True # marks that user has established connection with game socket
-        await sync_to_async(self.player.save)()
+        metrics.count(metrics.connects, ('game',))
+        presence.connected(self.player_id) # if player came back in time, his previous connection stops waiting
 
         # send initial state of game
-        await self.send(text_data=json.dumps({
-            'type': 'game_state',
-            "state": self.table.to_safejson(self.player_id),
-            "player_id": self.player_id
-        }))
+        state = self.actor.encode_player_state(self.player_id)
+        if state is not None:
+            await self.send(text_data=state)
 
     async def disconnect(self, close_code):
+        if self.actor is None: # connection wasn't accepted
+            return
+        metrics.count(metrics.disconnects, ('game',))
+
         # disconnect from groups
         await self.channel_layer.group_discard(
             self.game_group_name,
@@ -129,96 +164,47 @@ class GameConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-        self.player.is_connected = False # marks that user is not connected to game socket
-        await sync_to_async(self.player.save)()
-
-        # Start background task to check if user reconnects
-        asyncio.create_task(self.wait_until_reconnect(5))
+        # player is removed unless he reconnects in time (new consumer takes over the actor then)
+        presence.disconnected(self.player_id, self.remove_player, self.actor.detach)
 
-    async def wait_until_reconnect(self, time_to_reconnect):
-        for _ in range(time_to_reconnect):
-            await asyncio.sleep(1)
-
-            await sync_to_async(self.player.refresh_from_db)() # refresh data from database about connection
-            is_connected = self.player.is_connected
-
-            if is_connected: # if player reconnects, stop task
-                return
-
-        # player wants to left room, remove him
-        self.table.remove_player(self.player_id)
+    async def remove_player(self): # player didn't reconnect in time
+        # player wants to left room, bot takes his seat (or he is removed if he isn't playing anymore)
+        metrics.count(metrics.reconnect_timeouts)
+        presence.forget(self.player_id)
+        try:
+            await self.actor.call(self.player_id, {'action': 'leave'})
+        except ValueError: # player was already removed
+            pass
         await sync_to_async(self.player.delete, thread_sensitive=True)() #delete player from database
 
-        if len(self.table.players) == 0 and len(self.table.winners) == 0: # everyone left game
+        if self.actor.is_empty(): # everyone left game
             await sync_to_async(self.room.delete, thread_sensitive=True)() # delete room
-        else:
-            await self.save_and_send_all_state({'type': 'player_removed', 'player_id': self.player_id})
 
-    async def receive(self, text_data = None, **kwargs):
-        await sync_to_async(self.room.refresh_from_db, thread_sensitive=True)() # reload latest state from the database
-        self.table = EngineTable.Table.from_json(self.room.game_state)  # get updates from database
+        self.actor.detach()
 
+    async def receive(self, text_data = None, **kwargs):
         data = json.loads(text_data)
-        action = data['action']
-
-        try:
-            if action == 'play_turn':
-                card_name = data['card']
-
-                self.table.play_turn(EngineCard.Card.from_string(card_name)) # make move in engine side
-                await self.save_and_send_all_state({'type': 'play_turn'}) # send updates to front end
-
-            elif action == 'throw_additional':
-                card_name = data['card']
-
-                self.table.throw_additional(self.player_id, EngineCard.Card.from_string(card_name)) # call engine method to throw additional card
-                await self.save_and_send_all_state({'type': 'throw_additional', 'player_id': self.player_id}) # mark what action was made and by who
 
-            elif action == 'defend':
-                bottom_card = data['bottom_card']
-                defender_card = data['top_card']
+        if data.get('action') == 'resync': # client missed some update (gap in seq), send full state
+            with profiler.profile('game_resync'):
+                state = self.actor.encode_player_state(self.player_id)
+            if state is not None:
+                await self.send(text_data=state)
+            return
 
-                self.table.defend(EngineCard.Card.from_string(bottom_card), EngineCard.Card.from_string(defender_card))  # call engine method to defend bottom card
-                await self.save_and_send_all_state({'type': 'defend', 'player_id': self.player_id}) # save
-            elif action == 'take_cards':
-                if self.player_id != self.table.players[self.table.get_next_turn()].get_id(): # validate if user is defender
-                    raise ValueError("Only defender can take cards")
+        if data.get('action') not in self.client_actions:
+            metrics.count(metrics.player_mistakes, ('unknown',))
+            await self.player_mistake({
+                'type': 'player_mistake',
+                "player_id": self.player_id,
+                'message': "Unknown action"
+            })
+            return
 
-                self.table.defender_take_cards()
-                await self.save_and_send_all_state({'type': 'defender_take_cards'})  # save
-            elif action == 'finished':
-                self.table.player_finished(self.player_id)
-                await self.save_and_send_all_state({'type': 'finished', 'player_id': self.player_id})  # save
+        self.actor.submit(self.player_id, data) # actor applies actions of every player in the room in order and sends updates
 
-        except Exception as e: # if some error in validation occurred
-            msg = str(e)
+    async def encoded_message(self, event): # message already encoded to json by the actor
+        await self.send(text_data=event['text'])
 
-            await self.send(text_data=json.dumps({
-                'type': 'player_mistake',
-                "state": self.table.to_safejson(self.player_id),
-                "player_id": self.player_id,
-                'message': msg
-            }))
-
-
-    # save and send table state to everyone in group
-    async def save_and_send_all_state(self, last_action):
-        self.room.game_state = self.table.to_json()
-        await sync_to_async(self.room.save, thread_sensitive=True)()
-
-        players = await sync_to_async(list, thread_sensitive=True)(self.players)
-        for p in self.players: # sends state to users one-by-one to avoid sensitive data leak to other players
-            player_group_name = f'player_{p.id}'
-
-            await self.channel_layer.group_send(
-                player_group_name,
-                {
-                    'type': 'game_state',
-                    "state": self.table.to_safejson(str(p.id)),
-                    "player_id": str(p.id), # current player
-                    'last_action': last_action # action made by some player
-                }
-            )
-
-    async def game_state(self, event):
-        await self.send(text_data=json.dumps(event))
\ No newline at end of file
+    async def player_mistake(self, event): # action of this player was rejected by engine
+        await self.send(text_data=json.dumps(event))
@@ -0,0 +1,55 @@
+import engine.Card as EngineCard
+
+# fields of Table.to_publicjson that are sent whole when changed (they are small)
+PLAIN_FIELDS = ('attacks_number', 'turn', 'next_turn', 'refill_players_order', 'defender_hand_starting_len', 'finished_player_ids', 'defender_takes')
+
+
+def diff_attack_state(old: list, new: list) -> (dict | None): # removed bottom cards and new/changed [bottom, top] pairs
+    old_pairs = dict(old)
+    new_pairs = dict(new)
+
+    removed = [bottom for bottom in old_pairs if bottom not in new_pairs]
+    changed = [[bottom, top] for bottom, top in new if old_pairs.get(bottom) != top]
+    if not removed and not changed:
+        return None
+
+    return {'removed': removed, 'set': changed}
+
+
+# difference between two results of Table.to_publicjson, only changed fields are included
+def diff_public_state(old: dict, new: dict) -> dict:
+    changes = {}
+
+    if old['deck'] != new['deck']:
+        changes['deck'] = new['deck']
+
+    attack_state = diff_attack_state(old['attack_state'], new['attack_state'])
+    if attack_state is not None:
+        changes['attack_state'] = attack_state
+
+    for field in ('players', 'winners'):
+        if [p['id'] for p in old[field]] != [p['id'] for p in new[field]]: # somebody won or left, list is sent whole
+            changes[field] = new[field]
+
+    if 'players' not in changes: # the same players, only number of cards in their hands changes
+        hand_lens = {new_p['id']: new_p['hand_len'] for old_p, new_p in zip(old['players'], new['players']) if old_p['hand_len'] != new_p['hand_len']}
+        if hand_lens:
+            changes['hand_lens'] = hand_lens
+
+    for field in PLAIN_FIELDS:
+        if old[field] != new[field]:
+            changes[field] = new[field]
+
+    return changes
+
+
+def diff_hand(old_mask: int, player) -> (dict | None): # cards added to and removed from hand since it was old_mask (see Player.get_hand_mask)
+    new_mask = player.get_hand_mask()
+    if old_mask == new_mask:
+        return None
+
+    added_mask = new_mask & ~old_mask
+    return {
+        'added': [str(c) for c in player.get_hand() if c.get_bit() & added_mask], # in hand order (new cards are at the end)
+        'removed': [str(c) for c in EngineCard.cards_in_mask(old_mask & ~new_mask)],
+    }
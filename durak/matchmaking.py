@@ -0,0 +1,148 @@
+import asyncio
+import collections
+import itertools
+import random
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Room, Player
+from .bots import bots
+import engine.Table as EngineTable
+import engine.Player as EnginePlayer
+
+PLAYERS_COUNTS = (2, 3, 4) # room sizes players can choose
+
+
+# assigns players of the lobby to waiting rooms without reading the database or taking locks. Every room size has
+# a seat counter (next() of itertools.count is atomic), seat n belongs to room n // size, so concurrent joins can't
+# race into the same seat or overfill a room. Ids of rooms are generated in memory DURAK_MATCHMAKING_BATCH at a time
+# and the batch is inserted with one query (insert is idempotent, so threads reaching a new batch together don't wait
+# for each other). Seats of players who left the waiting room are handed out again before new ones, so a waiting room
+# is kept even when its last player leaves (see Player.delete).
+# Room which doesn't fill in DURAK_WAITING_BOTS_TIMEOUT after its first player entered starts with bots on free seats,
+# its remaining seats are skipped by joins.
+# Queues are per process: rooms are filled only by joins of the same process (like the game actors)
+class Matchmaker:
+    def __init__(self):
+        self.seats = {size: itertools.count() for size in PLAYERS_COUNTS} # size => counter of seats handed out
+        self.vacated = {size: collections.deque() for size in PLAYERS_COUNTS} # size => ids of rooms with a free seat
+        self.batches: dict = {} # (size, batch number) => room ids
+        self.resolved: dict = {} # (size, batch number) => counter of seats whose room was looked up
+        self.created: set = set() # (size, batch number) of batches stored in database
+        self.occupancy: dict = {} # waiting room id => ids of players connected to it (used by event loop only)
+        self.fill_timers: dict = {} # waiting room id => timer handle of starting it with bots
+        self.filled: set = set() # ids of rooms started with bots whose seats can still be handed out
+        self.fills: set[asyncio.Task] = set() # running starts of rooms with bots (referenced until they end)
+
+    @staticmethod
+    def batch_size() -> int: # rooms created with one query
+        return getattr(settings, 'DURAK_MATCHMAKING_BATCH', 16)
+
+    @staticmethod
+    def fill_timeout() -> (float | None): # seconds the first player of a room waits for others before bots take free seats (None - forever)
+        return getattr(settings, 'DURAK_WAITING_BOTS_TIMEOUT', 30.0)
+
+    def join(self, size: int) -> uuid.UUID: # id of a waiting room with a seat for the player (room exists in database)
+        while True:
+            room_id = self.take_seat(size)
+            if room_id is not None:
+                return room_id
+
+    def take_seat(self, size: int) -> (uuid.UUID | None): # None if bots took the rest of the room
+        try:
+            room_id = self.vacated[size].popleft()
+            return room_id if room_id not in self.filled else None
+        except IndexError: # no seat was vacated
+            pass
+
+        room_number = next(self.seats[size]) // size
+        batch, offset = divmod(room_number, self.batch_size())
+        key = (size, batch)
+        room_ids = self.batches.setdefault(key, [uuid.uuid4() for _ in range(self.batch_size())]) # the first list wins
+        if key not in self.created:
+            Room.objects.bulk_create([Room(id=room_id, max_players_count=size, is_waiting=True) for room_id in room_ids], ignore_conflicts=True)
+            self.created.add(key)
+
+        room_id = room_ids[offset] if room_ids[offset] not in self.filled else None
+        if next(self.resolved.setdefault(key, itertools.count(1))) == size * len(room_ids): # nobody needs the batch anymore
+            del self.batches[key], self.resolved[key]
+            self.created.discard(key)
+            self.filled.difference_update(room_ids) # no seat of the batch is handed out anymore
+
+        return room_id
+
+    def leave(self, size: int, room_id: uuid.UUID): # player left room which is still waiting, his seat is free again
+        self.vacated[size].append(room_id)
+
+    def enter(self, room_id: uuid.UUID, player_id: str) -> int: # player connected to waiting room, returns players connected now
+        connected = self.occupancy.setdefault(room_id, set())
+        connected.add(player_id)
+        return len(connected)
+
+    def exit(self, room_id: uuid.UUID, player_id: str) -> int: # player left waiting room, returns players connected now
+        connected = self.occupancy[room_id]
+        connected.discard(player_id)
+        if not connected: # the next player entering the room waits the whole time again
+            self.cancel_fill(room_id)
+        return len(connected)
+
+    def is_waiting(self, room_id: uuid.UUID) -> bool: # somebody entered the room and its game didn't start yet
+        return room_id in self.occupancy
+
+    def start(self, room_id: uuid.UUID): # room is full, game starts (counting is over)
+        self.occupancy.pop(room_id, None)
+        self.cancel_fill(room_id)
+
+    # first player entered the room, fill (coroutine function) is called if the room doesn't fill in time
+    def wait_for_players(self, room_id: uuid.UUID, fill):
+        timeout = self.fill_timeout()
+        if timeout is None or not bots.enabled() or room_id in self.fill_timers:
+            return
+        self.fill_timers[room_id] = asyncio.get_running_loop().call_later(timeout, self.expire, room_id, fill)
+
+    def cancel_fill(self, room_id: uuid.UUID):
+        timer = self.fill_timers.pop(room_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    def expire(self, room_id: uuid.UUID, fill): # nobody else came in time, bots take free seats
+        self.fill_timers.pop(room_id, None)
+        self.filled.add(room_id)
+        for vacated in self.vacated.values():
+            while room_id in vacated: # seats of players who left aren't handed out either
+                vacated.remove(room_id)
+        self.start(room_id)
+
+        task = asyncio.create_task(fill())
+        self.fills.add(task)
+        task.add_done_callback(self.fills.discard)
+
+
+# deal the table of the room which just filled and store it together with the roster (read by the game page) in one
+# compare-and-swap update on the version (only rooms without table have version 0), returns False if the room was started already.
+# with_bots: free seats of the room are taken by bots (see durak.bots)
+@transaction.atomic
+def start_room(room_id: uuid.UUID, with_bots: bool = False) -> bool:
+    players = list(Player.objects.filter(room_id=room_id).select_related('user', 'anonymous_user'))
+    roster = [p.group() for p in players]
+    bot_ids = []
+    if with_bots:
+        size = Room.objects.values_list('max_players_count', flat=True).get(id=room_id)
+        bot_ids = [str(uuid.uuid4()) for _ in range(size - len(players))]
+        roster += [{'name': f'Bot {i + 1}', 'id': bot_id} for i, bot_id in enumerate(bot_ids)]
+
+    # deal is seeded, so the game can be reproduced from the seed and moves log
+    seed = random.SystemRandom().randrange(2 ** 63)
+    table = EngineTable.Table([EnginePlayer.Player(p['name'], p['id']) for p in roster], seed=seed)
+
+    room = Room(id=room_id, version=1) # the deal is the first version
+    room.store_table(table)
+    return Room.objects.filter(id=room_id, version=0).update(
+        is_waiting=False, roster=roster, game_state=room.game_state, game_state_bin=room.game_state_bin,
+        version=room.version, snapshot_version=room.snapshot_version, seed=seed, bot_ids=bot_ids
+    ) == 1
+
+
+matchmaker = Matchmaker()
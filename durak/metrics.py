@@ -0,0 +1,123 @@
+import bisect
+import time
+
+from django.conf import settings
+
+
+# metrics of the process in prometheus text format (see durak.views.export_metrics). Every process keeps its own values,
+# so with several workers each one has to be scraped. When DURAK_METRICS is off, timed code only calls start() (which
+# doesn't read the clock) and observe() of a stage that wasn't started returns right away
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5) # seconds
+
+
+def escape(value) -> str: # label value inside double quotes
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names: tuple, values: tuple) -> str: # {name="value",...} or empty string without labels
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values: dict = {} # label values => count
+
+    def inc(self, labels: tuple = (), amount: int = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [f'{self.name}{format_labels(self.labels, labels)} {value}' for labels, value in sorted(self.values.items())]
+
+
+class Gauge: # value is read from the function when metrics are exported
+    kind = 'gauge'
+
+    def __init__(self, name: str, description: str, function):
+        self.name = name
+        self.description = description
+        self.function = function
+
+    def samples(self) -> list[str]:
+        return [f'{self.name} {self.function()}']
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.values: dict = {} # label values => [observations per bucket (the last one is +Inf), sum]
+
+    def observe(self, value: float, labels: tuple = ()):
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self) -> list[str]:
+        lines = []
+        for labels, counts in sorted(self.values.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts): # buckets are cumulative in the text format
+                total += count
+                lines.append(f'{self.name}_bucket{format_labels(self.labels + ("le",), labels + (bound,))} {total}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, labels)} {counts[-1]}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, labels)} {total}')
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        self.registry: list = []
+
+        # time of every stage of handling one action, by action type (see GameActor.handle)
+        self.stage_seconds = self.register(Histogram(
+            'durak_stage_seconds', "Seconds spent in one stage (db_refresh, engine_apply, serialization, save, group_send) of an action",
+            ('stage', 'action'),
+        ))
+        self.db_write_seconds = self.register(Histogram('durak_db_write_seconds', "Seconds of one batched write of game states"))
+        self.connects = self.register(Counter('durak_connects_total', "Accepted websocket connections", ('socket',)))
+        self.disconnects = self.register(Counter('durak_disconnects_total', "Closed websocket connections", ('socket',)))
+        self.reconnect_timeouts = self.register(Counter('durak_reconnect_timeouts_total', "Players who didn't reconnect to the game in time"))
+        self.player_mistakes = self.register(Counter('durak_player_mistakes_total', "Actions rejected with player_mistake", ('action',)))
+
+    @staticmethod
+    def enabled() -> bool:
+        return getattr(settings, 'DURAK_METRICS', False)
+
+    def register(self, metric):
+        self.registry.append(metric)
+        return metric
+
+    def start(self) -> float: # start time of a stage (0 when metrics are off)
+        return time.perf_counter() if self.enabled() else 0.0
+
+    def observe(self, stage: str, action: str, started: float): # record stage which began at start()
+        if started:
+            self.stage_seconds.observe(time.perf_counter() - started, (stage, action))
+
+    def count(self, counter: Counter, labels: tuple = ()):
+        if self.enabled():
+            counter.inc(labels)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.registry:
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines += metric.samples()
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('durak', '0003_player_is_connected'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='game_state_bin',
+            field=models.BinaryField(blank=True, default=None, null=True),
+        ),
+    ]
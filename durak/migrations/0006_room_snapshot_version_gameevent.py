@@ -0,0 +1,37 @@
+# Generated by Django 5.1.5 on 2026-10-18 11:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def snapshot_current_states(apps, schema_editor): # states stored before moves log are snapshots of their versions
+    Room = apps.get_model('durak', 'Room')
+    Room.objects.update(snapshot_version=models.F('version'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('durak', '0005_room_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='snapshot_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(snapshot_current_states, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='GameEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveBigIntegerField()),
+                ('event', models.JSONField()),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='durak.room')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('room', 'seq'), name='unique_room_event_seq')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 12:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('durak', '0006_room_snapshot_version_gameevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='seed',
+            field=models.PositiveBigIntegerField(blank=True, default=None, null=True),
+        ),
+    ]
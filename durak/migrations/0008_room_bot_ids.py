@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('durak', '0007_room_seed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='bot_ids',
+            field=models.JSONField(default=list),
+        ),
+    ]
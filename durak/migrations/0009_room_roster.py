@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('durak', '0008_room_bot_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='roster',
+            field=models.JSONField(default=list),
+        ),
+    ]
@@ -4,6 +4,8 @@ import json
 from django.db import models
 from django.contrib.auth.models import User
 
+import engine.Table as EngineTable
+
 # Model for an anonymous user
 class AnonymousUser(models.Model):
     name = models.CharField(max_length=255)
@@ -15,7 +17,45 @@ class Room(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False) #uuid instead of integer to prevent random user joining the room
     max_players_count = models.IntegerField(default=2)
     is_waiting = models.BooleanField(default=True) # room waiting until it fulls and game starts
-    game_state = models.JSONField(default=dict)
+    game_state = models.JSONField(default=dict) # legacy json state (rooms created before binary state), see game_state_bin
+    game_state_bin = models.BinaryField(null=True, blank=True, default=None) # compact state (see engine.Table.to_bytes)
+    version = models.PositiveBigIntegerField(default=0) # number of moves made in the room, every write is compare-and-swap on it
+    snapshot_version = models.PositiveBigIntegerField(default=0) # version of stored state, later moves are in GameEvent
+    seed = models.PositiveBigIntegerField(null=True, blank=True, default=None) # seed of the deal, with moves log the whole game can be replayed (see engine.replay)
+    bot_ids = models.JSONField(default=list) # ids of players whose seats are played by bots (see durak.bots)
+    roster = models.JSONField(default=list) # players of the table in seat order (see Player.group), stored when room fills
+
+    def has_table(self) -> bool: # is game table already created
+        return self.game_state_bin is not None or self.game_state != {}
+
+    def load_table(self) -> EngineTable.Table: # get table from the latest snapshot and replay moves made after it
+        if self.game_state_bin is not None:
+            table = EngineTable.Table.from_bytes(bytes(self.game_state_bin))
+        else: # fallback to json for old rows
+            table = EngineTable.Table.from_json(self.game_state)
+
+        events = self.events.filter(seq__gt=self.snapshot_version, seq__lte=self.version).order_by('seq').values_list('event', flat=True)
+        for event in events:
+            table.apply_event(event)
+
+        return table
+
+    def store_table(self, table: EngineTable.Table): # set table state as snapshot of the current version (saving is left for the caller)
+        self.game_state_bin = table.to_bytes()
+        self.game_state = {} # binary state replaces json one
+        self.snapshot_version = self.version
+
+
+# one move made in the room (see engine.Table.apply_event), full state of the room is stored only every few moves
+class GameEvent(models.Model):
+    room = models.ForeignKey(Room, related_name='events', on_delete=models.CASCADE)
+    seq = models.PositiveBigIntegerField() # room version after the move
+    event = models.JSONField() # e.g. ["defend", 3, 12] (cards are ids, see engine.Card.get_id)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'seq'], name='unique_room_event_seq'),
+        ]
     
 # Model to represent a player (either authenticated or anonymous)
 class Player(models.Model):
@@ -38,8 +78,8 @@ class Player(models.Model):
         
     def delete(self, *args, **kwargs): # delete player with related data
         room_players = Player.objects.filter(room=self.room).all()
-        if len(room_players) <= 1: # in case room is empty
-            self.room.delete()
+        if len(room_players) <= 1: # in case room is empty (waiting room stays, matchmaker hands its seats out again)
+            Room.objects.filter(id=self.room_id, is_waiting=False).delete()
         
         if self.anonymous_user: # user don't have an account
             self.anonymous_user.delete()
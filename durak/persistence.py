@@ -0,0 +1,117 @@
+import asyncio
+import atexit
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+from channels.db import database_sync_to_async
+
+from .models import Room, GameEvent
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# write-behind storage of game states: actors only mark rooms as dirty after every move and the writer saves new moves
+# of every dirty room once per interval in one transaction, so database latency never delays the players.
+# Moves are appended to the moves log (GameEvent), full state is written only every DURAK_SNAPSHOT_EVERY moves.
+# Every write is compare-and-swap on Room.version, state changed meanwhile by someone else is reported back to the actor
+class GameStateWriter:
+    def __init__(self):
+        self.dirty: dict = {} # room id => actor (latest state is encoded right before writing)
+        self.lock = asyncio.Lock() # keeps writes in order (interval flush and forced flush can't overlap)
+        self.task: (asyncio.Task | None) = None
+
+    @staticmethod
+    def interval() -> float: # seconds between flushes
+        return getattr(settings, 'DURAK_PERSIST_INTERVAL', 1.0)
+
+    @staticmethod
+    def snapshot_every() -> int: # number of moves between full state snapshots
+        return getattr(settings, 'DURAK_SNAPSHOT_EVERY', 20)
+
+    def mark_dirty(self, actor):
+        self.dirty[actor.room_id] = actor # many moves between flushes are coalesced into one write
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def discard(self, room_id): # room is deleted, nothing to write
+        self.dirty.pop(room_id, None)
+
+    async def run(self):
+        while self.dirty:
+            await asyncio.sleep(self.interval())
+            await self.flush()
+
+    async def flush(self, room_ids=None, snapshot=False): # write dirty rooms (all or given ones) to database
+        async with self.lock:
+            states = self.take_states(room_ids, snapshot)
+            if not states:
+                return
+
+            started = metrics.start()
+            try:
+                conflicts = await database_sync_to_async(self.write)(states)
+            except Exception: # e.g. database is locked, rooms stay dirty and are written by the next flush
+                logger.exception("Writing %d rooms failed", len(states))
+                for actor, *_ in states.values():
+                    self.mark_dirty(actor)
+                return
+            if started:
+                metrics.db_write_seconds.observe(time.perf_counter() - started)
+
+        for room_id, (actor, state, saved_version, version, events) in states.items():
+            if room_id in conflicts:
+                actor.conflict()
+            else:
+                actor.saved(version, len(events), state is not None)
+
+    def take_states(self, room_ids=None, snapshot=False) -> dict: # collect and forget changes of dirty rooms
+        if room_ids is None:
+            room_ids = list(self.dirty.keys())
+
+        states = {} # room id => (actor, snapshot or None, expected version, new version, moves made after expected version)
+        for room_id in room_ids:
+            actor = self.dirty.pop(room_id, None)
+            if actor is None:
+                continue
+
+            state = None
+            if snapshot or actor.version - actor.snapshot_version >= self.snapshot_every():
+                state = actor.table.to_bytes()
+            states[room_id] = (actor, state, actor.saved_version, actor.version, list(actor.unsaved_events))
+
+        return states
+
+    @staticmethod
+    def write(states: dict) -> set: # update every room in one transaction, returns ids of rooms changed by someone else
+        conflicts = set()
+        events = []
+        with transaction.atomic():
+            for room_id, (actor, state, saved_version, version, room_events) in states.items():
+                fields = {'version': version}
+                if state is not None:
+                    fields.update(game_state_bin=state, game_state={}, snapshot_version=version)
+
+                if Room.objects.filter(id=room_id, version=saved_version).update(**fields) == 0:
+                    conflicts.add(room_id)
+                    continue
+
+                events += [
+                    GameEvent(room_id=room_id, seq=saved_version + i + 1, event=list(event)) for i, event in enumerate(room_events)
+                ]
+
+            GameEvent.objects.bulk_create(events) # moves of every room are appended with one query
+
+        return conflicts
+
+    def flush_on_exit(self): # process is shutting down, event loop is not running anymore (conflicts can't be replayed)
+        states = self.take_states(snapshot=True)
+        if states:
+            self.write(states)
+
+
+writer = GameStateWriter()
+atexit.register(writer.flush_on_exit)
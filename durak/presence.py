@@ -0,0 +1,98 @@
+import asyncio
+import atexit
+
+from django.conf import settings
+from channels.db import database_sync_to_async
+
+from .models import Player
+from .metrics import metrics, Gauge
+
+
+# connection state of players of this process. Disconnect starts a grace timer on the event loop, reconnect cancels
+# it directly (nothing is polled), so a network blip costs no database reads. Player.is_connected only mirrors
+# the registry: changes are coalesced and written with one bulk update per DURAK_PRESENCE_INTERVAL, so code asking
+# whether player is connected has to use is_connected() of the registry
+class PresenceRegistry:
+    def __init__(self):
+        self.connections: dict[str, bool] = {} # player id => connected to game socket
+        self.unsaved: dict[str, bool] = {} # player id => state not written to database yet
+        self.pending: dict = {} # player id => (timer handle, callback of cancelled removal)
+        self.removals: set[asyncio.Task] = set() # running removals (referenced until they end)
+        self.task: (asyncio.Task | None) = None
+
+    @staticmethod
+    def reconnect_timeout() -> float: # seconds player has to reconnect before bot takes his seat
+        return getattr(settings, 'DURAK_RECONNECT_TIMEOUT', 5.0)
+
+    @staticmethod
+    def interval() -> float: # seconds between writes of changed states
+        return getattr(settings, 'DURAK_PRESENCE_INTERVAL', 5.0)
+
+    def is_connected(self, player_id: str) -> bool:
+        return self.connections.get(player_id, False)
+
+    def connected(self, player_id: str) -> bool: # player opened game socket, True if he came back in time
+        self.set_connected(player_id, True)
+        return self.cancel(player_id)
+
+    # remove: coroutine function called when time is up, reconnected: function called when player came back in time
+    def disconnected(self, player_id: str, remove, reconnected):
+        self.cancel(player_id) # the previous connection (e.g. other tab) isn't waited for anymore
+        self.set_connected(player_id, False)
+        timer = asyncio.get_running_loop().call_later(self.reconnect_timeout(), self.expire, player_id, remove)
+        self.pending[player_id] = (timer, reconnected)
+
+    def forget(self, player_id: str): # player is deleted, nothing to track or write
+        self.connections.pop(player_id, None)
+        self.unsaved.pop(player_id, None)
+        self.cancel(player_id)
+
+    def cancel(self, player_id: str) -> bool: # cancel pending removal of the player, True if there was one
+        pending = self.pending.pop(player_id, None)
+        if pending is None:
+            return False
+
+        timer, reconnected = pending
+        timer.cancel()
+        reconnected()
+        return True
+
+    def expire(self, player_id: str, remove):
+        self.pending.pop(player_id, None)
+        task = asyncio.create_task(remove())
+        self.removals.add(task)
+        task.add_done_callback(self.removals.discard)
+
+    def pending_count(self) -> int: # disconnected players waiting to be removed
+        return len(self.pending)
+
+    def set_connected(self, player_id: str, connected: bool):
+        self.connections[player_id] = connected
+        self.unsaved[player_id] = connected # many changes between flushes are coalesced into one write
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while self.unsaved:
+            await asyncio.sleep(self.interval())
+            await self.flush()
+
+    async def flush(self): # write changed states right now
+        changes, self.unsaved = self.unsaved, {}
+        if changes:
+            await database_sync_to_async(self.write)(changes)
+
+    @staticmethod
+    def write(changes: dict): # one bulk update of is_connected (deleted players are skipped by database)
+        Player.objects.bulk_update([Player(id=player_id, is_connected=connected) for player_id, connected in changes.items()], ['is_connected'])
+
+    def flush_on_exit(self): # process is shutting down, event loop is not running anymore
+        changes, self.unsaved = self.unsaved, {}
+        if changes:
+            self.write(changes)
+
+
+presence = PresenceRegistry()
+atexit.register(presence.flush_on_exit)
+metrics.register(Gauge('durak_pending_removals', "Disconnected players waiting for reconnect", presence.pending_count))
@@ -0,0 +1,109 @@
+import atexit
+import cProfile
+import functools
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+# opt-in sampling profiler for live traffic: DURAK_PROFILE_RATE of the calls are run under cProfile and their stats are
+# aggregated by name (the action type). A background thread adds up the samples and writes the totals every
+# DURAK_PROFILE_INTERVAL seconds (and on exit) to DURAK_PROFILE_DIR/<name>.<pid>.prof, readable by pstats or snakeviz,
+# so the event loop never waits for the files. Only one call of the process is profiled at a time (since Python 3.12 cProfile
+# can't run in two threads at once), a call sampled meanwhile isn't profiled. Profiled code must not await: other tasks
+# would run under the profiler, so actors profile only the synchronous part of the action
+class SamplingProfiler:
+    def __init__(self):
+        self.stats: dict[str, pstats.Stats] = {} # name => stats of every sampled call
+        self.samples: list[tuple] = [] # (name, profile) of calls sampled since the last dump
+        self.lock = threading.Lock() # guards samples and stats
+        self.active = threading.Lock() # held while some call is profiled
+        self.rng = random.Random()
+        self.thread: (threading.Thread | None) = None
+
+    @staticmethod
+    def enabled() -> bool:
+        return getattr(settings, 'DURAK_PROFILE', False)
+
+    @staticmethod
+    def rate() -> float: # fraction of calls which are profiled
+        return getattr(settings, 'DURAK_PROFILE_RATE', 0.01)
+
+    @staticmethod
+    def interval() -> float: # seconds between writes of dumps
+        return getattr(settings, 'DURAK_PROFILE_INTERVAL', 60.0)
+
+    @staticmethod
+    def directory() -> str:
+        return getattr(settings, 'DURAK_PROFILE_DIR', 'profiles')
+
+    @contextmanager
+    def profile(self, name: str): # profile the body if this call is sampled
+        if not self.enabled() or self.rng.random() >= self.rate() or not self.active.acquire(blocking=False):
+            yield
+            return
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError: # other profiler (e.g. debugger) is running
+            self.active.release()
+            yield
+            return
+
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.active.release()
+            self.add(name, profile)
+
+    def profiled(self, name: str): # decorator profiling sampled calls of a function
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.profile(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add(self, name: str, profile: cProfile.Profile):
+        with self.lock:
+            self.samples.append((name, profile))
+            if self.thread is None: # started with the first sample
+                self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval())
+            self.dump()
+
+    def collect(self): # add samples to totals
+        with self.lock:
+            samples, self.samples = self.samples, []
+            for name, profile in samples:
+                stats = self.stats.get(name)
+                if stats is None:
+                    self.stats[name] = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+
+    def dump(self): # write totals since start of the process (files are overwritten)
+        self.collect()
+        with self.lock:
+            if not self.stats:
+                return
+
+            os.makedirs(self.directory(), exist_ok=True)
+            for name, stats in self.stats.items():
+                stats.dump_stats(os.path.join(self.directory(), f'{name}.{os.getpid()}.prof'))
+
+
+profiler = SamplingProfiler()
+atexit.register(profiler.dump)
@@ -146,12 +146,24 @@ function loadPage() {
 function throwCardOnPlayZone(cardName) { // returns false is putting should be canceled
     const isAttacker = (gameState.player_id === gameState.state.players[gameState.state.turn].id);
     if (isAttacker && gameState.state.attack_state.length === 0) { // if first move has to be made
+        if (!gameState.legal.attacks.includes(cardName)) { // server would reject it anyway (see legal_moves in actors.py)
+            popUp('You cannot play this card now', false);
+            rollBackDraggingCard();
+            return;
+        }
+
         // play turn
         gameSocket.send(JSON.stringify({ // send to backend
             'action': 'play_turn',
             'card': cardName
         }));
     } else {
+        if (!gameState.legal.throws.includes(cardName)) {
+            popUp('You cannot throw this card now', false);
+            rollBackDraggingCard();
+            return;
+        }
+
         // throw additional card
         gameSocket.send(JSON.stringify({
             'action': 'throw_additional',
@@ -175,6 +187,9 @@ function defendCard(bottomCard, topCard) {
         if (!hasUnbeatenCards) { // if there is nothing to defend
             popUp('No any way to put card as a defender', false); //send pop up (see scripts/popup_messages.js)
             rollBackDraggingCard();
+        } else if (!(gameState.legal.defenses[bottomCard] || []).includes(topCard)) { // card doesn't beat the bottom one
+            popUp('This card cannot beat that one', false);
+            rollBackDraggingCard();
         } else {
             // defence
 
@@ -358,39 +373,124 @@ function drawLeaveButton() {
     }
 }
 
+// put hand of the current player (sent separately) into his entry of the players list
+function putOwnHand(message) {
+    if (message.hand === undefined) return;
+
+    message.state.players.concat(message.state.winners).forEach(p => {
+        if (p.id === message.player_id) p.hand = message.hand;
+    })
+}
+
+// search entry of the current player in the state (players or winners)
+function findOwnEntry(state) {
+    return state.players.concat(state.winners).find(p => p.id === gameState.player_id);
+}
+
+const plainStateFields = ['attacks_number', 'turn', 'next_turn', 'refill_players_order', 'defender_hand_starting_len', 'finished_player_ids', 'defender_takes'];
+
+// apply changes made by one move (see durak/deltas.py) to the current state
+function applyChanges(state, message) {
+    const changes = message.changes;
+    const ownHand = findOwnEntry(state)?.hand ?? []; // players list can be replaced, keep hand
+
+    if (changes.deck) state.deck = changes.deck;
+
+    if (changes.attack_state) {
+        state.attack_state = state.attack_state.filter(slot => !changes.attack_state.removed.includes(slot[0])); // remove cards taken from table
+        changes.attack_state.set.forEach(pair => { // beat existing card or add new one
+            let slot = state.attack_state.find(s => s[0] === pair[0]);
+            if (slot) slot[1] = pair[1];
+            else state.attack_state.push(pair);
+        })
+    }
+
+    if (changes.players) state.players = changes.players;
+    if (changes.winners) state.winners = changes.winners;
+    if (changes.hand_lens) {
+        state.players.forEach(p => {
+            if (p.id in changes.hand_lens) p.hand_len = changes.hand_lens[p.id];
+        })
+    }
+
+    plainStateFields.forEach(field => {
+        if (field in changes) state[field] = changes[field];
+    })
+
+    let ownEntry = findOwnEntry(state);
+    if (ownEntry) {
+        ownEntry.hand = ownHand;
+        if (message.hand) { // cards added to and removed from hand
+            ownEntry.hand = ownHand.filter(c => !message.hand.removed.includes(c)).concat(message.hand.added);
+        }
+    }
+}
+
+// draw state of the game, if changes are given, only changed parts are redrawn
+function drawGameState(changes = null, handChanged = true) {
+    // remove dragging card on screen of user who put it on table
+    if (gameState?.last_action?.type === 'play_turn' && gameState.player_id === gameState.state.players[gameState.state.turn]?.id) rollBackDraggingCard();
+    if (gameState?.last_action?.type === 'throw_additional' && gameState.player_id === gameState?.last_action?.player_id) rollBackDraggingCard();
+    if (gameState?.last_action?.type === 'defend' && gameState.player_id === gameState?.last_action?.player_id) rollBackDraggingCard();
+    if (gameState?.last_action?.type === 'player_removed') { // remove player's hand
+        document.getElementById(playerContainers[gameState.last_action.player_id]).innerHTML = '';
+    }
+
+    if (!changes || changes.deck) drawDeck(gameState.state.deck); // draw deck
+
+    if (!changes || changes.players || changes.hand_lens || handChanged) {
+        gameState.state.players.forEach(p => { // draw each player's hand
+            drawHand(p);
+        })
+    }
+    if (!changes || changes.players || 'turn' in changes || 'next_turn' in changes) {
+        drawTurn(gameState.state.players, gameState.state.turn, gameState.state.next_turn); // add marks to attacker and defender names
+    }
+    if (!changes || changes.attack_state) drawPlayZoneContent(gameState.state.attack_state) // draw play zone
+    drawActionButton();
+    drawResults();
+    drawLeaveButton();
+
+    loadPage(); // update bindings after loading state
+}
+
 var gameSocket = null;
+var awaitingResync = false; // full state was requested because some update was missed
 function connect() {
     gameSocket = new WebSocket("ws://" + window.location.host + "/ws/durak_game/"); // connect to game web socket
 
     gameSocket.onmessage = (e) => {
-        gameState = JSON.parse(e.data);
-        console.log(gameState)
-
-        if (gameState.type === "game_state") {
-            // remove dragging card on screen of user who put it on table
-            if (gameState?.last_action?.type === 'play_turn' && gameState.player_id === gameState.state.players[gameState.state.turn].id) rollBackDraggingCard();
-            if (gameState?.last_action?.type === 'throw_additional' && gameState.player_id === gameState?.last_action?.player_id) rollBackDraggingCard();
-            if (gameState?.last_action?.type === 'defend' && gameState.player_id === gameState?.last_action?.player_id) rollBackDraggingCard();
-            if (gameState?.last_action?.type === 'player_removed') { // remove player's hand
-                document.getElementById(playerContainers[gameState.last_action.player_id]).innerHTML = '';
-            }
+        const message = JSON.parse(e.data);
+        console.log(message)
+
+        if (message.type === "game_state") { // full state (on connect or after resync)
+            gameState = message;
+            putOwnHand(gameState); // server sends own hand next to the state shared by every player
+            awaitingResync = false;
 
-            drawDeck(gameState.state.deck); // draw deck
+            drawGameState();
+        }
+        else if (message.type === "state_delta") { // changes made by one move
+            if (awaitingResync || message.seq <= gameState.seq) return; // full state is on the way or already contains this update
+
+            if (message.seq !== gameState.seq + 1) { // some update was missed, changes can't be applied
+                awaitingResync = true;
+                gameSocket.send(JSON.stringify({
+                    'action': 'resync'
+                }));
+                return;
+            }
 
-            gameState.state.players.forEach(p => { // draw each player's hand
-                drawHand(p);
-            })
-            drawTurn(gameState.state.players, gameState.state.turn, gameState.state.next_turn); // add marks to attacker and defender names
-            drawPlayZoneContent(gameState.state.attack_state) // draw play zone
-            drawActionButton();
-            drawResults();
-            drawLeaveButton();
+            applyChanges(gameState.state, message);
+            gameState.seq = message.seq;
+            gameState.last_action = message.last_action;
+            gameState.legal = message.legal; // moves are sent whole with every update
 
-            loadPage(); // update bindings after loading state
+            drawGameState(message.changes, message.hand !== null);
         }
-        else if (gameState.type === "player_mistake") {
+        else if (message.type === "player_mistake") {
             rollBackDraggingCard();
-            popUp(gameState.message, false);
+            popUp(message.message, false);
         }
     }
 
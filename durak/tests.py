@@ -1,3 +1,935 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import pstats
+import random
+import tempfile
+import threading
+import uuid
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.db import OperationalError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+import engine.Table as EngineTable
+import engine.Player as EnginePlayer
+import engine.batch as EngineBatch
+import engine.endgame as EngineEndgame
+import engine.replay as EngineReplay
+import engine.sim as EngineSim
+from engine.Deck import Deck
+from .metrics import Histogram, Counter
+from .models import Room, Player, AnonymousUser
+from .persistence import GameStateWriter
+from .bots import bots
+from .actors import GameActor, apply_action, load_room, move_to_action, get_actor, actors, stopping_actors
+from .presence import PresenceRegistry
+from .profiling import SamplingProfiler
+from .deltas import PLAIN_FIELDS
+from .matchmaking import Matchmaker, start_room
+from core.asgi import application
+
+
+# numpy backend (engine.batch) has to play exactly like engine.Table: the same deals, legal moves and states after every move
+@skipUnless(EngineBatch.np is not None, "numpy is not installed")
+class BatchTableDifferentialTests(SimpleTestCase):
+    def play_both(self, players_count: int, seeds: list[int]):
+        rng = random.Random(players_count)
+        np = EngineBatch.np
+
+        tables = []
+        for seed in seeds:
+            players = [EnginePlayer.Player(EngineBatch.player_id(s), EngineBatch.player_id(s)) for s in range(players_count)]
+            tables.append(EngineTable.Table(players, seed=seed))
+        batch = EngineBatch.BatchTable.from_seeds(seeds, players_count)
+
+        for step in range(10000):
+            seats, legal = batch.legal_moves()
+            moves = np.full(len(tables), EngineBatch.NO_MOVE)
+
+            for game, table in enumerate(tables):
+                self.assertEqual(batch.game_state(game), EngineBatch.table_state(table), f"game {game}, move {step}")
+
+                player_id, table_moves = table.legal_moves()
+                self.assertEqual(sorted(EngineBatch.encode_move(m) for m in table_moves), np.flatnonzero(legal[game]).tolist())
+                if not table_moves: # game is over
+                    self.assertEqual(seats[game], -1)
+                    continue
+
+                self.assertEqual(seats[game], EngineBatch.seat_of(player_id))
+                move = rng.choice(table_moves)
+                table.apply_event(move)
+                moves[game] = EngineBatch.encode_move(move)
+
+            if (moves == EngineBatch.NO_MOVE).all():
+                break
+            batch.step(seats, moves)
+
+        self.assertFalse(batch.is_active().any())
+
+    def test_two_players(self):
+        self.play_both(2, list(range(100)))
+
+    def test_three_players(self):
+        self.play_both(3, list(range(100)))
+
+    def test_four_players(self):
+        self.play_both(4, list(range(100)))
+
+    def test_policies_choose_legal_moves(self):
+        np = EngineBatch.np
+        rng = np.random.default_rng(0)
+
+        for players_count in (2, 3, 4):
+            for policy in EngineBatch.POLICIES.values():
+                batch = EngineBatch.BatchTable.shuffled(200, players_count, rng)
+                while batch.is_active().any():
+                    seats, legal = batch.legal_moves()
+                    _, phases = batch.decisions()
+                    moves = policy(batch, seats, phases, rng)
+
+                    playing = np.flatnonzero(phases != EngineBatch.GAME_OVER)
+                    self.assertTrue(legal[playing, moves[playing]].all())
+                    self.assertTrue((moves[phases == EngineBatch.GAME_OVER] == EngineBatch.NO_MOVE).all())
+                    batch.step(seats, moves)
+
+
+# binary state has to restore the same table as json state (see engine.Table.to_bytes)
+class TableBytesTests(SimpleTestCase):
+    def test_round_trip_during_games(self):
+        rng = random.Random(0)
+        for players_count in (2, 3, 4):
+            for seed in range(20):
+                table = EngineTable.Table([EnginePlayer.Player(f'p{i}', f'p{i}') for i in range(players_count)], seed=seed)
+                while True:
+                    restored = EngineTable.Table.from_bytes(table.to_bytes())
+                    self.assertEqual(restored.to_json(), table.to_json())
+                    self.assertEqual(restored.legal_moves(), table.legal_moves())
+
+                    moves = table.legal_moves()[1]
+                    if not moves:
+                        break
+                    table.apply_event(rng.choice(moves))
+
+    def test_refill_order_keeps_players_not_at_table(self):
+        table = EngineTable.Table([EnginePlayer.Player(f'p{i}', f'p{i}') for i in range(3)], seed=0)
+        table.apply_event(table.legal_moves()[1][0]) # attacker gets to the refill order
+        table.refill_players_order[EnginePlayer.Player('left', 'left')] = None
+
+        expected = [p.get_id() for p in table.refill_players_order]
+        for restored in (EngineTable.Table.from_bytes(table.to_bytes()), EngineTable.Table.from_json(table.to_json())):
+            self.assertEqual([p.get_id() for p in restored.refill_players_order], expected)
+            self.assertIs(next(iter(restored.refill_players_order)), restored.players[restored.get_turn()]) # seated players aren't copied
+
+
+# make_move/unmake_move used by searches have to give the same states as apply_event on a clone
+class MakeUnmakeTests(SimpleTestCase):
+    def state(self, table: EngineTable.Table) -> tuple:
+        return table.to_bytes(), table.get_table_ranks(), table.legal_moves()
+
+    def test_make_unmake_matches_clone(self):
+        rng = random.Random(0)
+        for players_count in (2, 3, 4):
+            for seed in range(5):
+                table = EngineTable.Table([EnginePlayer.Player(f'p{i}', f'p{i}') for i in range(players_count)], seed=seed)
+                while True:
+                    before = self.state(table)
+                    moves = before[2][1]
+                    if not moves:
+                        break
+
+                    for move in moves:
+                        copy = table.clone()
+                        copy.apply_event(move)
+                        self.assertEqual(self.state(table), before) # clone doesn't share state with the table
+
+                        undo = table.make_move(move)
+                        self.assertEqual(self.state(table), self.state(copy))
+                        reply = table.legal_moves()[1]
+                        if reply: # the next move is unmade first
+                            table.unmake_move(table.make_move(rng.choice(reply)))
+                            self.assertEqual(self.state(table), self.state(copy))
+                        table.unmake_move(undo)
+                        self.assertEqual(self.state(table), before)
+
+                    defender_mask = table.players[table.get_next_turn()].get_hand_mask()
+                    missing = next(i for i in range(EngineTable.CARDS_COUNT) if not defender_mask >> i & 1)
+                    with self.assertRaises(ValueError): # rejected move changes nothing
+                        table.make_move(('defend', missing, missing))
+                    self.assertEqual(self.state(table), before)
+
+                    table.apply_event(rng.choice(moves))
+
+
+# seed and moves log rebuild every state of the game (see engine.replay)
+class ReplayTests(SimpleTestCase):
+    def test_replay_reproduces_states(self):
+        rng = random.Random(0)
+        for players_count in (2, 3, 4):
+            for seed in range(10):
+                table, record = EngineReplay.new_game([[f'name {i}', f'p{i}'] for i in range(players_count)], seed)
+                states = [json.dumps(table.to_json())] # encoded, because to_json shares lists with the table
+                while table.legal_moves()[1]:
+                    table.apply_event(rng.choice(table.legal_moves()[1]))
+                    states.append(json.dumps(table.to_json()))
+
+                record = EngineReplay.GameRecord.from_json(json.dumps(record.to_json())) # stored as json
+                self.assertEqual(len(record.events), len(states) - 1)
+                self.assertEqual(json.dumps(EngineReplay.replay(record.players, record.seed, record.events).to_json()), states[-1])
+                for moves in rng.sample(range(len(states)), 5):
+                    self.assertEqual(json.dumps(EngineReplay.replay(record.players, record.seed, record.events, moves).to_json()), states[moves])
+
+
+# simulated games are reproducible by seed and always end (the statistics of engine.sim rely on both)
+class SimulationTests(SimpleTestCase):
+    def test_same_seed_plays_same_game(self):
+        for players_count in (2, 3, 4):
+            first, second = (EngineSim.play_game(7, ['greedy', 'random'], players_count) for _ in range(2))
+            del first['seconds'], second['seconds']
+            self.assertEqual(first, second)
+
+    def test_every_game_ends_with_durak_or_draw(self):
+        for players_count in (2, 3, 4):
+            for policies in (['random'], ['greedy'], ['greedy', 'random']):
+                for result in EngineSim.simulate(30, policies, players_count, processes=1):
+                    self.assertTrue(result['finished'], result)
+                    self.assertLess(result['moves'], 10000)
+                    losers = [] if result['durak'] is None else [result['durak']] # nobody is durak in a draw
+                    self.assertCountEqual(result['winners'] + losers, result['policies'])
+
+
+# solver has to agree with plain minimax (no transposition table, no pruning) and suggest only legal moves. Attacker
+# with one card against defender with 16 or more cards keeps the game small, while the attack limit still needs
+# more than 4 bits of the transposition key
+class EndgameSolverTests(SimpleTestCase):
+    def minimax(self, solver: EngineEndgame.EndgameSolver, position: tuple, values: dict) -> int: # value for seat 0
+        value = values.get(position)
+        if value is None:
+            children, decider = solver.children(position)
+            results = [child if type(child) is int else self.minimax(solver, child, values) for _, child in children]
+            value = values[position] = max(results) if decider == 0 else min(results)
+        return value
+
+    def endgame(self, seed: int, defender_cards: int) -> EngineTable.Table: # deck is empty, attacker has one card
+        rng = random.Random(seed)
+        table = EngineTable.Table([EnginePlayer.Player(f'p{i}', f'p{i}') for i in range(2)], seed=seed)
+        cards = rng.sample(EngineTable.CARDS_BY_ID, defender_cards + 1)
+        attacker = table.get_turn()
+        table.players[attacker].set_hand(cards[:1])
+        table.players[1 - attacker].set_hand(cards[1:])
+        table.deck = Deck([], table.deck.get_trump())
+        table.attacks_number = 2 # not the first attack, limit is the whole hand of defender
+        return table
+
+    def test_large_hands_match_minimax(self):
+        for defender_cards in (16, 18, 20):
+            for seed in range(10):
+                table = self.endgame(seed, defender_cards)
+                solver = EngineEndgame.EndgameSolver() # positions of the whole line share one transposition table
+                values = {}
+                while True:
+                    player_id, moves = table.legal_moves()
+                    if not moves:
+                        break
+
+                    value, move = solver.solve(table, player_id)
+                    sign = 1 if player_id == 'p0' else -1
+                    self.assertIn(move, moves, f"seed {seed}, {defender_cards} cards")
+                    self.assertEqual(value, self.minimax(solver, solver.position(table), values) * sign)
+
+                    after = table.clone()
+                    after.apply_event(move)
+                    if after.legal_moves()[1]: # the best move keeps the value
+                        self.assertEqual(value, self.minimax(solver, solver.position(after), values) * sign)
+
+                    # defender takes whenever he can, so attacker decides with the same cards as the defender did
+                    table.apply_event(('take_cards',) if ('take_cards',) in moves else moves[0])
+
+
+class MetricsTests(SimpleTestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('latency_seconds', "Latency", ('action',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value, ('defend',))
+
+        self.assertEqual(histogram.samples(), [
+            'latency_seconds_bucket{action="defend",le="0.1"} 2',
+            'latency_seconds_bucket{action="defend",le="1.0"} 3',
+            'latency_seconds_bucket{action="defend",le="+Inf"} 4',
+            'latency_seconds_sum{action="defend"} 2.65',
+            'latency_seconds_count{action="defend"} 4',
+        ])
+
+    def test_label_values_are_escaped(self):
+        counter = Counter('mistakes_total', "Mistakes", ('action',))
+        counter.inc(('say "hi"\n',))
+        self.assertEqual(counter.samples(), ['mistakes_total{action="say \\"hi\\"\\n"} 1'])
+
+    @override_settings(DURAK_METRICS=False)
+    def test_disabled_metrics_are_not_exported(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    @override_settings(DURAK_METRICS=True)
+    def test_metrics_are_exported_as_text(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE durak_stage_seconds histogram', response.content.decode())
+
+
+# sampled calls are profiled one at a time, their stats are added up by name and written by the background thread
+@override_settings(DURAK_PROFILE=True, DURAK_PROFILE_RATE=1.0, DURAK_PROFILE_INTERVAL=3600)
+class ProfilerTests(SimpleTestCase):
+    def setUp(self):
+        self.profiler = SamplingProfiler()
+        self.profiler.rng = random.Random(0)
+        self.profiler.thread = mock.Mock() # nothing is dumped in background unless the test starts it
+
+    @staticmethod
+    def work(): # function whose calls are counted
+        return sum(range(100))
+
+    @staticmethod
+    def calls(stats: pstats.Stats) -> int: # calls of work() recorded in stats
+        return sum(nc for (_, _, function), (_, nc, *_) in stats.stats.items() if function == 'work')
+
+    def test_calls_are_sampled_at_rate(self):
+        with override_settings(DURAK_PROFILE_RATE=0.25):
+            for _ in range(400):
+                with self.profiler.profile('work'):
+                    self.work()
+        sampled = len(self.profiler.samples)
+        self.assertTrue(70 <= sampled <= 130, sampled)
+
+        with override_settings(DURAK_PROFILE=False):
+            with self.profiler.profile('work'):
+                self.work()
+        self.assertEqual(len(self.profiler.samples), sampled)
+
+    def test_nested_call_is_not_profiled(self): # only one call of the process is profiled at a time
+        with self.profiler.profile('outer'):
+            with self.profiler.profile('inner'):
+                self.work()
+        self.assertEqual([name for name, _ in self.profiler.samples], ['outer'])
+
+    def test_samples_are_added_up_by_name(self):
+        work = self.profiler.profiled('work')(self.work)
+        for _ in range(3):
+            work()
+        with self.profiler.profile('other'):
+            self.work()
+
+        self.profiler.collect()
+        self.assertEqual(self.profiler.samples, [])
+        self.assertEqual(self.calls(self.profiler.stats['work']), 3)
+        self.assertEqual(self.calls(self.profiler.stats['other']), 1)
+
+    def test_totals_are_written_to_files(self):
+        for _ in range(2):
+            with self.profiler.profile('work'):
+                self.work()
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(DURAK_PROFILE_DIR=directory):
+            self.profiler.dump()
+            self.assertEqual(os.listdir(directory), [f'work.{os.getpid()}.prof'])
+            self.assertEqual(self.calls(pstats.Stats(os.path.join(directory, f'work.{os.getpid()}.prof'))), 2)
+
+    def test_dump_runs_in_background_thread(self):
+        self.profiler.thread = None
+        dumped = threading.Event()
+        threads = []
+        def dump():
+            threads.append(threading.current_thread())
+            dumped.set()
+
+        with mock.patch.object(self.profiler, 'dump', dump), override_settings(DURAK_PROFILE_INTERVAL=0.01):
+            with self.profiler.profile('work'): # the first sample starts the thread
+                self.work()
+            self.assertTrue(dumped.wait(5))
+            self.profiler.samples.clear() # the thread goes on, later dumps have nothing to write
+        self.assertIs(threads[0], self.profiler.thread)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+
+# lobby and waiting room sockets sharing a fresh matchmaker (seats of other tests are not handed out)
+class WaitingRoomTests(TransactionTestCase):
+    def setUp(self):
+        self.matchmaker = Matchmaker()
+        for module in ('durak.views', 'durak.consumers'):
+            self.enterContext(mock.patch(f'{module}.matchmaker', self.matchmaker))
+
+    async def join(self, name: str) -> tuple[WebsocketCommunicator, Player]: # take a seat of 2 player room and open its waiting room
+        response = await self.async_client.post('/', {'players_count': '2', 'username': name})
+        self.assertEqual(response.status_code, 302)
+
+        player_id = response.cookies['player_id'].value
+        communicator = WebsocketCommunicator(application, '/ws/waiting_room/', headers=[(b'cookie', f'player_id={player_id}'.encode())])
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator, await Player.objects.aget(id=player_id)
+
+    async def test_next_player_gets_seat_of_lone_player_who_left(self):
+        first, first_player = await self.join('first')
+        self.assertEqual((await first.receive_json_from())['connected_users_count'], 1)
+        await first.disconnect(code=1001)
+
+        second, second_player = await self.join('second')
+        self.assertEqual(second_player.room_id, first_player.room_id) # the room kept waiting, its seat was handed out again
+        self.assertEqual((await second.receive_json_from())['connected_users_count'], 1)
+        await second.disconnect(code=1001)
+
+        self.assertEqual(await Player.objects.acount(), 0)
+        self.assertEqual(await AnonymousUser.objects.acount(), 0)
+
+    async def test_seat_is_given_up_before_player_is_deleted(self): # player entering meanwhile doesn't count him
+        first, player = await self.join('first')
+        await first.receive_json_from()
+
+        seats = [] # occupancy and vacated seats of the room while player was deleted
+        def delete(deleted):
+            seats.append((set(self.matchmaker.occupancy[player.room_id]), list(self.matchmaker.vacated[2])))
+        with mock.patch.object(Player, 'delete', autospec=True, side_effect=delete):
+            await first.disconnect(code=4000)
+        self.assertEqual(seats, [(set(), [player.room_id])])
+
+    async def test_socket_of_started_room_is_sent_to_game(self): # e.g. waiting room page opened after the room filled
+        first, player = await self.join('first')
+        second, _ = await self.join('second') # room is full, its game starts
+        await second.disconnect(code=1000)
+
+        late = WebsocketCommunicator(application, '/ws/waiting_room/', headers=[(b'cookie', f'player_id={player.id}'.encode())])
+        connected, _ = await late.connect()
+        self.assertTrue(connected)
+        self.assertEqual(await late.receive_json_from(), {'type': 'start_game', 'redirect_url': '/durak/'})
+        await late.disconnect(code=4000) # e.g. tab closed before redirect
+
+        self.assertTrue(await Player.objects.filter(id=player.id).aexists()) # player stays in his game
+        await first.disconnect(code=1000)
+
+    @override_settings(DURAK_BOTS=True, DURAK_WAITING_BOTS_TIMEOUT=0.05)
+    async def test_lone_player_starts_game_with_bot(self):
+        first, first_player = await self.join('first')
+        self.assertEqual((await first.receive_json_from())['connected_users_count'], 1)
+        self.assertEqual((await first.receive_json_from(timeout=2))['type'], 'start_game') # nobody else came in time
+
+        room = await Room.objects.aget(id=first_player.room_id)
+        self.assertFalse(room.is_waiting)
+        self.assertEqual(len(room.roster), 2)
+        self.assertEqual(room.bot_ids, [room.roster[1]['id']])
+        await first.disconnect(code=1000)
+
+        second, second_player = await self.join('second')
+        self.assertNotEqual(second_player.room_id, first_player.room_id) # the seat of the bot isn't handed out
+        await second.disconnect(code=1001)
+
+
+# every write is compare-and-swap on Room.version, actor replays its unsaved moves on state written by someone else
+class GameStateWriterTests(TestCase):
+    def setUp(self):
+        self.table = EngineTable.Table([EnginePlayer.Player(f'p{i}', f'p{i}') for i in range(2)], seed=0)
+        self.room = Room(max_players_count=2, is_waiting=False, version=1)
+        self.room.store_table(self.table)
+        self.room.save()
+
+    def write(self, saved_version: int, events: list) -> set: # store moves made after saved_version
+        return GameStateWriter.write({self.room.id: (None, None, saved_version, saved_version + len(events), events)})
+
+    def test_moves_are_appended_to_saved_version(self):
+        move = self.table.legal_moves()[1][0]
+        self.assertEqual(self.write(1, [move]), set())
+
+        self.table.apply_event(move)
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.version, 2)
+        self.assertEqual(self.room.load_table().to_json(), self.table.to_json())
+
+    def test_stale_version_is_conflict(self):
+        first, second = self.table.legal_moves()[1][:2]
+        self.write(1, [first])
+        self.assertEqual(self.write(1, [second]), {self.room.id}) # state was changed by someone else meanwhile
+
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.version, 2)
+        self.assertEqual(list(self.room.events.values_list('seq', 'event')), [(2, list(first))])
+
+    @mock.patch('durak.actors.writer')
+    async def test_actor_replays_unsaved_moves_after_conflict(self, actor_writer):
+        actor = GameActor(self.room.id)
+        actor.set_table(*await database_sync_to_async(load_room)(self.room.id))
+        saved, unsaved = self.table.legal_moves()[1][:2]
+
+        actor.table.apply_event(unsaved) # made by this actor, but not written yet
+        actor.version += 1
+        await database_sync_to_async(self.write)(1, [saved]) # another process wrote its move first
+
+        states = {self.room.id: (actor, None, actor.saved_version, actor.version, list(actor.unsaved_events))}
+        self.assertEqual(await database_sync_to_async(GameStateWriter.write)(states), {self.room.id})
+        actor.conflict()
+        await actor.reload()
+
+        for move in (saved, unsaved):
+            self.table.apply_event(move)
+        self.assertEqual(actor.table.to_json(), self.table.to_json())
+        self.assertEqual((actor.saved_version, actor.version, actor.unsaved_events), (2, 3, [unsaved]))
+        actor_writer.mark_dirty.assert_called_once_with(actor) # replayed move is written on top of the fresh state
+
+    @staticmethod
+    def next_move(table: EngineTable.Table, rng: random.Random) -> tuple: # (player id, action) of a random legal move
+        player_id, legal = table.legal_moves()
+        move = rng.choice(legal)
+        return (move[1] if move[0] == 'throw_additional' else player_id), move_to_action(move)
+
+    async def start_actor(self, writer: GameStateWriter) -> GameActor:
+        self.enterContext(mock.patch('durak.actors.writer', writer))
+        actor = GameActor(self.room.id)
+        actor.set_table(*await database_sync_to_async(load_room)(self.room.id))
+        actor.remember_sent_state()
+        return actor
+
+    @override_settings(DURAK_BOTS=False, DURAK_PERSIST_INTERVAL=0.05)
+    async def test_moves_of_one_interval_are_one_write(self):
+        writer = GameStateWriter()
+        actor = await self.start_actor(writer)
+        rng = random.Random(0)
+        with mock.patch.object(GameStateWriter, 'write', wraps=GameStateWriter.write) as write:
+            for _ in range(3): # every move marks the room dirty
+                await actor.apply(*self.next_move(actor.table, rng), None)
+            await asyncio.wait_for(writer.task, 5) # the writer stops when nothing is dirty
+
+        write.assert_called_once()
+        (states,), _ = write.call_args
+        self.assertEqual(list(states), [self.room.id])
+        self.assertEqual(len(states[self.room.id][4]), 3) # all moves go with the single row update
+
+        await self.room.arefresh_from_db()
+        self.assertEqual(self.room.version, 4)
+        self.assertEqual(await self.room.events.acount(), 3)
+
+    @override_settings(DURAK_BOTS=False, DURAK_PERSIST_INTERVAL=60)
+    async def test_finished_game_is_written_immediately(self):
+        rng = random.Random(0)
+        while True: # play the stored table up to its last move
+            player_id, action = self.next_move(self.table, rng)
+            table = self.table.clone()
+            apply_action(table, player_id, action)
+            if len(table.players) <= 1:
+                break
+            self.table = table
+        self.room.store_table(self.table)
+        await self.room.asave()
+
+        writer = GameStateWriter()
+        actor = await self.start_actor(writer)
+        await actor.apply(player_id, action, None)
+        writer.task.cancel() # nothing is left for the interval flush
+
+        self.assertEqual(writer.dirty, {})
+        await self.room.arefresh_from_db()
+        self.assertEqual((self.room.version, self.room.snapshot_version), (2, 2))
+        self.assertEqual((await database_sync_to_async(self.room.load_table)()).to_json(), table.to_json())
+
+
+# state_delta messages applied in seq order (like game.js does) have to give the state and hand of the table
+class StateDeltaTests(TestCase):
+    @staticmethod
+    def apply_changes(state: dict, hand: list, message: dict) -> list: # patch public state, returns new hand
+        changes = message['changes']
+        if 'deck' in changes:
+            state['deck'] = changes['deck']
+        if 'attack_state' in changes:
+            pairs = dict(state['attack_state'])
+            for bottom in changes['attack_state']['removed']:
+                del pairs[bottom]
+            pairs.update(changes['attack_state']['set'])
+            state['attack_state'] = [list(pair) for pair in pairs.items()]
+        for field in ('players', 'winners'):
+            if field in changes:
+                state[field] = changes[field]
+        for player in state['players']:
+            player['hand_len'] = changes.get('hand_lens', {}).get(player['id'], player['hand_len'])
+        for field in PLAIN_FIELDS:
+            if field in changes:
+                state[field] = changes[field]
+
+        if message['hand'] is None:
+            return hand
+        return [c for c in hand if c not in message['hand']['removed']] + message['hand']['added']
+
+    @mock.patch('durak.actors.writer')
+    async def test_deltas_rebuild_state(self, _):
+        table = EngineTable.Table([EnginePlayer.Player(f'p{i}', f'p{i}') for i in range(2)], seed=0)
+        room = Room(max_players_count=2, is_waiting=False, version=1)
+        room.store_table(table)
+        await room.asave()
+
+        actor = GameActor(room.id)
+        actor.set_table(*await database_sync_to_async(load_room)(room.id))
+        actor.remember_sent_state()
+        channel = await actor.channel_layer.new_channel()
+        await actor.channel_layer.group_add('player_p0', channel)
+
+        state = table.to_publicjson()
+        hand = [str(c) for c in table.players[0].get_hand()]
+        rng = random.Random(0)
+        for seq in range(2, 60):
+            player_id, moves = actor.table.legal_moves()
+            if not moves:
+                break
+            await actor.apply(player_id, move_to_action(rng.choice(moves)), None)
+
+            message = json.loads((await actor.channel_layer.receive(channel))['text'])
+            self.assertEqual((message['type'], message['seq']), ('state_delta', seq))
+            hand = self.apply_changes(state, hand, message)
+            self.assertEqual(state, json.loads(json.dumps(actor.table.to_publicjson())))
+            player = actor.table.search_player('p0') or actor.table.search_winner('p0')
+            self.assertEqual(hand, [str(c) for c in player.get_hand()])
+
+
+# disconnected player is removed after the grace time unless he reconnects (timers run on the event loop)
+@override_settings(DURAK_RECONNECT_TIMEOUT=0.01, DURAK_PRESENCE_INTERVAL=60)
+class PresenceTimerTests(SimpleTestCase):
+    def setUp(self):
+        self.presence = PresenceRegistry()
+        self.presence.run = mock.AsyncMock() # states aren't written by these tests
+        self.remove = mock.AsyncMock()
+        self.reconnected = mock.Mock()
+
+    async def test_reconnect_in_time_cancels_removal(self):
+        self.presence.disconnected('p0', self.remove, self.reconnected)
+        self.assertEqual(self.presence.pending_count(), 1)
+        self.assertFalse(self.presence.is_connected('p0'))
+
+        self.assertTrue(self.presence.connected('p0'))
+        await asyncio.sleep(0.05)
+        self.reconnected.assert_called_once_with()
+        self.remove.assert_not_awaited()
+        self.assertEqual(self.presence.pending_count(), 0)
+        self.assertTrue(self.presence.is_connected('p0'))
+
+    async def test_player_is_removed_after_timeout(self):
+        self.presence.disconnected('p0', self.remove, self.reconnected)
+        await asyncio.sleep(0.05)
+        self.remove.assert_awaited_once_with()
+        self.reconnected.assert_not_called()
+        self.assertEqual(self.presence.pending_count(), 0)
+        self.assertFalse(self.presence.connected('p0')) # too late, nothing was waiting
+
+    async def test_new_disconnect_replaces_pending_one(self): # e.g. player closed the second tab
+        other_remove = mock.AsyncMock()
+        self.presence.disconnected('p0', other_remove, self.reconnected)
+        self.presence.disconnected('p0', self.remove, mock.Mock())
+        self.reconnected.assert_called_once_with() # the first connection isn't waited for anymore
+        self.assertEqual(self.presence.pending_count(), 1)
+
+        await asyncio.sleep(0.05)
+        other_remove.assert_not_awaited()
+        self.remove.assert_awaited_once_with()
+
+
+# Player.is_connected mirrors the registry, changes between flushes are written with one bulk update
+@override_settings(DURAK_PRESENCE_INTERVAL=60)
+class PresenceWriteTests(TestCase):
+    def setUp(self):
+        room = Room.objects.create(max_players_count=2, is_waiting=False)
+        self.players = [Player.objects.create(room=room, anonymous_user=AnonymousUser.objects.create(name=f'p{i}')) for i in range(2)]
+        self.ids = [str(p.id) for p in self.players]
+
+    def test_changes_are_written_with_one_query(self):
+        deleted_id = str(uuid.uuid4()) # player deleted meanwhile is skipped
+        with self.assertNumQueries(1):
+            PresenceRegistry.write({self.ids[0]: True, self.ids[1]: False, deleted_id: True})
+
+        self.assertEqual(list(Player.objects.filter(id__in=self.ids).order_by('anonymous_user__name').values_list('is_connected', flat=True)), [True, False])
+
+    async def test_changes_between_flushes_are_coalesced(self):
+        presence = PresenceRegistry()
+        presence.run = mock.AsyncMock() # flushed by the test instead of the interval loop
+        presence.set_connected(self.ids[0], True)
+        presence.set_connected(self.ids[0], False)
+        presence.set_connected(self.ids[0], True)
+        presence.set_connected(self.ids[1], True)
+        presence.forget(self.ids[1]) # deleted, nothing to write
+        self.assertEqual(presence.unsaved, {self.ids[0]: True})
+
+        with mock.patch.object(PresenceRegistry, 'write') as write:
+            await presence.flush()
+            await presence.flush() # nothing changed since the last flush
+        write.assert_called_once_with({self.ids[0]: True})
+        self.assertTrue(presence.is_connected(self.ids[0]))
+        self.assertFalse(presence.is_connected(self.ids[1]))
+
+
+# seats are assigned in memory, rooms are created a batch at a time and vacated seats are handed out first
+@override_settings(DURAK_MATCHMAKING_BATCH=2)
+class MatchmakerTests(TestCase):
+    def test_seats_fill_rooms_in_order(self):
+        matchmaker = Matchmaker()
+        with self.assertNumQueries(1): # the first batch is inserted with one query
+            first = [matchmaker.join(2) for _ in range(4)]
+        self.assertEqual(len({first[0], first[2]}), 2)
+        self.assertEqual(first, [first[0], first[0], first[2], first[2]])
+        self.assertEqual(Room.objects.filter(id__in=first, max_players_count=2, is_waiting=True).count(), 2)
+
+        with self.assertNumQueries(1): # the next batch
+            room_id = matchmaker.join(2)
+        self.assertNotIn(room_id, first)
+        self.assertNotIn(matchmaker.join(3), first) # every size has its own rooms
+
+    def test_vacated_seat_is_handed_out_first(self):
+        matchmaker = Matchmaker()
+        room_id = matchmaker.join(3)
+        other_id = matchmaker.join(2)
+        matchmaker.leave(3, room_id)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(matchmaker.join(3), room_id)
+            self.assertEqual(matchmaker.join(3), room_id) # the next seat of the counter
+        self.assertEqual(matchmaker.join(2), other_id)
+
+    def test_occupancy_counts_connected_players(self):
+        matchmaker = Matchmaker()
+        room_id = matchmaker.join(2)
+        self.assertFalse(matchmaker.is_waiting(room_id))
+
+        self.assertEqual(matchmaker.enter(room_id, 'p0'), 1)
+        self.assertEqual(matchmaker.enter(room_id, 'p0'), 1) # the same player connected again
+        self.assertEqual(matchmaker.exit(room_id, 'p0'), 0)
+        self.assertTrue(matchmaker.is_waiting(room_id))
+
+        self.assertEqual(matchmaker.enter(room_id, 'p0'), 1)
+        self.assertEqual(matchmaker.enter(room_id, 'p1'), 2)
+        matchmaker.start(room_id)
+        self.assertFalse(matchmaker.is_waiting(room_id))
+
+    @override_settings(DURAK_BOTS=True, DURAK_WAITING_BOTS_TIMEOUT=0.01)
+    async def test_rooms_which_dont_fill_in_time_start_with_bots(self):
+        matchmaker = Matchmaker()
+        join = database_sync_to_async(matchmaker.join)
+        full_id, _, lone_id = [await join(2) for _ in range(3)]
+        fill_full, fill_lone = mock.AsyncMock(), mock.AsyncMock()
+
+        matchmaker.enter(full_id, 'p0')
+        matchmaker.wait_for_players(full_id, fill_full)
+        matchmaker.enter(full_id, 'p1')
+        matchmaker.start(full_id) # room filled in time
+
+        matchmaker.enter(lone_id, 'p2')
+        matchmaker.wait_for_players(lone_id, fill_lone)
+        matchmaker.enter(lone_id, 'p3')
+        matchmaker.exit(lone_id, 'p3')
+        matchmaker.leave(2, lone_id)
+        await asyncio.sleep(0.05)
+
+        fill_full.assert_not_awaited()
+        fill_lone.assert_awaited_once()
+        self.assertFalse(matchmaker.is_waiting(lone_id))
+        self.assertNotIn(await join(2), (full_id, lone_id)) # neither vacated nor the last seat of the room is handed out
+
+    @override_settings(DURAK_WAITING_BOTS_TIMEOUT=None)
+    async def test_rooms_wait_forever_without_timeout(self):
+        matchmaker = Matchmaker()
+        room_id = await database_sync_to_async(matchmaker.join)(2)
+        matchmaker.enter(room_id, 'p0')
+        matchmaker.wait_for_players(room_id, mock.AsyncMock())
+        self.assertEqual(matchmaker.fill_timers, {})
+
+
+# table is dealt once when the room fills, the game page only reads it
+class StartRoomTests(TestCase):
+    def setUp(self):
+        self.room = Room.objects.create(max_players_count=2)
+        self.players = [Player.objects.create(room=self.room, anonymous_user=AnonymousUser.objects.create(name=f'p{i}')) for i in range(2)]
+
+    def open_game(self, player: Player):
+        self.client.cookies['player_id'] = str(player.id)
+        return self.client.get('/durak/')
+
+    def test_table_is_dealt_once(self):
+        self.assertTrue(start_room(self.room.id))
+        self.room.refresh_from_db()
+        self.assertFalse(start_room(self.room.id)) # the second player filling the room at the same moment
+
+        room = Room.objects.get(id=self.room.id)
+        self.assertEqual((room.is_waiting, room.version, room.game_state_bin), (False, 1, self.room.game_state_bin))
+        self.assertCountEqual(room.roster, [p.group() for p in self.players])
+        self.assertEqual(len(room.load_table().players), 2)
+
+    def test_free_seats_are_taken_by_bots(self):
+        Room.objects.filter(id=self.room.id).update(max_players_count=4)
+        self.assertTrue(start_room(self.room.id, with_bots=True))
+
+        room = Room.objects.get(id=self.room.id)
+        self.assertCountEqual(room.roster[:2], [p.group() for p in self.players])
+        self.assertEqual(room.bot_ids, [p['id'] for p in room.roster[2:]])
+        self.assertEqual([p.get_id() for p in room.load_table().players], [p['id'] for p in room.roster])
+
+    def test_game_page_of_waiting_room_redirects(self):
+        self.assertRedirects(self.open_game(self.players[0]), '/waiting_room/')
+
+    def test_game_page_reads_stored_roster(self):
+        start_room(self.room.id)
+        with self.assertNumQueries(1): # player together with the room
+            response = self.open_game(self.players[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['player']['id'] for p in response.context['indexed_players']], [str(self.players[1].id)])
+
+    def test_room_filled_without_table_is_dealt_by_game_page(self): # e.g. room filled while the server was updated
+        Room.objects.filter(id=self.room.id).update(is_waiting=False)
+        self.assertEqual(self.open_game(self.players[0]).status_code, 200)
+        room = Room.objects.get(id=self.room.id)
+        self.assertTrue(room.has_table())
+
+        self.assertEqual(self.open_game(self.players[1]).status_code, 200)
+        self.assertEqual(Room.objects.get(id=self.room.id).game_state_bin, room.game_state_bin)
+
+
+# one actor per room applies actions of every consumer in queue order and hands the room over to the next actor
+@override_settings(DURAK_BOTS=False)
+class GameActorTests(TestCase):
+    def setUp(self):
+        self.table = EngineTable.Table([EnginePlayer.Player(f'p{i}', f'p{i}') for i in range(2)], seed=0)
+        self.room = Room(max_players_count=2, is_waiting=False, version=1)
+        self.room.store_table(self.table)
+        self.room.save()
+
+        self.writer = GameStateWriter() # the writer task of this test is stopped by stop()
+        self.enterContext(mock.patch('durak.actors.writer', self.writer))
+
+    async def start(self) -> GameActor:
+        actor = get_actor(self.room.id)
+        await asyncio.wait_for(actor.ready.wait(), 5)
+        return actor
+
+    async def stop(self, actor: GameActor):
+        actor.detach()
+        await asyncio.wait_for(actor.task, 5)
+        if self.writer.task is not None:
+            self.writer.task.cancel()
+
+    def moves(self, count: int) -> list[tuple]: # (player id, action) of the next moves of a copy of the table
+        table = self.table.clone()
+        rng = random.Random(0)
+        moves = []
+        for _ in range(count):
+            player_id, legal = table.legal_moves()
+            move = rng.choice(legal)
+            table.apply_event(move)
+            moves.append((move[1] if move[0] == 'throw_additional' else player_id, move_to_action(move)))
+        self.table = table
+        return moves
+
+    async def test_submitted_actions_are_applied_in_order(self):
+        actor = await self.start()
+        *submitted, (player_id, last) = self.moves(10)
+        for move in submitted: # every move is legal only after the previous ones
+            actor.submit(*move)
+        await actor.call(player_id, last)
+
+        self.assertEqual(actor.version, 11)
+        self.assertEqual(actor.table.to_json(), self.table.to_json())
+        await self.stop(actor)
+
+    async def test_concurrent_calls_are_serialized(self):
+        actor = await self.start()
+        moves = self.moves(4)
+        results = await asyncio.gather(*(actor.call(*move) for move in moves), actor.call('p0', {'action': 'unknown'}), return_exceptions=True)
+
+        self.assertEqual([r['type'] for r in results[:4]], [self.type_of(action) for _, action in moves])
+        self.assertIsInstance(results[4], ValueError) # rejected action fails only its caller
+        self.assertEqual(actor.version, 5)
+        await self.stop(actor)
+
+    @staticmethod
+    def type_of(action: dict) -> str: # type of last_action (see apply_action)
+        return {'take_cards': 'defender_take_cards'}.get(action['action'], action['action'])
+
+    @override_settings(DURAK_BOTS=True)
+    async def test_failed_action_keeps_actor_running(self):
+        actor = await self.start()
+        with mock.patch('durak.actors.save_bot_ids', side_effect=OperationalError("database is locked")), \
+                self.assertLogs('durak.actors', 'ERROR'):
+            # not assertRaises, it clears frames of the traceback (including the running actor)
+            error, = await asyncio.gather(actor.call('p1', {'action': 'leave'}), return_exceptions=True)
+        self.assertIsInstance(error, OperationalError)
+        self.assertEqual(actor.bot_ids, set())
+
+        (player_id, action), = self.moves(1)
+        await actor.call(player_id, action) # the next action is still applied
+        self.assertEqual(actor.version, 2)
+        await self.stop(actor)
+
+    async def test_next_actor_reads_state_written_by_stopping_one(self):
+        actor = await self.start()
+        for move in self.moves(3):
+            await actor.call(*move)
+
+        actor.detach() # its last state is written while the next actor starts
+        self.assertIs(stopping_actors.get(self.room.id), actor)
+        next_actor = await self.start()
+        self.assertIsNot(next_actor, actor)
+        self.assertEqual((next_actor.version, next_actor.table.to_json()), (4, self.table.to_json()))
+        self.assertNotIn(self.room.id, stopping_actors)
+        await self.stop(next_actor)
+
+    async def test_failed_stopping_actor_doesnt_block_next_one(self):
+        failed = asyncio.get_running_loop().create_future()
+        failed.set_exception(RuntimeError("actor failed"))
+        stopping_actors[self.room.id] = mock.Mock(task=failed)
+        try:
+            with self.assertLogs('durak.actors', 'ERROR'):
+                actor = await self.start()
+        finally:
+            stopping_actors.pop(self.room.id, None)
+
+        self.assertEqual(actor.table.to_json(), self.table.to_json())
+        await self.stop(actor)
+
+    async def wait_version(self, actor: GameActor, version: int): # moves of bots are applied in background
+        async with asyncio.timeout(5):
+            while actor.version < version:
+                await asyncio.sleep(0.01)
+
+    @override_settings(DURAK_BOTS=True)
+    async def test_bot_seat_is_stored_and_loaded(self):
+        actor = await self.start()
+        waiting_id = next(p.get_id() for p in self.table.players if p.get_id() != self.table.legal_moves()[0])
+        self.assertEqual(await actor.call(waiting_id, {'action': 'leave'}), {'type': 'bot_took_seat', 'player_id': waiting_id})
+        await self.stop(actor)
+
+        await self.room.arefresh_from_db()
+        self.assertEqual(self.room.bot_ids, [waiting_id])
+        actor = await self.start()
+        self.assertEqual(actor.bot_ids, {waiting_id})
+        await self.stop(actor)
+
+    @override_settings(DURAK_BOTS=True, DURAK_BOT_MOVE_TIME=0.05, DURAK_BOT_SEARCH_WORKERS=1)
+    async def test_bot_plays_legal_move(self):
+        player_id, legal = self.table.legal_moves()
+        actor = await self.start()
+        with mock.patch.object(bots, 'get_executor', return_value=None): # search runs in threads instead of processes
+            await actor.call(player_id, {'action': 'leave'})
+            await self.wait_version(actor, 2)
+        await self.stop(actor)
+
+        event = await self.room.events.filter(seq=2).values_list('event', flat=True).aget()
+        self.assertIn(tuple(event), legal) # illegal move wouldn't change the version
+
+    @override_settings(DURAK_BOTS=True, DURAK_BOT_MOVE_TIME=0.05, DURAK_BOT_SEARCH_WORKERS=1)
+    async def test_failed_search_falls_back_to_greedy(self):
+        player_id, legal = self.table.legal_moves()
+        with mock.patch.object(bots, 'get_executor', return_value=None), \
+                mock.patch('engine.ismcts.search', side_effect=RuntimeError("search failed")), \
+                self.assertLogs('durak.bots', 'ERROR'):
+            move = await bots.choose_move(self.table, player_id)
+        self.assertEqual(move, EngineSim.greedy_policy(self.table, player_id, legal, random.Random()))
+
+    async def test_stale_bot_move_is_dropped(self):
+        actor = await self.start()
+        (player_id, action), = self.moves(1)
+        actor.submit(player_id, {**action, 'bot_version': 0}) # searched before the first move
+        await actor.call(player_id, action) # would be illegal after the same move of the bot
+
+        self.assertEqual(actor.version, 2)
+        self.assertEqual(actor.table.to_json(), self.table.to_json())
+        await self.stop(actor)
@@ -1,9 +1,10 @@
 from django.shortcuts import render, redirect
-from django.http import HttpRequest, HttpResponseBadRequest, HttpResponse
+from django.http import HttpRequest, HttpResponseBadRequest, HttpResponse, Http404
 
 from .models import *
-import engine.Table as EngineTable
-import engine.Player as EnginePlayer
+from .metrics import metrics
+from .profiling import profiler
+from .matchmaking import matchmaker, start_room, PLAYERS_COUNTS
 
 # home page where user can choose players count and join appropriate waiting room
 def index(request: HttpRequest):
@@ -14,7 +15,7 @@ def index(request: HttpRequest):
         players_count_room = request.POST['players_count']
         
         # Validate that the players count is provided and is either 2, 3, or 4
-        if not players_count_room or (players_count_room not in ['2','3','4']):
+        if not players_count_room or (players_count_room not in [str(c) for c in PLAYERS_COUNTS]):
             return render(request, 'index.html', {'error_msg': 'Options available are: 2, 3 or 4'}, status=400)
         # If the user is not authenticated and no username is provided, return an error
         if not request.user.is_authenticated and not request.POST['username']:
@@ -22,20 +23,17 @@ def index(request: HttpRequest):
         
         players_count_room = int(players_count_room)
         
-        # Try to find an available room that matches the player count and is still waiting for players
-        available_room = Room.objects.filter(max_players_count=players_count_room, is_waiting=True).first()
-        if not available_room: # If no such room exists, create a new one
-            available_room = Room(max_players_count=players_count_room, is_waiting=True)
-            available_room.save()
-            
+        # Take a seat in a waiting room of this size (assigned in memory, see durak.matchmaking)
+        room_id = matchmaker.join(players_count_room)
+
         player = None
         if request.user.is_authenticated:  # If the user is authenticated, create a Player entry linked to their user account
-            player = Player(user=request.user, anonymous_user=None, room=available_room)
+            player = Player(user=request.user, anonymous_user=None, room_id=room_id)
         else: # If the user is anonymous, create a temporary AnonymousUser profile
             anonymous_profile = AnonymousUser(name=request.POST['username'])
             anonymous_profile.save()
             
-            player = Player(user=None, anonymous_user=anonymous_profile, room=available_room)
+            player = Player(user=None, anonymous_user=anonymous_profile, room_id=room_id)
             
         player.save()
         
@@ -60,28 +58,33 @@ def waiting_room(request: HttpRequest):
     
     return render(request, 'waiting_room.html', {'max_players_count': player.room.max_players_count})
 
+@profiler.profiled('start_durakgame')
 def start_durakgame(request):
     player = get_valid_player(request)
     if not player:  # redirect to index if the player doesn't exist or is not in the correct room
         return redirect('index')
 
     room = player.room
-    players = Player.objects.filter(room=room).all() # all players
+    if not room.has_table():
+        if room.is_waiting: # room is still waiting for players (table is dealt when it fills, see matchmaking.start_room)
+            return redirect('waiting_room')
 
-    if room.game_state == {}: # if game state is empty
-        # construct list of players for engine
-        engine_players: list[EnginePlayer.Player] = []
-        for p in players:
-            p = EnginePlayer.Player(str(p), str(p.id))
-            engine_players.append(p)
-        # create table object
-        table = EngineTable.Table(engine_players)
-
-        # save table state to database
-        room.game_state = table.to_json()
-        room.save()
+        # room filled before its waiting room dealt tables (it was left without one), the first page load deals it
+        start_room(room.id)
+        room.refresh_from_db()
 
+    roster = room.roster or [ # rooms started before rosters were stored
+        p.group() for p in Player.objects.filter(room=room).select_related('user', 'anonymous_user')
+    ]
     indexed_players = [ # indexing players (despite requesting one) to easily display them
-        {"player": p, "index": i} for i, p in enumerate([p for p in players if p.id != player.id])
+        {"player": p, "index": i} for i, p in enumerate([p for p in roster if p['id'] != str(player.id)])
     ]
-    return render(request, 'durak_game.html', {'room': room, 'indexed_players': indexed_players, 'player': player})
\ No newline at end of file
+    return render(request, 'durak_game.html', {'room': room, 'indexed_players': indexed_players, 'player': player})
+
+
+# metrics of this process in prometheus text format (scraped by monitoring, see durak.metrics)
+def export_metrics(request: HttpRequest):
+    if not metrics.enabled():
+        raise Http404("Metrics are disabled")
+
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
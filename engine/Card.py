@@ -1,4 +1,5 @@
 from enum import Enum
+from functools import cache
 
 # helper enums for Card class
 class CardSuit(Enum):
@@ -18,13 +19,46 @@ class CardRank(Enum):  # only six-ace because classical Durak don't use two-five
     KING = 13
     ACE = 14
 
+# compact encoding: every card is an integer 0-35 (suit-major), so sets of cards fit into one 64-bit integer (bitset)
+RANKS_COUNT = len(CardRank)
+CARDS_COUNT = len(CardSuit) * RANKS_COUNT
+NO_CARD_ID = 0xFF # byte used in binary encoding instead of missing card (e.g. not beaten bottom card)
+
 # class representing game card
+# there are only 36 different cards, so every card is created once (flyweight) and shared by every deck, hand and table
 class Card:
     str_separator = '_'
+    __slots__ = ('__suit', '__rank', '__id', '__bit', '__rank_bit', '__str')
+
+    __by_id: list = [None] * CARDS_COUNT # card id => shared instance
+    __by_string: dict = {} # string representation => shared instance
+
+    def __new__(cls, suit: CardSuit, rank: CardRank):
+        card_id = (suit.value - CardSuit.HEARTS.value) * RANKS_COUNT + (rank.value - CardRank.SIX.value) # compact integer code
+        card = Card.__by_id[card_id]
+        if card is not None: # card was already created, share it
+            return card
+
+        card = super().__new__(cls)
+        card.__suit = suit # set the private suit field
+        card.__rank = rank # set the private rank field
+        card.__id = card_id
+        card.__bit = 1 << card_id
+        card.__rank_bit = 1 << (rank.value - CardRank.SIX.value)
+        card.__str = f"{rank.name}{Card.str_separator}{suit.name}"
+
+        Card.__by_id[card_id] = card
+        Card.__by_string[card.__str] = card
+        return card
+
+    def get_id(self) -> int: # compact integer code (0-35)
+        return self.__id
 
-    def __init__(self, suit: CardSuit, rank: CardRank):
-        self.__suit: CardSuit = suit # set the private suit field
-        self.__rank: CardRank = rank # set the private rank field
+    def get_bit(self) -> int: # bit of the card inside of cards bitset
+        return self.__bit
+
+    def get_rank_bit(self) -> int: # bit of the card rank inside of ranks bitset (9 bits, six-ace)
+        return self.__rank_bit
 
     def get_suit(self): # suit getter
         return self.__suit
@@ -33,32 +67,74 @@ class Card:
         return self.__rank
 
     def __str__(self): #string representation (match names of card images)
-        return f"{self.__rank.name}_{self.__suit.name}"
+        return self.__str
+
+    def __repr__(self):
+        return self.__str
 
     @classmethod
-    def from_string(cls, str_representation: str): # construct card from string representation
+    def from_string(cls, str_representation: str): # get card from string representation
         if str_representation == 'None':
             return None
 
-        str_representation = str_representation.upper()
+        card = Card.__by_string.get(str_representation)
+        if card is None: # lookup is case insensitive, but exact names are the common case
+            card = Card.__by_string.get(str_representation.upper())
+            if card is None:
+                raise ValueError("Invalid string representation")
 
-        if Card.str_separator not in str_representation: # check if string is valid
-            raise ValueError("Invalid string representation")
+        return card
 
-        parts = str_representation.split(Card.str_separator) #split into 2 parts
-        if len(parts) != 2: #validate
-            raise ValueError("Invalid string representation")
+    @classmethod
+    def from_id(cls, card_id: int): # get card from compact integer code
+        if card_id < 0 or card_id >= CARDS_COUNT:
+            raise ValueError("Invalid card id")
 
-        rank = parts[0]
-        suit = parts[1]
+        return Card.__by_id[card_id]
 
-        return cls(CardSuit(CardSuit[suit]), CardRank(CardRank[rank])) # call constructor with enum values
+    def __reduce__(self): # keep cards shared after pickling/copying (e.g. for multiprocessing)
+        return Card.from_id, (self.__id,)
 
     def __eq__(self, other):
-        if not isinstance(other, Card):
-            return False
-
-        return self.__suit == other.__suit and self.__rank == other.__rank
+        return self is other
 
     def __hash__(self):
-        return hash(str(self))
\ No newline at end of file
+        return self.__id
+
+
+# create every card up front, so lookups never allocate
+for _suit in CardSuit:
+    for _rank in CardRank:
+        Card(_suit, _rank)
+
+CARDS_BY_ID: tuple[Card, ...] = tuple(Card.from_id(i) for i in range(CARDS_COUNT)) # card id => card, for decoding many ids at once
+
+
+@cache # computed once per trump suit
+def beats_table(trump_suit: CardSuit) -> tuple[int, ...]: # card id => bitset of cards beating it (36x36 "beats" matrix packed into rows)
+    table = []
+    for bottom in CARDS_BY_ID:
+        beating = 0
+        for top in CARDS_BY_ID:
+            if top.get_suit() == bottom.get_suit():
+                if top.get_rank().value > bottom.get_rank().value: # higher card of the same suit
+                    beating |= top.get_bit()
+            elif top.get_suit() == trump_suit: # trump beats every other suit
+                beating |= top.get_bit()
+        table.append(beating)
+
+    return tuple(table)
+
+
+def ids_to_mask(card_ids) -> int: # pack iterable of card ids (e.g. bytes) into bitset
+    return sum(map((1).__lshift__, card_ids))
+
+
+def cards_in_mask(mask: int) -> list[Card]: # unpack bitset into list of cards (ordered by id)
+    cards = []
+    while mask:
+        low_bit = mask & -mask
+        cards.append(Card.from_id(low_bit.bit_length() - 1))
+        mask ^= low_bit
+
+    return cards
@@ -6,7 +6,8 @@ from .Card import *
 
 # class representing cards deck (the main one, where players take cards)
 class Deck:
-    def __init__(self, deck: (list[Card]) | None = None, trump: (Card | None)= None):
+    # new deck is shuffled by given random generator, by new generator seeded with given seed or by global one
+    def __init__(self, deck: (list[Card]) | None = None, trump: (Card | None)= None, seed: (int | None) = None, rng: (random.Random | None) = None):
         if deck is None:
             self.__deck = [] # create stack because cards are always taken from the top
 
@@ -17,27 +18,57 @@ class Deck:
                         Card(CardSuit(suit_i), CardRank(rank_i))
                     )
 
-            random.shuffle(self.__deck) # shuffle deck
+            if rng is None and seed is not None:
+                rng = random.Random(seed)
+            (rng.shuffle if rng is not None else random.shuffle)(self.__deck) # shuffle deck
             self.__trump = Card(self.__deck[0].get_suit(), self.__deck[0].get_rank())  # select trump (card with most valuable suit)
         else:
             self.__deck = deck
             self.__trump = trump
 
+        self.__mask: int = sum(map(Card.get_bit, self.__deck)) # bitset of cards left in deck (cards are unique, so sum equals bitwise or)
+
     def get_trump(self) -> Card: # trump getter
         return self.__trump
 
     def cards_available(self) -> int: # how many cards left in deck
         return len(self.__deck)
 
+    def get_cards(self) -> list[Card]: # cards from the bottom (trump) to the top
+        return self.__deck
+
+    def get_mask(self) -> int: # bitset of cards left in deck
+        return self.__mask
+
+    def has_card(self, card: Card) -> bool: # check if card is still in deck
+        return card is not None and self.__mask & card.get_bit() != 0
+
     def take_card(self) -> Card: # take card (or nothing) from deck
         if self.cards_available() <= 0:
             raise IndexError("No cards available")
 
-        return self.__deck.pop()
+        card = self.__deck.pop()
+        self.__mask &= ~card.get_bit()
+        return card
 
     def add_card_left(self, card: Card): # add cards to the bottom of the deck
         # trump should be always at the bottom
         self.__deck.insert(1, card)
+        self.__mask |= card.get_bit()
+
+    def put_card(self, card: Card): # put card back on the top (undo of take_card)
+        self.__deck.append(card)
+        self.__mask |= card.get_bit()
+
+    def remove_card_left(self): # undo of add_card_left (card added to empty deck is the first one)
+        self.__mask &= ~self.__deck.pop(1 if len(self.__deck) > 1 else 0).get_bit()
+
+    def clone(self) -> 'Deck': # copy with its own list of cards (cards are shared)
+        deck = Deck.__new__(Deck)
+        deck.__deck = list(self.__deck)
+        deck.__trump = self.__trump
+        deck.__mask = self.__mask
+        return deck
 
     def to_json(self, sensible_data = False):
         data = {
@@ -55,10 +86,18 @@ class Deck:
 
     @classmethod
     def from_json(cls, data: dict):
-        deck = data['deck']
+        deck = [Card.from_string(c) for c in data['deck']] # cards are shared instances, only the list is allocated
         trump = Card.from_string(data['trump'])
 
-        for i in range(0, len(deck)):
-            deck[i] = Card.from_string(deck[i])
-
         return cls(deck, trump)
+
+    def to_bytes(self) -> bytes: # trump id, cards count and card ids from the bottom to the top
+        return bytes((self.__trump.get_id(), len(self.__deck))) + bytes(map(Card.get_id, self.__deck))
+
+    @classmethod
+    def from_bytes(cls, data: bytes, offset: int = 0): # returns deck and offset right after it
+        trump = Card.from_id(data[offset])
+        length = data[offset + 1]
+        deck = list(map(CARDS_BY_ID.__getitem__, data[offset + 2:offset + 2 + length]))
+
+        return cls(deck, trump), offset + 2 + length
@@ -1,7 +1,9 @@
 import json
+import re
 
 from .Card import *
 
+UUID_PATTERN = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}') # canonical form (the only one that survives packing to 16 bytes)
 
 class Player:
     def __init__(self, name: str, player_id: str, hand=None):
@@ -10,7 +12,9 @@ class Player:
         self.player_name: str = name
         self.__id: str = player_id
 
-        self.__hand: list[Card] = [Card.from_string(c) for c in hand]
+        self.__hand: list[Card] = [Card.from_string(c) for c in hand] # ordered hand (order is kept for displaying)
+        self.__header: (tuple[str, bytes] | None) = None # cached (name, encoded id and name) for to_bytes
+        self.__hand_mask: int = sum(map(Card.get_bit, self.__hand)) # bitset of cards in hand for constant time membership checks
 
     def get_id(self) -> str:
         return self.__id
@@ -21,23 +25,52 @@ class Player:
     def get_hand(self) -> list[Card]:
         return self.__hand
 
+    def set_hand(self, cards: list[Card]): # replace the whole hand (e.g. with guessed cards of opponent)
+        self.__hand = cards
+        self.__hand_mask = sum(map(Card.get_bit, cards))
+
     def hands_len(self) -> int:
         return len(self.__hand)
 
+    def get_hand_mask(self) -> int:
+        return self.__hand_mask
+
     def take_card(self, card: Card):
         self.__hand.append(card)
+        self.__hand_mask |= card.get_bit()
+
+    def throw_card(self, card: Card) -> Card:
+        if not self.have_card(card):
+            raise ValueError("Card is not in player's hand.")
 
-    def throw_card(self, card: Card):
         self.__hand.remove(card)
+        self.__hand_mask &= ~card.get_bit()
+        return card
+
+    def put_card(self, index: int, card: Card): # put card back to its place in hand (undo of throw_card)
+        self.__hand.insert(index, card)
+        self.__hand_mask |= card.get_bit()
+
+    def drop_last_card(self): # remove the last taken card (undo of take_card)
+        self.__hand_mask &= ~self.__hand.pop().get_bit()
+
+    def clone(self) -> 'Player': # copy with its own hand (cards are shared)
+        player = Player.__new__(Player)
+        player.player_name = self.player_name
+        player.__id = self.__id
+        player.__hand = list(self.__hand)
+        player.__header = self.__header
+        player.__hand_mask = self.__hand_mask
+        return player
 
     def have_card(self, card: Card) -> bool:
-        return card in self.__hand
+        return card is not None and self.__hand_mask & card.get_bit() != 0
 
     def __eq__(self, other) -> bool:
-        return self.get_id() == other.get_id() and self.get_hand() == other.get_hand() and self.player_name == other.player_name
+        return self.get_id() == other.get_id() and self.__hand_mask == other.get_hand_mask() and self.player_name == other.player_name
 
-    def __hash__(self):
-        return hash(str(self))
+    def __hash__(self): # id is the only field that never changes (hand changes while player is stored in refill_players_order)
+        return hash(self.__id)
 
     def to_json(self, player_id = None): # convert user data to dict
         data = {
@@ -50,10 +83,63 @@ class Player:
 
         return data
 
+    def to_publicjson(self): # data every player can see
+        return {
+            'id': self.get_id(),
+            'name': self.get_name(),
+            'hand_len': self.hands_len(),
+        }
+
     def __str__(self):
         data = self.to_json()
         return str(data)
 
     @classmethod
     def from_json(cls, data: dict):
-        return cls(data['name'], data['id'], data['hand'])
\ No newline at end of file
+        return cls(data['name'], data['id'], data['hand'])
+
+    def to_bytes(self) -> bytes: # compact binary representation (see Table.to_bytes)
+        header = self.__header
+        if header is None or header[0] != self.player_name: # id and name never change in game, encode them once
+            header = (self.player_name, Player.__encode_header(self.get_id(), self.player_name))
+            self.__header = header
+
+        return header[1] + bytes((self.hands_len(),)) + bytes(map(Card.get_id, self.get_hand()))
+
+    @staticmethod
+    def __encode_header(player_id: str, player_name: str) -> bytes:
+        name = player_name.encode()
+
+        if UUID_PATTERN.fullmatch(player_id): # ids are uuids in the game, pack them to 16 bytes (length 0 marks uuid)
+            id_bytes = b'\x00' + bytes.fromhex(player_id.replace('-', ''))
+        else: # any other id is stored as length-prefixed string
+            id_bytes = player_id.encode()
+            if len(id_bytes) == 0 or len(id_bytes) > 255:
+                raise ValueError("Player id must be 1-255 bytes long to encode")
+            id_bytes = bytes((len(id_bytes),)) + id_bytes
+
+        return id_bytes + len(name).to_bytes(2, 'big') + name
+
+    @classmethod
+    def from_bytes(cls, data: bytes, offset: int = 0): # returns player and offset right after it
+        id_len = data[offset]
+        offset += 1
+        if id_len == 0:
+            h = bytes(data[offset:offset + 16]).hex()
+            player_id = f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+            offset += 16
+        else:
+            player_id = bytes(data[offset:offset + id_len]).decode()
+            offset += id_len
+
+        name_len = int.from_bytes(data[offset:offset + 2], 'big')
+        name = bytes(data[offset + 2:offset + 2 + name_len]).decode()
+        offset += 2 + name_len
+
+        hand_len = data[offset]
+        hand_ids = data[offset + 1:offset + 1 + hand_len]
+        player = cls(name, player_id)
+        player.__hand = list(map(CARDS_BY_ID.__getitem__, hand_ids))
+        player.__hand_mask = ids_to_mask(hand_ids)
+
+        return player, offset + 1 + hand_len
@@ -1,10 +1,11 @@
 import json
+import random
 
 from .Deck import *
 from .Player import *
 
 class Table:
-    def __init__(self, players: list[Player] = None):
+    def __init__(self, players: list[Player] = None, seed: (int | None) = None, rng: (random.Random | None) = None): # seed or rng make deal reproducible
         if players is None: # default constructor
             self.deck = None
             self.players = None
@@ -15,10 +16,13 @@ class Table:
             self.defender_hand_starting_len = None
             self.finished_player_ids = None
             self.defender_takes = None
+            self.__table_ranks = 0
+            self.event_listener = None
+            self.__journal = None
 
             return
 
-        self.deck = Deck() # deck laying on table
+        self.deck = Deck(seed=seed, rng=rng) # deck laying on table
 
         if len(players) < 2 or len(players) > 4: # validate players count
             raise ValueError("Table needs at least 2 and at most 4 players.")
@@ -26,6 +30,7 @@ class Table:
         self.players: list[Player] = players # list of players
         self.winners: list[Player] = [] # players left with no cards (while deck is also empty)
         self.attack_state: dict[Card, (Card | None)] = dict() # attack state represent cards laying on table when player attacks another one. Visually, to "beat" card, the player have to put higher value card on top of bottom one
+        self.__table_ranks: int = 0 # bitset of ranks of every card inside attack_state (to validate additional cards with one bit operation)
         self.attacks_number: int = 0 # the number of attacks was made
         self.refill_players_order: dict[Player, None] = dict() # ordered set to keep track of throwing order to properly refill cards after attack
 
@@ -53,10 +58,113 @@ class Table:
         self.defender_hand_starting_len = 6 # how many cards defender has at the beginning of attack
         self.finished_player_ids: list[str] = [] # array of player ids who don't want to throw any additional cards
         self.defender_takes = False # determines if defender wants to take all cards
+        self.event_listener = None # function called with compact event (tuple) after every move, see apply_event
+        self.__journal: (list | None) = None # undo operations of the move being made by make_move
+
+    def __emit(self, *event): # notify listener about the move (e.g. to append it to the moves log)
+        if self.event_listener is not None:
+            self.event_listener(event)
+
+    def apply_event(self, event: (list | tuple)): # repeat move described by emitted event
+        action = event[0]
+        if action == 'play_turn':
+            self.play_turn(Card.from_id(event[1]))
+        elif action == 'defend':
+            self.defend(Card.from_id(event[1]), Card.from_id(event[2]))
+        elif action == 'throw_additional':
+            self.throw_additional(event[1], Card.from_id(event[2]))
+        elif action == 'take_cards':
+            self.defender_take_cards()
+        elif action == 'finished':
+            self.player_finished(event[1])
+        elif action == 'remove_player':
+            self.remove_player(event[1])
+        else:
+            raise ValueError(f"Unknown event: {action}")
+
+    # make move (event, see apply_event) remembering only what it changes, returns record for unmake_move.
+    # Moves have to be unmade in reverse order, listener is notified like after apply_event (search should use clone())
+    def make_move(self, move: (list | tuple)) -> tuple:
+        undo = ((self.__turn, self.attacks_number, self.defender_hand_starting_len, self.defender_takes, self.__table_ranks), [])
+        self.__journal = undo[1]
+        try:
+            self.apply_event(move)
+        except Exception: # invalid move (validation happens before changes, but be safe)
+            self.__journal = None
+            self.unmake_move(undo)
+            raise
+        self.__journal = None
+
+        return undo
+
+    def unmake_move(self, undo: tuple): # restore state from before make_move
+        values, journal = undo
+        for operation in reversed(journal):
+            operation[0](*operation[1:])
+        self.__turn, self.attacks_number, self.defender_hand_starting_len, self.defender_takes, self.__table_ranks = values
+
+    def clone(self) -> 'Table': # independent copy (without listener), cards are shared and only containers are copied
+        table = Table()
+        copies = {id(p): p.clone() for p in self.players + self.winners}
+
+        table.deck = self.deck.clone()
+        table.players = [copies[id(p)] for p in self.players]
+        table.winners = [copies[id(p)] for p in self.winners]
+        table.attack_state = dict(self.attack_state)
+        table.refill_players_order = {copies[id(p)]: None for p in self.refill_players_order}
+        table.__turn = self.__turn
+        table.attacks_number = self.attacks_number
+        table.defender_hand_starting_len = self.defender_hand_starting_len
+        table.finished_player_ids = list(self.finished_player_ids)
+        table.defender_takes = self.defender_takes
+        table.__table_ranks = self.__table_ranks
+
+        return table
 
     def get_turn(self) -> int: # get playing player index
         return self.__turn
 
+    def get_table_ranks(self) -> int: # bitset of ranks laying on the table
+        return self.__table_ranks
+
+    def clear_attack_state(self): # remove every card from the table
+        if self.__journal is not None: # the old dict is kept for undo
+            self.__record(setattr, self, 'attack_state', self.attack_state)
+            self.attack_state = {}
+        else:
+            self.attack_state.clear()
+        self.__table_ranks = 0
+
+    # changes of hands, deck and table which can be undone (see make_move). Every undo operation is (function, *arguments)
+    def __record(self, *undo):
+        if self.__journal is not None:
+            self.__journal.append(undo)
+
+    def __throw_card(self, player: Player, card: Card): # card leaves player's hand
+        if self.__journal is not None:
+            self.__journal.append((player.put_card, player.get_hand().index(card), card))
+        player.throw_card(card)
+
+    def __take_card(self, player: Player, card: Card): # card gets to player's hand
+        player.take_card(card)
+        self.__record(player.drop_last_card)
+
+    def __put_on_table(self, card: Card, player: Player): # attacking card (of attacker or player throwing additional cards)
+        self.attack_state[card] = None
+        self.__table_ranks |= card.get_rank_bit()
+        self.__record(self.attack_state.pop, card)
+
+        if player not in self.refill_players_order: # store order to properly refill cards
+            self.refill_players_order[player] = None
+            self.__record(self.refill_players_order.pop, player)
+
+    def __beats(self) -> tuple[int, ...]: # card id => bitset of cards beating it with current trump
+        return beats_table(self.deck.get_trump().get_suit())
+
+    # according to rules, number of cards in one attack can't be more than number of cards in defender's hand. Maximum cards on table count is 5 (hand length - 1) if attack is first
+    def __attack_limit_reached(self) -> bool:
+        return len(self.attack_state) == self.defender_hand_starting_len - (1 if self.attacks_number == 1 else 0)
+
     def get_next_turn(self) -> int: # get the next player after playing one
         if len(self.players) - 1 == self.__turn: # if index is on the end go at the start
             return 0
@@ -69,13 +177,14 @@ class Table:
             raise ValueError("Cannot play a card that is not in player's hand.")
 
         # put card on table
-        player.throw_card(card)
-        self.attack_state[card] = None
+        self.__throw_card(player, card)
+        self.__put_on_table(card, player)
 
-        self.refill_players_order[player] = None # store order to properly refill cards
         self.attacks_number += 1
         self.defender_hand_starting_len = self.players[self.get_next_turn()].hands_len()
 
+        self.__emit('play_turn', card.get_id())
+
     def defend(self, bottom_card: Card, defender_card: Card): # defender should defend from cards given to him (or take them)
         defender = self.players[self.get_next_turn()]
         if not defender.have_card(defender_card):  # validate if user actually have given card in hand
@@ -87,25 +196,26 @@ class Table:
             raise ValueError("Cannot beat card that is already beaten.")
 
         # check if the defender card is higher (in current hierarchy) then the bottom one
-        if defender_card.get_suit() == bottom_card.get_suit():
-            if defender_card.get_rank().value < bottom_card.get_rank().value:
+        if not self.__beats()[bottom_card.get_id()] & defender_card.get_bit():
+            if defender_card.get_suit() == bottom_card.get_suit():
                 raise ValueError("Defender card has lower rank than the bottom one.")
-        elif defender_card.get_suit() != self.deck.get_trump().get_suit() and defender_card.get_suit() != bottom_card.get_suit():
             raise ValueError("Given card has not valid suit.")
 
         # put card on table
-        defender.throw_card(defender_card)
+        self.__throw_card(defender, defender_card)
         self.attack_state[bottom_card] = defender_card
+        self.__record(self.attack_state.__setitem__, bottom_card, None)
+        self.__table_ranks |= defender_card.get_rank_bit()
 
         self.end_attack_if_possible()
+        self.__emit('defend', bottom_card.get_id(), defender_card.get_id())
 
     def throw_additional(self, throwing_player_id: str, card: Card): # players can throw more cards with the same suit as was before in the attack to defender
         defender = self.players[self.get_next_turn()]
         if defender.get_id() == throwing_player_id: # check if defender and player throwing card have the same id's
             raise ValueError("Defender cannot throw additional cards.")
 
-        # according to rules, number of cards in one attack can't be more than number of cards in defender's hand. Maximum cards on table count is 5 (hand length - 1) if attack is first
-        if len(self.attack_state) == self.defender_hand_starting_len - (1 if self.attacks_number == 1 else 0):
+        if self.__attack_limit_reached():
             raise ValueError("The maximum number of cards on the table was already reached.")
 
         throwing_player = self.search_player(throwing_player_id)
@@ -121,31 +231,25 @@ class Table:
             raise ValueError("You confirmed that you finished with throwing additional cards..")
 
         # according to rules, additional thrown card must have the same rank as one laying on table already (i.e. inside attack_state map)
-        contain_same_ranked_card = False
-        for b_card, t_card in self.attack_state.items():
-            if b_card.get_rank() == card.get_rank() or (t_card is not None and t_card.get_rank() == card.get_rank()): # bottom card can't be None
-                contain_same_ranked_card = True
-                break
-
-        if not contain_same_ranked_card:
+        if not self.__table_ranks & card.get_rank_bit():
             raise ValueError("Cannot throw an additional card with not valid rank.")
 
         # throw card on the table
-        throwing_player.throw_card(card)
-        self.attack_state[card] = None
+        self.__throw_card(throwing_player, card)
+        self.__put_on_table(card, throwing_player)
 
-        self.refill_players_order[throwing_player] = None  # store order to properly refill cards
+        self.__emit('throw_additional', throwing_player_id, card.get_id())
 
     def take_cards(self): # defender is taking all cards from the attack. It means that he can't beat one of them (or just want to take)
         defender = self.players[self.get_next_turn()]
 
         # give all cards from attack to defender's hand
         for b_card, t_card in self.attack_state.items():
-            defender.take_card(b_card)
+            self.__take_card(defender, b_card)
             if t_card is not None:
-                defender.take_card(t_card)
+                self.__take_card(defender, t_card)
 
-        self.attack_state.clear() # clear attack state
+        self.clear_attack_state() # clear attack state
 
     def end_attack(self, defender_picked_up: bool): # should be called when attack is over
         # getting ready to refill hands before self.__turn messes up
@@ -159,26 +263,31 @@ class Table:
             self.take_cards()
             self.__turn = self.get_next_turn() # move turn 2 timer if defender picked up
         else:
-            self.attack_state.clear() # clear attack state
+            self.clear_attack_state() # clear attack state
 
         self.__turn = self.get_next_turn() # change turn to next player
 
         # refill hands
         for player in players_to_refill:
             while player.hands_len() < 6 and self.deck.cards_available() > 0: # while player have less than 6 cards and some cards left in deck
-                player.take_card(self.deck.take_card())
+                card = self.deck.take_card()
+                self.__record(self.deck.put_card, card)
+                self.__take_card(player, card)
 
             player_index = self.players.index(self.search_player(player.get_id()))  # get player index in list to change data
             self.players[player_index] = player
 
             if player.hands_len() == 0: # Players win if no cards left in hand and deck
                 self.winners.append(self.players[player_index])
-                self.players.remove(self.players[player_index])
+                self.__record(self.winners.pop)
+                self.__record(self.players.insert, player_index, self.players.pop(player_index))
 
                 if len(self.players) > 1: # change turn
                     self.__turn = player_index + 1 if (player_index + 1) < len(self.players) else 0
 
         # zero all
+        self.__record(setattr, self, 'finished_player_ids', self.finished_player_ids)
+        self.__record(setattr, self, 'refill_players_order', self.refill_players_order)
         self.finished_player_ids = []
         self.defender_takes = False
         self.refill_players_order = {}
@@ -187,10 +296,13 @@ class Table:
     def defender_take_cards(self):
         self.defender_takes = True
         self.end_attack_if_possible()
+        self.__emit('take_cards')
 
     def player_finished(self, player_id: str):
         self.finished_player_ids.append(player_id)
+        self.__record(self.finished_player_ids.pop)
         self.end_attack_if_possible()
+        self.__emit('finished', player_id)
 
     # check everything to end attack and end if possible
     def end_attack_if_possible(self):
@@ -206,6 +318,70 @@ class Table:
                 self.end_attack(False)
             elif self.defender_takes:
                 self.end_attack(True)
+    # legal moves: the same checks as play_turn, defend, throw_additional and defender_take_cards do,
+    # so client can block illegal move before sending it
+    def legal_attacks(self) -> list[Card]: # cards attacker can start the attack with
+        if len(self.players) < 2 or len(self.attack_state) > 0:
+            return []
+
+        return list(self.players[self.__turn].get_hand())
+
+    def legal_defenses(self, bottom_card: Card) -> list[Card]: # defender's cards which can beat given card on the table
+        if len(self.players) < 2 or bottom_card not in self.attack_state or self.attack_state[bottom_card] is not None:
+            return []
+
+        defender = self.players[self.get_next_turn()]
+        beating = self.__beats()[bottom_card.get_id()] & defender.get_hand_mask()
+        if not beating:
+            return []
+
+        return [c for c in defender.get_hand() if c.get_bit() & beating]
+
+    def legal_throws(self, player_id: str) -> list[Card]: # cards given player can throw to defender now
+        if len(self.players) < 2 or len(self.attack_state) == 0 or self.__attack_limit_reached() or player_id in self.finished_player_ids:
+            return []
+        if self.players[self.get_next_turn()].get_id() == player_id: # defender can't throw
+            return []
+
+        player = self.search_player(player_id)
+        if player is None:
+            return []
+
+        return [c for c in player.get_hand() if c.get_rank_bit() & self.__table_ranks]
+
+    def can_take(self) -> bool: # defender can take cards (attack started and something is not beaten yet)
+        if len(self.players) < 2 or self.defender_takes:
+            return False
+
+        return any(t_card is None for t_card in self.attack_state.values())
+
+    # whose decision it is and what can be done, moves are events (see apply_event), so table.apply_event(move) makes one.
+    # Attacker starts the attack, then defender beats cards (or takes them) and when nothing is left to beat
+    # other players throw additional cards or finish one-by-one starting from the attacker
+    def legal_moves(self) -> tuple[(str | None), list[tuple]]:
+        if len(self.players) < 2: # game is over
+            return None, []
+
+        if len(self.attack_state) == 0:
+            return self.players[self.__turn].get_id(), [('play_turn', c.get_id()) for c in self.legal_attacks()]
+
+        defender = self.players[self.get_next_turn()]
+        if self.can_take():
+            moves = [('defend', b.get_id(), t.get_id()) for b, t_card in self.attack_state.items() if t_card is None for t in self.legal_defenses(b)]
+            moves.append(('take_cards',))
+            return defender.get_id(), moves
+
+        for i in range(len(self.players)):
+            player = self.players[(self.__turn + i) % len(self.players)]
+            if player is defender or player.get_id() in self.finished_player_ids:
+                continue
+
+            moves = [('throw_additional', player.get_id(), c.get_id()) for c in self.legal_throws(player.get_id())]
+            moves.append(('finished', player.get_id()))
+            return player.get_id(), moves
+
+        return None, []
+
     '''
             self.deck = None
             self.players = None
@@ -224,31 +400,41 @@ class Table:
 
         if player is None: # remove player from winners list
             winner = self.search_winner(player_id)
+            self.__record(self.winners.insert, self.winners.index(winner), winner)
             self.winners.remove(winner)
+            self.__emit('remove_player', player_id)
 
             return
 
         player_index = self.players.index(player)
         if (player_index < len(self.players) and self.get_next_turn() < len(self.players)) and self.players[player_index] == self.players[self.get_next_turn()]: # player is defender
-            self.attack_state.clear()
+            self.clear_attack_state()
 
-        for c in self.players[player_index].get_hand(): # put cards from hand to the bottom of the deck
-            self.deck.add_card_left(self.players[player_index].throw_card(c))
+        for c in list(self.players[player_index].get_hand()): # put cards from hand to the bottom of the deck (iterate over copy, hand is changing)
+            self.__throw_card(self.players[player_index], c)
+            self.deck.add_card_left(c)
+            self.__record(self.deck.remove_card_left)
 
         if self.players[player_index] in self.refill_players_order:
+            self.__record(setattr, self, 'refill_players_order', dict(self.refill_players_order))
             self.refill_players_order.pop(self.players[player_index]) # remove from refill set
 
         if len(self.players) > 1:  # change turn
             self.__turn = player_index + 1 if (player_index + 1) < len(self.players) else 0
 
         if player_id in self.finished_player_ids:
+            self.__record(self.finished_player_ids.insert, self.finished_player_ids.index(player_id), player_id)
             self.finished_player_ids.remove(player_id)
 
+        self.__record(self.players.insert, player_index, player)
         self.players.remove(player)
 
         if len(self.players) == 1: # if only one player left
             self.winners.append(self.players[0]) # he is a winner
-            self.players.remove(self.players[0])
+            self.__record(self.winners.pop)
+            self.__record(self.players.insert, 0, self.players.pop(0))
+
+        self.__emit('remove_player', player_id)
 
     def search_player(self, player_id: str): # search the player with given id
         for player in self.players:
@@ -265,16 +451,16 @@ class Table:
         return None
 
 
-    def to_safejson(self, player_id: str): # convert to json excluding sensible fields like every player's hand
+    def to_publicjson(self): # convert to json excluding every player's hand (the same for every player, so it can be serialized once)
         data = {
             "deck": self.deck.to_json(sensible_data=True),
-            "players": [p.to_json(player_id) for p in self.players],
-            'winners': [p.to_json(player_id) for p in self.winners],
+            "players": [p.to_publicjson() for p in self.players],
+            'winners': [p.to_publicjson() for p in self.winners],
             "attack_state": [[str(bottom_c), str(top_c)] for bottom_c, top_c in self.attack_state.items()],
             "attacks_number": self.attacks_number,
             "turn": self.get_turn(),
             'next_turn': self.get_next_turn(),
-            "refill_players_order": [p.to_json() for p in self.refill_players_order.keys()],
+            "refill_players_order": [p.to_publicjson() for p in self.refill_players_order.keys()],
             'defender_hand_starting_len': self.defender_hand_starting_len,
             'finished_player_ids': self.finished_player_ids,
             'defender_takes': self.defender_takes,
@@ -282,6 +468,15 @@ class Table:
 
         return data
 
+    def to_safejson(self, player_id: str): # convert to json excluding sensible fields like every player's hand (despite given player's one)
+        data = self.to_publicjson()
+        for key, players in (('players', self.players), ('winners', self.winners)):
+            for i, player in enumerate(players):
+                if player.get_id() == player_id:
+                    data[key][i] = player.to_json(player_id)
+
+        return data
+
     def to_json(self): # convert table to dictionary to store in database
         data = {
             "deck": self.deck.to_json(),
@@ -315,10 +510,12 @@ class Table:
         table.attack_state = {
             Card.from_string(state[0]): Card.from_string(state[1]) for state in data["attack_state"]
         } # recreate attack state
+        for b_card, t_card in table.attack_state.items(): # recreate ranks bitset
+            table.__table_ranks |= b_card.get_rank_bit() | (t_card.get_rank_bit() if t_card is not None else 0)
         table.attacks_number = data["attacks_number"]
         table.__turn = data["turn"]
-        table.refill_players_order = {
-            Player.from_json(p): None for p in data["refill_players_order"]
+        table.refill_players_order = { # refill order references players from the list instead of their copies
+            (table.search_player(p['id']) or Player.from_json(p)): None for p in data["refill_players_order"]
         }
         table.defender_hand_starting_len = data["defender_hand_starting_len"]
         table.finished_player_ids = data["finished_player_ids"]
@@ -326,6 +523,111 @@ class Table:
 
         return table
 
+    # binary format (all numbers are unsigned bytes unless said otherwise):
+    # magic 'DT', version, flags (bit 0 - defender_takes), turn, attacks_number (2 bytes), defender_hand_starting_len,
+    # deck (see Deck.to_bytes), players and winners (count + Player.to_bytes each), attack_state (count + bottom/top card id pairs),
+    # refill_players_order and finished_player_ids (count + seat index in players + winners each)
+    BYTES_MAGIC = b'DT'
+    BYTES_VERSION = 1
+    UNKNOWN_SEAT = 0xFF # seat index marking that length-prefixed player id follows (id of player not sitting at the table)
+
+    @staticmethod
+    def is_bytes(data) -> bool: # check if stored state is in binary format
+        return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:2]) == Table.BYTES_MAGIC
+
+    def __seat_refs(self, player_ids: list[str]) -> bytes: # encode players by their seat instead of full data
+        seats = {p.get_id(): i for i, p in enumerate(self.players + self.winners)}
+        data = bytearray((len(player_ids),))
+        for player_id in player_ids:
+            if player_id in seats:
+                data.append(seats[player_id])
+            else:
+                encoded_id = player_id.encode()
+                data += bytes((Table.UNKNOWN_SEAT, len(encoded_id))) + encoded_id
+
+        return bytes(data)
+
+    @staticmethod
+    def __read_seat_refs(data: bytes, offset: int, seats: list[Player]): # returns list of player ids and offset right after them
+        player_ids = []
+        count = data[offset]
+        offset += 1
+        for _ in range(count):
+            seat = data[offset]
+            if seat == Table.UNKNOWN_SEAT:
+                id_len = data[offset + 1]
+                player_ids.append(bytes(data[offset + 2:offset + 2 + id_len]).decode())
+                offset += 2 + id_len
+            else:
+                player_ids.append(seats[seat].get_id())
+                offset += 1
+
+        return player_ids, offset
+
+    def to_bytes(self) -> bytes: # compact versioned alternative to to_json (for storing in database)
+        data = bytearray(Table.BYTES_MAGIC)
+        data += bytes((Table.BYTES_VERSION, 1 if self.defender_takes else 0, self.get_turn()))
+        data += self.attacks_number.to_bytes(2, 'big')
+        data.append(self.defender_hand_starting_len)
+        data += self.deck.to_bytes()
+
+        for players in (self.players, self.winners):
+            data.append(len(players))
+            for player in players:
+                data += player.to_bytes()
+
+        data.append(len(self.attack_state))
+        for bottom_c, top_c in self.attack_state.items():
+            data += bytes((bottom_c.get_id(), NO_CARD_ID if top_c is None else top_c.get_id()))
+
+        data += self.__seat_refs([p.get_id() for p in self.refill_players_order.keys()])
+        data += self.__seat_refs(self.finished_player_ids)
+
+        return bytes(data)
+
+    @classmethod
+    def from_bytes(cls, data: bytes): # initialize table with data from to_bytes
+        if not Table.is_bytes(data):
+            raise ValueError("Data is not a binary table state")
+        if data[2] != Table.BYTES_VERSION:
+            raise ValueError(f"Unsupported binary table state version: {data[2]}")
+
+        table = cls() # construct table
+        table.defender_takes = data[3] & 1 == 1
+        table.__turn = data[4]
+        table.attacks_number = int.from_bytes(data[5:7], 'big')
+        table.defender_hand_starting_len = data[7]
+        table.deck, offset = Deck.from_bytes(data, 8)
+
+        table.players = []
+        table.winners = []
+        for players in (table.players, table.winners):
+            count = data[offset]
+            offset += 1
+            for _ in range(count):
+                player, offset = Player.from_bytes(data, offset)
+                players.append(player)
+
+        table.attack_state = {}
+        count = data[offset]
+        offset += 1
+        for _ in range(count):
+            bottom_c = Card.from_id(data[offset])
+            top_c = None if data[offset + 1] == NO_CARD_ID else Card.from_id(data[offset + 1])
+            table.attack_state[bottom_c] = top_c
+            table.__table_ranks |= bottom_c.get_rank_bit() | (top_c.get_rank_bit() if top_c is not None else 0)
+            offset += 2
+
+        seats = table.players + table.winners
+        refill_ids, offset = Table.__read_seat_refs(data, offset, seats)
+        by_id = {p.get_id(): p for p in seats}
+        table.refill_players_order = { # like from_json, players not sitting at the table are kept (only their id is stored)
+            by_id.get(player_id) or Player(player_id, player_id): None for player_id in refill_ids
+        }
+        table.finished_player_ids, offset = Table.__read_seat_refs(data, offset, seats)
+
+        return table
+
 
 
 """
@@ -0,0 +1,527 @@
+import argparse
+import json
+import sys
+import time
+from functools import cache
+
+try:
+    import numpy as np
+except ImportError: # numpy is optional, only this backend needs it
+    np = None
+
+from .Table import *
+
+
+# second engine backend: many games of the same players count played in lockstep, every game is a row of numpy arrays
+# and every move is applied to all games at once. Rules (including their quirks) are the same as in Table,
+# which is checked move for move by the differential tests (see durak/tests.py).
+# Seats are numbered from 0 and seat s plays as player with id 'p{s}' (like in engine.sim)
+
+# moves are indexes into one flat space, so legal moves of all games are one boolean matrix (games x MOVES_COUNT)
+PLAY_TURN_OFFSET = 0 # + card id
+DEFEND_OFFSET = PLAY_TURN_OFFSET + CARDS_COUNT # + bottom card id * CARDS_COUNT + top card id
+THROW_OFFSET = DEFEND_OFFSET + CARDS_COUNT * CARDS_COUNT # + card id
+TAKE_MOVE = THROW_OFFSET + CARDS_COUNT
+FINISH_MOVE = TAKE_MOVE + 1
+MOVES_COUNT = FINISH_MOVE + 1
+NO_MOVE = -1 # game is over
+
+# kinds of decisions (see BatchTable.decisions)
+ATTACKING, DEFENDING, THROWING = range(3)
+GAME_OVER = -1
+HAND_SIZE = 6
+
+
+@cache
+def beats_matrix(): # [trump suit index, bottom card id, top card id] => top card beats bottom one (see Card.beats_table)
+    matrix = np.zeros((len(CardSuit), CARDS_COUNT, CARDS_COUNT), dtype=bool)
+    for suit in CardSuit:
+        for bottom_id, beating in enumerate(beats_table(suit)):
+            matrix[suit.value - 1, bottom_id] = [(beating >> top_id) & 1 for top_id in range(CARDS_COUNT)]
+
+    return matrix
+
+
+def card_suits(): # suit index of every card id
+    return np.arange(CARDS_COUNT) // RANKS_COUNT
+
+
+def card_ranks(): # rank index (0 is six) of every card id
+    return np.arange(CARDS_COUNT) % RANKS_COUNT
+
+
+def player_id(seat: int) -> str:
+    return f'p{seat}'
+
+
+def seat_of(player_id: str) -> int:
+    return int(player_id[1:])
+
+
+def encode_move(event: (list | tuple)) -> int: # Table event (see Table.apply_event) => index of the move
+    action = event[0]
+    if action == 'play_turn':
+        return PLAY_TURN_OFFSET + event[1]
+    elif action == 'defend':
+        return DEFEND_OFFSET + event[1] * CARDS_COUNT + event[2]
+    elif action == 'throw_additional':
+        return THROW_OFFSET + event[2]
+    elif action == 'take_cards':
+        return TAKE_MOVE
+    elif action == 'finished':
+        return FINISH_MOVE
+
+    raise ValueError(f"Unsupported event: {action}")
+
+
+class BatchTable:
+    def __init__(self, decks, players_count: int): # decks: games x 36 card ids from the bottom to the top (like Deck)
+        if np is None:
+            raise ImportError("engine.batch needs numpy (pip install numpy)")
+        if players_count < 2 or players_count > 4: # validate players count
+            raise ValueError("Table needs at least 2 and at most 4 players.")
+
+        self.deck = np.array(decks, dtype=np.int8).reshape(-1, CARDS_COUNT)
+        self.games_count = len(self.deck)
+        self.players_count = players_count
+        games = self.games_count
+
+        self.__games = np.arange(games)
+        self.deck_len = np.full(games, CARDS_COUNT, dtype=np.int64) # cards are taken from the end
+        self.trump_suit = self.deck[:, 0] // RANKS_COUNT # bottom card of the deck selects trump
+        self.hands = np.zeros((games, players_count, CARDS_COUNT), dtype=bool) # [game, seat, card id]
+        self.seats = np.tile(np.arange(players_count), (games, 1)) # Table.players as seats (-1 after the last one)
+        self.players_len = np.full(games, players_count, dtype=np.int64)
+        self.winners = np.full((games, players_count), -1, dtype=np.int64) # Table.winners as seats
+        self.winners_len = np.zeros(games, dtype=np.int64)
+        self.bottoms = np.zeros((games, CARDS_COUNT), dtype=bool) # cards attacking defender
+        self.tops = np.full((games, CARDS_COUNT), -1, dtype=np.int8) # bottom card id => card beating it (-1 if unbeaten)
+        self.attacks_number = np.zeros(games, dtype=np.int64)
+        self.refill_order = np.full((games, players_count), -1, dtype=np.int64) # seat => position in Table.refill_players_order
+        self.refill_len = np.zeros(games, dtype=np.int64)
+        self.defender_hand_starting_len = np.full(games, HAND_SIZE, dtype=np.int64)
+        self.finished = np.zeros((games, players_count), dtype=bool) # seat is in Table.finished_player_ids
+        self.defender_takes = np.zeros(games, dtype=bool)
+
+        # give every player 6 cards at the beginning
+        for seat in range(players_count):
+            cards = self.deck[:, CARDS_COUNT - HAND_SIZE * (seat + 1):CARDS_COUNT - HAND_SIZE * seat]
+            self.hands[self.__games[:, None], seat, cards] = True
+        self.deck_len -= HAND_SIZE * players_count
+
+        # player with the least ranked trump card plays turn first (the first one if nobody has trump)
+        trump_ranks = np.where(self.hands & self.trump_mask()[:, None, :], card_ranks(), RANKS_COUNT).min(axis=2)
+        self.turn = np.where(trump_ranks.min(axis=1) < RANKS_COUNT, trump_ranks.argmin(axis=1), 0)
+
+    @classmethod
+    def from_seeds(cls, seeds: list[int], players_count: int): # the same deals as Table(players, seed=seed)
+        decks = [list(Deck(seed=seed).to_bytes()[2:]) for seed in seeds]
+        return cls(decks, players_count)
+
+    @classmethod
+    def shuffled(cls, games: int, players_count: int, rng=None): # deals shuffled by numpy (much faster than from_seeds)
+        rng = rng if rng is not None else np.random.default_rng()
+        return cls(rng.permuted(np.tile(np.arange(CARDS_COUNT), (games, 1)), axis=1), players_count)
+
+    # helpers below work with every game or only with given ones (games is array of indexes, results are in its order)
+    def rows(self, games=None):
+        return self.__games if games is None else games
+
+    def trump_mask(self, games=None): # [game, card id] => card is trump
+        return card_suits() == self.trump_suit[self.rows(games), None]
+
+    def card_strengths(self, games=None): # [game, card id] => cost of giving the card away (trumps are more expensive than any other card)
+        return self.trump_mask(games) * RANKS_COUNT + card_ranks()
+
+    def is_active(self): # game is not over yet
+        return self.players_len >= 2
+
+    def next_turn(self): # Table.get_next_turn of every game
+        return np.where(self.turn == self.players_len - 1, 0, self.turn + 1)
+
+    # turn can point behind the last player after the game is over (like in Table), so seats of such games are garbage
+    def attackers(self): # seat of the attacker in every game
+        return self.seats[self.__games, self.turn % self.players_count]
+
+    def defenders(self): # seat of the defender in every game
+        return self.seats[self.__games, self.next_turn() % self.players_count]
+
+    def unbeaten(self, games=None): # [game, card id] => card is attacking and not beaten
+        games = self.rows(games)
+        return self.bottoms[games] & (self.tops[games] < 0)
+
+    def table_cards(self, games=None): # [game, card id] => card lays on the table (bottom or top)
+        games = self.rows(games)
+        cards = self.bottoms[games]
+        tops = self.tops[games]
+        rows, bottoms = np.nonzero(tops >= 0)
+        cards[rows, tops[rows, bottoms]] = True
+        return cards
+
+    def hands_of(self, seats, games=None): # [game, card id] => card is in hand of given seat (garbage for seat -1)
+        return self.hands[self.rows(games), seats % self.players_count]
+
+    # whose decision it is in every game and what kind of decision (see Table.legal_moves), seat is -1 if game is over
+    def decisions(self):
+        games = self.__games
+        active = self.is_active()
+        defenders = self.defenders()
+
+        attack_empty = ~self.bottoms.any(axis=1)
+        attacking = active & attack_empty
+        defending = active & ~attack_empty & ~self.defender_takes & self.unbeaten().any(axis=1) # Table.can_take
+        throwing = active & ~attack_empty & ~defending
+
+        seats = np.full(self.games_count, -1, dtype=np.int64)
+        phases = np.full(self.games_count, GAME_OVER, dtype=np.int64)
+        seats[attacking] = self.attackers()[attacking]
+        phases[attacking] = ATTACKING
+        seats[defending] = defenders[defending]
+        phases[defending] = DEFENDING
+
+        # other players throw additional cards or finish one-by-one starting from the attacker
+        players_len = np.maximum(self.players_len, 1)
+        for i in range(self.players_count):
+            seat = self.seats[games, (self.turn + i) % players_len]
+            candidate = throwing & (phases == GAME_OVER) & (seat >= 0) & (seat != defenders) & ~self.finished[games, seat]
+            seats[candidate] = seat[candidate]
+            phases[candidate] = THROWING
+
+        return seats, phases
+
+    def throwable(self, seats, games=None): # [game, card id] => given seat can throw the card now (if it's its decision)
+        games = self.rows(games)
+        limit_reached = self.bottoms[games].sum(axis=1, dtype=np.int8) == self.defender_hand_starting_len[games] - (self.attacks_number[games] == 1)
+        table_ranks = self.table_cards(games).reshape(len(games), len(CardSuit), RANKS_COUNT).any(axis=1)
+        return self.hands_of(seats, games) & table_ranks[:, card_ranks()] & ~limit_reached[:, None]
+
+    def beating(self, bottoms, games=None): # [game, card id] => card beats given bottom card of the game
+        return beats_matrix()[self.trump_suit[self.rows(games)], bottoms]
+
+    def defense_counts(self, hands, games=None): # [game, card id] => number of cards in given hands beating the card if it's unbeaten
+        games = self.rows(games)
+        suited = hands.reshape(len(games), len(CardSuit), RANKS_COUNT)
+        higher = suited[:, :, ::-1].cumsum(axis=2, dtype=np.int8)[:, :, ::-1] - suited # cards of the same suit with higher rank
+        trumps = suited[np.arange(len(games)), self.trump_suit[games]].sum(axis=1, dtype=np.int8)
+        counts = higher.reshape(len(games), CARDS_COUNT) + np.where(self.trump_mask(games), 0, trumps[:, None])
+        return np.where(self.unbeaten(games), counts, 0)
+
+    # every legal move (see Table.legal_moves) as boolean matrix games x MOVES_COUNT and seat of the player who makes it.
+    # The matrix is big (defenses are 36 x 36 pairs), policies use decisions and the helpers above instead
+    def legal_moves(self):
+        seats, phases = self.decisions()
+        hands = self.hands_of(seats)
+        legal = np.zeros((self.games_count, MOVES_COUNT), dtype=bool)
+
+        legal[:, PLAY_TURN_OFFSET:DEFEND_OFFSET] = hands & (phases == ATTACKING)[:, None]
+
+        defending = phases == DEFENDING
+        pairs = self.unbeaten()[:, :, None] & beats_matrix()[self.trump_suit] & hands[:, None, :]
+        legal[:, DEFEND_OFFSET:THROW_OFFSET] = pairs.reshape(self.games_count, -1) & defending[:, None]
+        legal[:, TAKE_MOVE] = defending
+
+        throwing = phases == THROWING
+        legal[:, THROW_OFFSET:TAKE_MOVE] = self.throwable(seats) & throwing[:, None]
+        legal[:, FINISH_MOVE] = throwing
+
+        return seats, legal
+
+    # apply one move (see encode_move, NO_MOVE skips the game) of given seat in every game
+    def step(self, seats, moves):
+        seats = np.asarray(seats)
+        moves = np.asarray(moves)
+        games = self.__games
+        attackers = self.attackers()
+        defenders = self.defenders()
+
+        # play turn: attacker puts the first card on the table
+        g = np.flatnonzero((moves >= PLAY_TURN_OFFSET) & (moves < DEFEND_OFFSET))
+        cards = moves[g] - PLAY_TURN_OFFSET
+        self.hands[g, attackers[g], cards] = False
+        self.bottoms[g, cards] = True
+        self.__add_refill(g, attackers[g])
+        self.attacks_number[g] += 1
+        self.defender_hand_starting_len[g] = self.hands[g, defenders[g]].sum(axis=1, dtype=np.int8)
+
+        # defend: defender puts card on top of the bottom one
+        g = np.flatnonzero((moves >= DEFEND_OFFSET) & (moves < THROW_OFFSET))
+        bottoms, tops = np.divmod(moves[g] - DEFEND_OFFSET, CARDS_COUNT)
+        self.hands[g, defenders[g], tops] = False
+        self.tops[g, bottoms] = tops
+        ending = np.zeros(self.games_count, dtype=bool)
+        ending[g] = True
+
+        # throw additional card
+        g = np.flatnonzero((moves >= THROW_OFFSET) & (moves < TAKE_MOVE))
+        cards = moves[g] - THROW_OFFSET
+        self.hands[g, seats[g], cards] = False
+        self.bottoms[g, cards] = True
+        self.__add_refill(g, seats[g])
+
+        # defender takes cards, players finish with throwing
+        taking = moves == TAKE_MOVE
+        self.defender_takes[taking] = True
+        finishing = np.flatnonzero(moves == FINISH_MOVE)
+        self.finished[finishing, seats[finishing]] = True
+        ending |= taking
+        ending[finishing] = True
+
+        self.__end_attack_if_possible(ending)
+
+    def __add_refill(self, games, seats): # Table.refill_players_order[player] = None (position of known player is kept)
+        new = self.refill_order[games, seats] < 0
+        games, seats = games[new], seats[new]
+        self.refill_order[games, seats] = self.refill_len[games]
+        self.refill_len[games] += 1
+
+    def __end_attack_if_possible(self, checked):
+        every_finished = checked & (self.finished.sum(axis=1, dtype=np.int8) == self.players_len - 1) # every player despite defender are finished
+        every_card_beaten = ~self.unbeaten().any(axis=1)
+
+        self.__end_attack(every_finished & every_card_beaten, every_finished & ~every_card_beaten & self.defender_takes)
+
+    def __end_attack(self, beaten, picked_up): # Table.end_attack for games where defender beat everything or picks cards up
+        g = np.flatnonzero(beaten | picked_up)
+        if len(g) == 0:
+            return
+
+        # players to refill in order of throwing, defender is the last one
+        defenders = self.defenders()[g]
+        refill_order = np.where(self.refill_order[g] >= 0, self.refill_order[g], self.players_count)
+        refill_seats = np.full((len(g), self.players_count + 1), -1, dtype=np.int64)
+        refill_seats[:, :self.players_count] = np.where(
+            np.arange(self.players_count) < self.refill_len[g][:, None], np.argsort(refill_order, axis=1, kind='stable'), -1
+        )
+        refill_seats[np.arange(len(g)), self.refill_len[g]] = defenders
+
+        # defender takes every card from the table and turn moves 2 times
+        picking = picked_up[g]
+        gp = g[picking]
+        self.hands[gp, defenders[picking]] |= self.bottoms[gp]
+        rows, bottoms = np.nonzero(self.tops[gp] >= 0)
+        self.hands[gp[rows], defenders[picking][rows], self.tops[gp[rows], bottoms]] = True
+        self.turn[gp] = self.next_turn()[gp]
+
+        self.bottoms[g] = False
+        self.tops[g] = -1
+        self.turn[g] = self.next_turn()[g]
+
+        # refill hands one player after another
+        for position in range(self.players_count + 1):
+            refilled = refill_seats[:, position] >= 0
+            gr, seats = g[refilled], refill_seats[refilled, position]
+
+            taken = np.minimum(np.maximum(HAND_SIZE - self.hands[gr, seats].sum(axis=1, dtype=np.int8), 0), self.deck_len[gr])
+            for i in range(HAND_SIZE):
+                taking = taken > i
+                if not taking.any():
+                    break
+                gt = gr[taking]
+                self.hands[gt, seats[taking], self.deck[gt, self.deck_len[gt] - 1 - i]] = True
+            self.deck_len[gr] -= taken
+
+            # players win if no cards left in hand and deck
+            won = ~self.hands[gr, seats].any(axis=1)
+            gw, seats = gr[won], seats[won]
+            indexes = (self.seats[gw] == seats[:, None]).argmax(axis=1)
+
+            self.winners[gw, self.winners_len[gw]] = seats
+            self.winners_len[gw] += 1
+
+            shifted = np.concatenate((self.seats[gw, 1:], np.full((len(gw), 1), -1)), axis=1)
+            self.seats[gw] = np.where(np.arange(self.players_count) >= indexes[:, None], shifted, self.seats[gw])
+            self.players_len[gw] -= 1
+
+            turn_changes = self.players_len[gw] > 1 # change turn
+            gw, indexes = gw[turn_changes], indexes[turn_changes]
+            self.turn[gw] = np.where(indexes + 1 < self.players_len[gw], indexes + 1, 0)
+
+        # zero all
+        self.finished[g] = False
+        self.defender_takes[g] = False
+        self.refill_order[g] = -1
+        self.refill_len[g] = 0
+
+    def take(self, games): # keep only given games (e.g. drop finished ones, so they don't slow down the rest)
+        for name in ('deck', 'deck_len', 'trump_suit', 'hands', 'seats', 'players_len', 'winners', 'winners_len', 'bottoms', 'tops', 'turn',
+                     'attacks_number', 'refill_order', 'refill_len', 'defender_hand_starting_len', 'finished', 'defender_takes'):
+            setattr(self, name, getattr(self, name)[games])
+        self.games_count = len(self.deck)
+        self.__games = np.arange(self.games_count)
+
+    def game_state(self, game: int) -> dict: # state of one game in the form of table_state
+        players_len = self.players_len[game]
+        cards_on_table = np.flatnonzero(self.bottoms[game])
+        return {
+            'deck': [str(CARDS_BY_ID[c]) for c in self.deck[game, :self.deck_len[game]]],
+            'trump_suit': int(self.trump_suit[game]),
+            'players': [[player_id(s), [str(c) for c in cards_in_mask_array(self.hands[game, s])]] for s in self.seats[game, :players_len]],
+            'winners': [player_id(s) for s in self.winners[game, :self.winners_len[game]]],
+            'attack_state': sorted([str(CARDS_BY_ID[b]), str(CARDS_BY_ID[self.tops[game, b]]) if self.tops[game, b] >= 0 else None] for b in cards_on_table),
+            'attacks_number': int(self.attacks_number[game]),
+            'turn': int(self.turn[game]),
+            'next_turn': int(self.next_turn()[game]),
+            'refill_players_order': [player_id(s) for s in np.argsort(self.refill_order[game])[self.players_count - self.refill_len[game]:]],
+            'defender_hand_starting_len': int(self.defender_hand_starting_len[game]),
+            'finished_player_ids': sorted(player_id(s) for s in np.flatnonzero(self.finished[game])),
+            'defender_takes': bool(self.defender_takes[game]),
+        }
+
+    def durak_seats(self): # seat of the player left with cards (-1 if game isn't over or nobody is left)
+        return np.where(self.players_len == 1, self.seats[:, 0], -1)
+
+
+def cards_in_mask_array(mask) -> list[Card]: # boolean row of card ids => cards in id order
+    return [CARDS_BY_ID[c] for c in np.flatnonzero(mask)]
+
+
+def table_state(table: Table) -> dict: # state of Table comparable with BatchTable.game_state (hands and attack are in card id order)
+    return {
+        'deck': table.deck.to_json()['deck'],
+        'trump_suit': table.deck.get_trump().get_suit().value - 1,
+        'players': [[p.get_id(), [str(c) for c in cards_in_mask(p.get_hand_mask())]] for p in table.players],
+        'winners': [p.get_id() for p in table.winners],
+        'attack_state': sorted([str(b), str(t) if t is not None else None] for b, t in table.attack_state.items()),
+        'attacks_number': table.attacks_number,
+        'turn': table.get_turn(),
+        'next_turn': table.get_next_turn(),
+        'refill_players_order': [p.get_id() for p in table.refill_players_order.keys()],
+        'defender_hand_starting_len': table.defender_hand_starting_len,
+        'finished_player_ids': sorted(table.finished_player_ids),
+        'defender_takes': table.defender_takes,
+    }
+
+
+def pick_nth(mask, n): # index of n-th (from 0) set card in every row
+    return (mask.cumsum(axis=1, dtype=np.int8) > n[:, None]).argmax(axis=1)
+
+
+# batched policies choose one move (index, NO_MOVE if game is over) of the deciding seat in every game,
+# every kind of decision is computed only for games making it
+def random_policy(batch: BatchTable, seats, phases, rng): # uniform over legal moves, like engine.sim.random_policy
+    chance = rng.random(batch.games_count)
+    moves = np.full(batch.games_count, NO_MOVE, dtype=np.int64)
+
+    games = np.flatnonzero(phases == ATTACKING)
+    hands = batch.hands_of(seats[games], games)
+    n = (chance[games] * hands.sum(axis=1, dtype=np.int8)).astype(np.int64)
+    moves[games] = PLAY_TURN_OFFSET + pick_nth(hands, n)
+
+    # defenses of every unbeaten card and taking, n-th one is found in counts of defenses
+    games = np.flatnonzero(phases == DEFENDING)
+    rows = np.arange(len(games))
+    hands = batch.hands_of(seats[games], games)
+    counts = batch.defense_counts(hands, games)
+    counts_sums = counts.cumsum(axis=1, dtype=np.int16)
+    n = (chance[games] * (counts_sums[:, -1] + 1)).astype(np.int64)
+    bottoms = (counts_sums > n[:, None]).argmax(axis=1)
+    tops = pick_nth(batch.beating(bottoms, games) & hands, n - counts_sums[rows, bottoms] + counts[rows, bottoms])
+    moves[games] = np.where(n < counts_sums[:, -1], DEFEND_OFFSET + bottoms * CARDS_COUNT + tops, TAKE_MOVE)
+
+    games = np.flatnonzero(phases == THROWING)
+    throwable = batch.throwable(seats[games], games)
+    counts = throwable.sum(axis=1, dtype=np.int8)
+    n = (chance[games] * (counts + 1)).astype(np.int64) # the last one is finishing
+    moves[games] = np.where(n < counts, THROW_OFFSET + pick_nth(throwable, n), FINISH_MOVE)
+
+    return moves
+
+
+def greedy_policy(batch: BatchTable, seats, phases, rng): # the same idea as engine.sim.greedy_policy: always the lowest card
+    not_chosen = len(CardSuit) * RANKS_COUNT # more than any card strength
+    moves = np.full(batch.games_count, NO_MOVE, dtype=np.int64)
+
+    games = np.flatnonzero(phases == ATTACKING)
+    hands = batch.hands_of(seats[games], games)
+    moves[games] = PLAY_TURN_OFFSET + np.where(hands, batch.card_strengths(games), not_chosen).argmin(axis=1)
+
+    # the lowest card beating any unbeaten card, takes if some card can't be beaten (everything will be taken anyway)
+    games = np.flatnonzero(phases == DEFENDING)
+    hands = batch.hands_of(seats[games], games)
+    trumps = batch.trump_mask(games)
+    unbeaten = batch.unbeaten(games)
+    lowest_unbeaten = np.where(unbeaten.reshape(-1, len(CardSuit), RANKS_COUNT), card_ranks()[:RANKS_COUNT], RANKS_COUNT).min(axis=2)
+    beating_any = hands & (
+        (card_ranks() > lowest_unbeaten[:, card_suits()]) | (trumps & (unbeaten & ~trumps).any(axis=1)[:, None])
+    )
+    tops = np.where(beating_any, batch.card_strengths(games), not_chosen).argmin(axis=1)
+    bottoms = (unbeaten & beats_matrix()[batch.trump_suit[games], :, tops]).argmax(axis=1)
+    must_take = (unbeaten & (batch.defense_counts(hands, games) == 0)).any(axis=1)
+    moves[games] = np.where(must_take, TAKE_MOVE, DEFEND_OFFSET + bottoms * CARDS_COUNT + tops)
+
+    games = np.flatnonzero(phases == THROWING)
+    throwable = batch.throwable(seats[games], games) & ~batch.trump_mask(games) # trumps are kept
+    cheapest = np.where(throwable, batch.card_strengths(games), not_chosen).argmin(axis=1)
+    moves[games] = np.where(throwable.any(axis=1), THROW_OFFSET + cheapest, FINISH_MOVE)
+
+    return moves
+
+
+POLICIES = {
+    'random': random_policy,
+    'greedy': greedy_policy,
+}
+
+
+# play every game to the end (or max_moves), returns moves count and durak seat (-1 if nobody, -2 if unfinished) of every game.
+# Finished games are dropped from the batch on the way
+def play_games(batch: BatchTable, policy: str = 'random', rng=None, max_moves: int = 10000):
+    rng = rng if rng is not None else np.random.default_rng()
+    moves_count = np.zeros(batch.games_count, dtype=np.int64)
+    duraks = np.full(batch.games_count, -2, dtype=np.int64)
+    ids = np.arange(batch.games_count) # original index of every game left in the batch
+
+    for _ in range(max_moves):
+        seats, phases = batch.decisions()
+        over = phases == GAME_OVER
+        if over.any():
+            duraks[ids[over]] = batch.durak_seats()[over]
+            if over.all():
+                break
+            if over.mean() > 0.25: # copying the rest is cheaper than stepping finished games
+                playing = np.flatnonzero(~over)
+                batch.take(playing)
+                ids, seats, phases = ids[playing], seats[playing], phases[playing]
+
+        batch.step(seats, POLICIES[policy](batch, seats, phases, rng))
+        moves_count[ids] += phases != GAME_OVER
+
+    return moves_count, duraks
+
+
+def main(argv=None): # python -m engine.batch --games 100000 --players 3 --policy greedy
+    parser = argparse.ArgumentParser(description="Play games between bots on numpy backend and print statistics as json")
+    parser.add_argument('--games', type=int, default=10000, help="number of games to play")
+    parser.add_argument('--players', type=int, default=2, choices=(2, 3, 4), help="number of players in every game")
+    parser.add_argument('--policy', default='random', choices=list(POLICIES), help="policy of every player")
+    parser.add_argument('--batch-size', type=int, default=4096, help="number of games played in lockstep")
+    parser.add_argument('--seed', type=int, default=None, help="seed of numpy generator")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    started = time.perf_counter()
+    moves = []
+    duraks = []
+    for first in range(0, args.games, args.batch_size):
+        batch_moves, batch_duraks = play_games(BatchTable.shuffled(min(args.batch_size, args.games - first), args.players, rng), args.policy, rng)
+        moves.append(batch_moves)
+        duraks.append(batch_duraks)
+    seconds = time.perf_counter() - started
+
+    moves = np.concatenate(moves)
+    duraks = np.concatenate(duraks)
+    json.dump({
+        'games': args.games,
+        'seconds': seconds,
+        'games_per_second': args.games / seconds if seconds > 0 else None,
+        'moves_mean': float(moves.mean()),
+        'moves_max': int(moves.max()),
+        'draws': int((duraks == -1).sum()),
+        'unfinished': int((duraks == -2).sum()),
+        'durak_by_seat': {player_id(s): int((duraks == s).sum()) for s in range(args.players)},
+    }, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+import argparse
+import json
+import random
+import sys
+import time
+from collections import OrderedDict
+from functools import cache
+
+from .Table import *
+from .sim import POLICIES
+
+# value of the game for the player the solver plays for
+WIN = 1 # opponent is durak
+DRAW = 0 # both players finished at the same moment
+LOSS = -1 # player is durak
+
+# kinds of values stored in transposition table (alpha-beta cuts give only bounds)
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# moves of positions, cards are indexes of the encoding (see encoding)
+ATTACK = 0 # (ATTACK, card)
+DEFEND = 1 # (DEFEND, bottom card, top card)
+THROW = 2 # (THROW, card)
+TAKE = 3 # (TAKE,)
+FINISH = 4 # (FINISH,)
+
+
+class SolverTimeout(Exception): # search didn't finish before the deadline
+    pass
+
+
+def is_endgame(table: Table) -> bool: # deck is empty, so players can't get unknown cards anymore
+    return table.deck.cards_available() == 0 and len(table.players) >= 2
+
+
+def is_perfect_information(table: Table) -> bool: # with 2 players and empty deck the opponent has all the cards nobody saw
+    return is_endgame(table) and len(table.players) == 2
+
+
+# cards of the game with given trump renumbered from the cheapest (six of non trump suit) to the most expensive (trump ace),
+# so the lowest bit of any set of cards is its cheapest card and moves are tried from the cheapest cards.
+# Returns (card id => index, index => card id, index => indexes beating it, ranks bitset => indexes of these ranks, index => rank bit)
+@cache
+def encoding(trump_suit: CardSuit) -> tuple:
+    cards = sorted(CARDS_BY_ID, key=lambda c: (c.get_suit() == trump_suit, c.get_rank().value, c.get_suit().value))
+    to_index = [0] * CARDS_COUNT
+    for i, card in enumerate(cards):
+        to_index[card.get_id()] = i
+
+    beats = beats_table(trump_suit)
+    beating = tuple(sum(1 << to_index[c.get_id()] for c in cards if beats[card.get_id()] & c.get_bit()) for card in cards)
+    rank_bits = tuple(card.get_rank_bit() for card in cards)
+    rank_cards = tuple(sum(1 << i for i, bit in enumerate(rank_bits) if bit & ranks) for ranks in range(1 << RANKS_COUNT))
+
+    return tuple(to_index), tuple(c.get_id() for c in cards), beating, rank_cards, rank_bits
+
+
+def encode_mask(mask: int, to_index: tuple) -> int: # bitset of card ids to bitset of indexes
+    encoded = 0
+    while mask:
+        bit = mask & -mask
+        mask ^= bit
+        encoded |= 1 << to_index[bit.bit_length() - 1]
+    return encoded
+
+
+# exact alpha-beta search of 2 player endgame (the deck is empty, so both players know every card). Table is turned into
+# position of plain integers: (attacker seat, hand of seat 0, hand of seat 1, unbeaten cards, cards on the table,
+# ranks on the table, number of attacking cards, limit of attacking cards, defender takes, attacker finished),
+# moves follow Table.legal_moves. The defender beats unbeaten cards from the cheapest one: the same cards get beaten
+# in any order and beating before taking only gives attacker more ranks to throw.
+# Values of visited positions are kept in transposition table limited to max_entries, the least recently used entry
+# is evicted first. Positions are the same for every game with the same trump, so one solver can serve many searches
+class EndgameSolver:
+    def __init__(self, max_entries: int = 200_000):
+        self.max_entries = max_entries
+        self.table: OrderedDict = OrderedDict() # (trump, position key) => (value for seat 0, kind of value, best move)
+        self.nodes = 0 # positions visited by the last search
+        self.__deadline: (float | None) = None
+        self.__trump: (CardSuit | None) = None
+        self.__encoding: tuple = ()
+
+    # value of the table for given player (WIN, DRAW or LOSS) and the best move (event, see Table.apply_event)
+    # if it's his decision (None otherwise). Raises SolverTimeout if time.time() reaches deadline
+    def solve(self, table: Table, player_id: str, deadline: (float | None) = None) -> tuple[int, (tuple | None)]:
+        if not is_perfect_information(table):
+            raise ValueError("Only 2 player games with empty deck can be solved")
+
+        seat = [p.get_id() for p in table.players].index(player_id)
+        attacker_id = table.players[table.get_turn()].get_id()
+        self.__trump = table.deck.get_trump().get_suit()
+        self.__encoding = encoding(self.__trump)
+        self.__deadline = deadline
+        self.nodes = 0
+
+        position = self.position(table)
+        value = self.__search(position, LOSS, WIN) * (1 if seat == 0 else -1)
+
+        entry = self.table.get((self.__trump, self.key(position)))
+        if entry is None or entry[2] is None or table.legal_moves()[0] != player_id:
+            return value, None
+        return value, self.event(entry[2], attacker_id)
+
+    def position(self, table: Table) -> tuple: # compact state of 2 player table
+        to_index = self.__encoding[0]
+        unbeaten = 0
+        on_table = 0
+        for b_card, t_card in table.attack_state.items():
+            on_table |= b_card.get_bit()
+            if t_card is None:
+                unbeaten |= b_card.get_bit()
+            else:
+                on_table |= t_card.get_bit()
+
+        count = len(table.attack_state)
+        limit = table.defender_hand_starting_len - (1 if table.attacks_number == 1 else 0) if count > 0 else 0
+        return (
+            table.get_turn(),
+            encode_mask(table.players[0].get_hand_mask(), to_index), encode_mask(table.players[1].get_hand_mask(), to_index),
+            encode_mask(unbeaten, to_index), encode_mask(on_table, to_index), table.get_table_ranks(),
+            count, limit, count > 0 and table.defender_takes, count > 0 and len(table.finished_player_ids) > 0,
+        )
+
+    @staticmethod
+    def key(position: tuple) -> int: # position packed to one integer (ranks are known from cards on the table, count and limit get 6 bits each)
+        attacker, hand0, hand1, unbeaten, on_table, _, count, limit, takes, finished = position
+        return hand0 | hand1 << 36 | unbeaten << 72 | on_table << 108 | (attacker | count << 1 | limit << 7 | takes << 13 | finished << 14) << 144
+
+    def event(self, move: tuple, attacker_id: str) -> tuple: # move of position as move of table
+        to_card = self.__encoding[1]
+        kind = move[0]
+        if kind == ATTACK:
+            return ('play_turn', to_card[move[1]])
+        if kind == DEFEND:
+            return ('defend', to_card[move[1]], to_card[move[2]])
+        if kind == THROW:
+            return ('throw_additional', attacker_id, to_card[move[1]])
+        if kind == TAKE:
+            return ('take_cards',)
+        return ('finished', attacker_id)
+
+    @staticmethod
+    def end_attack(attacker: int, hand0: int, hand1: int, taken: bool, on_table: int) -> (tuple | int): # next position or value of finished game for seat 0
+        if taken: # defender gets every card from the table and the same player attacks again
+            if attacker == 0:
+                hand1 |= on_table
+            else:
+                hand0 |= on_table
+        else:
+            attacker = 1 - attacker
+
+        if hand0 == 0:
+            return DRAW if hand1 == 0 else WIN
+        if hand1 == 0:
+            return LOSS
+        return (attacker, hand0, hand1, 0, 0, 0, 0, 0, False, False)
+
+    # moves of the player whose decision it is (the cheapest cards first) with the next positions
+    # (or values of finished games) and seat of the deciding player
+    def children(self, position: tuple) -> tuple[list, int]:
+        attacker, hand0, hand1, unbeaten, on_table, ranks, count, limit, takes, finished = position
+        _, _, beating, rank_cards, rank_bits = self.__encoding
+        attacker_hand, defender_hand = (hand0, hand1) if attacker == 0 else (hand1, hand0)
+        result = []
+
+        if count == 0: # attacker starts the attack with any card
+            defender_len = defender_hand.bit_count()
+            cards = attacker_hand
+            while cards:
+                bit = cards & -cards
+                cards ^= bit
+                card = bit.bit_length() - 1
+                rest = attacker_hand ^ bit
+                result.append(((ATTACK, card), (
+                    attacker, rest if attacker == 0 else hand0, hand1 if attacker == 0 else rest,
+                    bit, bit, rank_bits[card], 1, defender_len, False, False,
+                )))
+            return result, attacker
+
+        if unbeaten and not takes: # defender beats the cheapest unbeaten card or takes
+            bottom_bit = unbeaten & -unbeaten
+            bottom = bottom_bit.bit_length() - 1
+            left = unbeaten ^ bottom_bit
+            cards = beating[bottom] & defender_hand
+            while cards:
+                bit = cards & -cards
+                cards ^= bit
+                card = bit.bit_length() - 1
+                rest = defender_hand ^ bit
+                new_hand0, new_hand1 = (hand0, rest) if attacker == 0 else (rest, hand1)
+                if left == 0 and finished:
+                    child = self.end_attack(attacker, new_hand0, new_hand1, False, 0)
+                else:
+                    child = (attacker, new_hand0, new_hand1, left, on_table | bit, ranks | rank_bits[card], count, limit, False, finished)
+                result.append(((DEFEND, bottom, card), child))
+
+            if finished:
+                child = self.end_attack(attacker, hand0, hand1, True, on_table)
+            else:
+                child = (attacker, hand0, hand1, unbeaten, on_table, ranks, count, limit, True, False)
+            result.append(((TAKE,), child))
+            return result, 1 - attacker
+
+        # everything is beaten (or defender takes), attacker throws cards of ranks on the table or finishes the attack
+        if count != limit:
+            cards = attacker_hand & rank_cards[ranks]
+            while cards:
+                bit = cards & -cards
+                cards ^= bit
+                rest = attacker_hand ^ bit
+                result.append(((THROW, bit.bit_length() - 1), (
+                    attacker, rest if attacker == 0 else hand0, hand1 if attacker == 0 else rest,
+                    unbeaten | bit, on_table | bit, ranks, count + 1, limit, takes, False,
+                )))
+        result.append(((FINISH,), self.end_attack(attacker, hand0, hand1, takes, on_table)))
+        return result, attacker
+
+    def __search(self, position: tuple, alpha: int, beta: int) -> int: # value for seat 0
+        self.nodes += 1
+        if self.__deadline is not None and self.nodes & 1023 == 0 and time.time() >= self.__deadline:
+            raise SolverTimeout()
+
+        key = (self.__trump, self.key(position))
+        entry = self.table.get(key)
+        best_move = None
+        if entry is not None:
+            self.table.move_to_end(key)
+            value, kind, best_move = entry
+            if kind == EXACT or (kind == LOWER and value >= beta) or (kind == UPPER and value <= alpha):
+                return value
+
+        children, decider = self.children(position)
+        if best_move is not None: # the best move of previous search is tried first
+            children.sort(key=lambda c: c[0] != best_move)
+
+        maximizing = decider == 0
+        best = LOSS - 1 if maximizing else WIN + 1
+        low, high = alpha, beta
+        for move, child in children:
+            value = child if type(child) is int else self.__search(child, low, high)
+
+            if (value > best) if maximizing else (value < best):
+                best = value
+                best_move = move
+                if maximizing:
+                    low = max(low, value)
+                else:
+                    high = min(high, value)
+                if low >= high:
+                    break
+
+        kind = UPPER if best <= alpha else LOWER if best >= beta else EXACT
+        self.table[key] = (best, kind, best_move)
+        if len(self.table) > self.max_entries:
+            self.table.popitem(last=False)
+
+        return best
+
+
+solver: (EndgameSolver | None) = None # solver of this process (transposition table is reused by next searches)
+
+
+# the best move of the player whose decision it is, None if it's not found before deadline (time.time()).
+# Table can be given as bytes (see Table.to_bytes) to solve in another process
+def solve_move(table: (Table | bytes), player_id: str, deadline: (float | None) = None, max_entries: int = 200_000) -> (tuple | None):
+    global solver
+    if Table.is_bytes(table):
+        table = Table.from_bytes(table)
+    if solver is None or solver.max_entries != max_entries:
+        solver = EndgameSolver(max_entries)
+
+    try:
+        return solver.solve(table, player_id, deadline)[1]
+    except SolverTimeout:
+        return None
+
+
+def main(argv=None): # python -m engine.endgame --games 100
+    parser = argparse.ArgumentParser(description="Play 2 player games until the deck is empty, solve the rest and print statistics as json")
+    parser.add_argument('--games', type=int, default=100, help="number of endgames to solve")
+    parser.add_argument('--policy', default='greedy', choices=tuple(POLICIES), help="policy playing games until the deck is empty")
+    parser.add_argument('--max-entries', type=int, default=200_000, help="size of transposition table")
+    parser.add_argument('--timeout', type=float, default=10.0, help="seconds after which endgame is given up")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first game (next games use the following seeds)")
+    args = parser.parse_args(argv)
+
+    endgame_solver = EndgameSolver(args.max_entries)
+    times = []
+    nodes = []
+    values = {WIN: 0, DRAW: 0, LOSS: 0}
+    timeouts = 0
+    for seed in range(args.seed, args.seed + args.games):
+        table = Table([Player(f'p{i}', f'p{i}') for i in range(2)], seed=seed)
+        rng = random.Random(f'policies-{seed}')
+        while not is_endgame(table) and len(table.players) >= 2:
+            player_id, moves = table.legal_moves()
+            table.apply_event(POLICIES[args.policy](table, player_id, moves, rng))
+
+        player_id, moves = table.legal_moves()
+        if not moves:
+            continue
+
+        endgame_solver.table.clear() # every endgame is solved from scratch
+        started = time.perf_counter()
+        try:
+            value, _ = endgame_solver.solve(table, player_id, time.time() + args.timeout)
+        except SolverTimeout:
+            timeouts += 1
+            continue
+        times.append(time.perf_counter() - started)
+        nodes.append(endgame_solver.nodes)
+        values[value] += 1
+
+    times.sort()
+    nodes.sort()
+    json.dump({
+        'endgames': len(times) + timeouts,
+        'timeouts': timeouts,
+        'seconds_median': times[len(times) // 2] if times else None,
+        'seconds_p95': times[int(len(times) * 0.95)] if times else None,
+        'nodes_median': nodes[len(nodes) // 2] if nodes else None,
+        'wins': values[WIN],
+        'draws': values[DRAW],
+        'losses': values[LOSS],
+    }, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
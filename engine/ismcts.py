@@ -0,0 +1,177 @@
+import argparse
+import json
+import math
+import random
+import sys
+import time
+
+from .Table import *
+from .sim import POLICIES as ROLLOUT_POLICIES
+
+EXPLORATION = 0.7 # weight of exploration in UCB (rewards are 0 or 1)
+MAX_PLAYOUT_MOVES = 1000 # playout which didn't end in so many moves counts as a draw
+
+
+# statistics of one move in the tree. Tree is shared by every determinization, so a move can be legal only in some of them:
+# available counts how many times it was (subset-armed UCB of information set MCTS)
+class Node:
+    __slots__ = ('move', 'player_id', 'parent', 'children', 'visits', 'available', 'reward')
+
+    def __init__(self, move: (tuple | None) = None, player_id: (str | None) = None, parent: ('Node | None') = None):
+        self.move = move
+        self.player_id = player_id # who made the move (reward is counted from his point of view)
+        self.parent = parent
+        self.children: dict[tuple, Node] = {} # move => node
+        self.visits = 0
+        self.available = 1
+        self.reward = 0.0
+
+    def ucb(self) -> float:
+        return self.reward / self.visits + EXPLORATION * math.sqrt(math.log(self.available) / self.visits)
+
+
+# copy of the table where cards the player can't see (other hands and deck without visible trump card at the bottom)
+# are dealt randomly, every hand keeps its size
+def determinize(table: Table, player_id: str, rng: random.Random) -> Table:
+    state = table.clone()
+    opponents = [p for p in state.players if p.get_id() != player_id] # winners have no cards
+    deck = state.deck.get_cards()
+
+    hidden = deck[1:]
+    for opponent in opponents:
+        hidden += opponent.get_hand()
+    rng.shuffle(hidden)
+
+    dealt = 0
+    for opponent in opponents:
+        hand_len = opponent.hands_len()
+        opponent.set_hand(hidden[dealt:dealt + hand_len])
+        dealt += hand_len
+    state.deck = Deck(deck[:1] + hidden[dealt:], state.deck.get_trump())
+
+    return state
+
+
+def playout(state: Table, rng: random.Random, policy) -> tuple[bool, (str | None)]: # play to the end, returns (finished, durak id)
+    for _ in range(MAX_PLAYOUT_MOVES):
+        player_id, moves = state.legal_moves()
+        if not moves:
+            return True, state.players[0].get_id() if len(state.players) == 1 else None
+
+        state.apply_event(policy(state, player_id, moves, rng))
+
+    return False, None
+
+
+# run determinized information set MCTS for the player whose decision it is until deadline (time.time()) or max_playouts,
+# returns (root move => visits, number of playouts). Table can be given as bytes (see Table.to_bytes) to search in another process
+def search(table: (Table | bytes), player_id: str, deadline: float, max_playouts: (int | None) = None,
+           seed: (int | None) = None, rollout: str = 'greedy') -> tuple[dict, int]:
+    if Table.is_bytes(table):
+        table = Table.from_bytes(table)
+    if table.legal_moves()[0] != player_id:
+        raise ValueError("It's not player's decision")
+
+    rng = random.Random(seed)
+    policy = ROLLOUT_POLICIES[rollout]
+    root = Node()
+    playouts = 0
+
+    while (max_playouts is None or playouts < max_playouts) and time.time() < deadline:
+        state = determinize(table, player_id, rng)
+        node = root
+
+        # selection (and expansion of one move not tried yet)
+        decider, moves = state.legal_moves()
+        while moves:
+            untried = []
+            for move in moves:
+                child = node.children.get(move)
+                if child is None:
+                    untried.append(move)
+                else:
+                    child.available += 1
+
+            if untried:
+                move = rng.choice(untried)
+                child = Node(move, decider, node)
+                node.children[move] = child
+                node = child
+                state.apply_event(move)
+                break
+
+            node = max((node.children[m] for m in moves), key=Node.ucb)
+            state.apply_event(node.move)
+            decider, moves = state.legal_moves()
+
+        finished, durak = playout(state, rng, policy)
+        playouts += 1
+
+        while node is not None: # backpropagation, everyone except durak wins
+            node.visits += 1
+            if node.player_id is not None:
+                node.reward += (node.player_id != durak) if finished else 0.5
+            node = node.parent
+
+    return {move: child.visits for move, child in root.children.items()}, playouts
+
+
+def best_move(visits: dict) -> (tuple | None): # the most visited move (the most robust one)
+    return max(visits, key=visits.get, default=None)
+
+
+def choose_move(table: Table, player_id: str, time_budget: float, max_playouts: (int | None) = None, seed: (int | None) = None) -> tuple:
+    visits, _ = search(table, player_id, time.time() + time_budget, max_playouts, seed)
+    move = best_move(visits)
+    if move is None: # budget was too short even for one playout
+        move = ROLLOUT_POLICIES['greedy'](table, player_id, table.legal_moves()[1], random.Random(seed))
+
+    return move
+
+
+def main(argv=None): # python -m engine.ismcts --games 100 --opponent greedy --move-time 0.1
+    parser = argparse.ArgumentParser(description="Play games of ISMCTS bot against simulation policy and print statistics as json")
+    parser.add_argument('--games', type=int, default=100, help="number of games to play")
+    parser.add_argument('--players', type=int, default=2, choices=(2, 3, 4), help="number of players in every game (bot takes the first seat)")
+    parser.add_argument('--opponent', default='greedy', choices=tuple(ROLLOUT_POLICIES), help="policy of other seats")
+    parser.add_argument('--move-time', type=float, default=0.1, help="seconds bot thinks about every move")
+    parser.add_argument('--max-playouts', type=int, default=None, help="limit of playouts per move")
+    parser.add_argument('--rollout', default='greedy', choices=tuple(ROLLOUT_POLICIES), help="policy playing moves after the tree")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first game (next games use the following seeds)")
+    args = parser.parse_args(argv)
+
+    durak_count = 0
+    playouts = 0
+    search_seconds = 0.0
+    for seed in range(args.seed, args.seed + args.games):
+        table = Table([Player(f'p{i}', f'p{i}') for i in range(args.players)], seed=seed)
+        rng = random.Random(f'policies-{seed}')
+
+        while True:
+            player_id, moves = table.legal_moves()
+            if not moves:
+                break
+
+            if player_id == 'p0':
+                started = time.time()
+                visits, count = search(table, player_id, started + args.move_time, args.max_playouts, rng.random(), args.rollout)
+                search_seconds += time.time() - started
+                playouts += count
+                move = best_move(visits) or moves[0]
+            else:
+                move = ROLLOUT_POLICIES[args.opponent](table, player_id, moves, rng)
+            table.apply_event(move)
+
+        durak_count += len(table.players) == 1 and table.players[0].get_id() == 'p0'
+
+    json.dump({
+        'games': args.games,
+        'bot_durak_rate': durak_count / args.games,
+        'fair_durak_rate': 1 / args.players,
+        'playouts_per_second': playouts / search_seconds if search_seconds > 0 else None,
+    }, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
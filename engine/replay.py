@@ -0,0 +1,61 @@
+import argparse
+import json
+import sys
+
+from .Table import *
+
+
+# record of one game: everything needed to rebuild any of its states exactly
+# (players in seating order as [name, id] pairs, seed of the deal and events emitted by the table, see Table.apply_event)
+class GameRecord:
+    def __init__(self, players: list, seed: int, events: (list | None) = None):
+        self.players: list = [list(p) for p in players]
+        self.seed: int = seed
+        self.events: list = events if events is not None else []
+
+    def to_json(self):
+        return {'players': self.players, 'seed': self.seed, 'events': [list(e) for e in self.events]}
+
+    @classmethod
+    def from_json(cls, data: (str | dict)):
+        if type(data) is str:
+            data = json.loads(data)
+
+        return cls(data['players'], data['seed'], data['events'])
+
+
+def new_game(players: list, seed: int) -> tuple[Table, GameRecord]: # start recorded game
+    record = GameRecord(players, seed)
+    table = Table([Player(name, player_id) for name, player_id in record.players], seed=seed)
+    table.event_listener = record.events.append
+
+    return table, record
+
+
+def replay(players: list, seed: int, events: list, moves: (int | None) = None) -> Table: # rebuild state after given number of moves (all by default)
+    table = Table([Player(name, player_id) for name, player_id in players], seed=seed)
+    for event in events[:moves]:
+        table.apply_event(event)
+
+    return table
+
+
+def main(argv=None): # python -m engine.replay record.json [--moves N]
+    parser = argparse.ArgumentParser(description="Rebuild state of recorded game and print it as json")
+    parser.add_argument('record', help="json file with players, seed and events (see GameRecord), '-' for stdin")
+    parser.add_argument('--moves', type=int, default=None, help="number of moves to replay (all by default)")
+    args = parser.parse_args(argv)
+
+    if args.record == '-':
+        record = GameRecord.from_json(json.load(sys.stdin))
+    else:
+        with open(args.record) as f: # only the file is closed, not stdin
+            record = GameRecord.from_json(json.load(f))
+
+    table = replay(record.players, record.seed, record.events, args.moves)
+    json.dump(table.to_json(), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
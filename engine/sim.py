@@ -0,0 +1,146 @@
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import time
+
+from .Table import *
+
+
+# policies choose one of legal moves (see Table.legal_moves) for the player whose decision it is
+def random_policy(table: Table, player_id: str, moves: list[tuple], rng: random.Random) -> tuple:
+    return rng.choice(moves)
+
+
+def card_strength(table: Table, card_id: int) -> tuple: # (is trump, rank), the lowest card is the cheapest to give away
+    card = Card.from_id(card_id)
+    return card.get_suit() == table.deck.get_trump().get_suit(), card.get_rank().value
+
+
+def greedy_policy(table: Table, player_id: str, moves: list[tuple], rng: random.Random) -> tuple: # always plays the lowest card it can
+    action = moves[0][0]
+    if action == 'play_turn':
+        return min(moves, key=lambda m: card_strength(table, m[1]))
+
+    if action == 'defend' or action == 'take_cards':
+        defenses = [m for m in moves if m[0] == 'defend']
+        unbeaten = sum(1 for t_card in table.attack_state.values() if t_card is None)
+        if len({m[1] for m in defenses}) < unbeaten: # some card can't be beaten, so everything will be taken anyway
+            return ('take_cards',)
+
+        return min(defenses, key=lambda m: card_strength(table, m[2]))
+
+    throws = [m for m in moves if m[0] == 'throw_additional' and not card_strength(table, m[2])[0]] # trumps are kept
+    if throws:
+        return min(throws, key=lambda m: card_strength(table, m[2]))
+
+    return moves[-1] # finished
+
+
+POLICIES = {
+    'random': random_policy,
+    'greedy': greedy_policy,
+}
+
+
+# play one game from the deal given by seed to the end, seats are taking policies in order (cyclically)
+def play_game(seed: int, policies: list[str], players_count: int = 2, max_moves: int = 10000) -> dict:
+    started = time.perf_counter()
+
+    table = Table([Player(f'p{i}', f'p{i}') for i in range(players_count)], seed=seed)
+    seat_policies = {p.get_id(): policies[i % len(policies)] for i, p in enumerate(table.players)}
+    rng = random.Random(f'policies-{seed}') # separate stream, so policies don't change the deal
+
+    moves_count = 0
+    while moves_count < max_moves:
+        player_id, moves = table.legal_moves()
+        if not moves:
+            break
+
+        table.apply_event(POLICIES[seat_policies[player_id]](table, player_id, moves, rng))
+        moves_count += 1
+
+    durak = table.players[0].get_id() if len(table.players) == 1 else None
+    return {
+        'seed': seed,
+        'policies': seat_policies,
+        'moves': moves_count,
+        'attacks': table.attacks_number,
+        'winners': [w.get_id() for w in table.winners],
+        'durak': durak,
+        'finished': len(table.players) <= 1, # False if max_moves was reached
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def play_game_args(args: tuple) -> dict: # Pool.imap passes one argument
+    return play_game(*args)
+
+
+# play games with seeds first_seed..first_seed+games-1 in pool of processes, yields statistics of every game (in any order)
+def simulate(games: int, policies: list[str], players_count: int = 2, processes: (int | None) = None, first_seed: int = 0):
+    tasks = ((seed, policies, players_count) for seed in range(first_seed, first_seed + games))
+
+    if processes == 1: # without pool (e.g. for profiling)
+        yield from map(play_game_args, tasks)
+        return
+
+    with multiprocessing.Pool(processes) as pool:
+        yield from pool.imap_unordered(play_game_args, tasks, chunksize=max(1, min(256, games // (8 * (processes or multiprocessing.cpu_count())))))
+
+
+def summarize(results: list[dict], seconds: float) -> dict: # aggregated statistics of simulated games
+    durak_policies = {}
+    for r in results:
+        if r['durak'] is not None:
+            policy = r['policies'][r['durak']]
+            durak_policies[policy] = durak_policies.get(policy, 0) + 1
+
+    moves = [r['moves'] for r in results]
+    return {
+        'games': len(results),
+        'seconds': seconds,
+        'games_per_second': len(results) / seconds if seconds > 0 else None,
+        'moves_mean': sum(moves) / len(moves) if moves else None,
+        'moves_max': max(moves, default=None),
+        'attacks_mean': sum(r['attacks'] for r in results) / len(results) if results else None,
+        'draws': sum(1 for r in results if r['finished'] and r['durak'] is None), # last players finished at the same moment
+        'unfinished': sum(1 for r in results if not r['finished']),
+        'durak_by_policy': durak_policies,
+    }
+
+
+def main(argv=None): # python -m engine.sim --games 10000 --players 3 --policies greedy,random
+    parser = argparse.ArgumentParser(description="Play games between bots without server and print statistics as json")
+    parser.add_argument('--games', type=int, default=1000, help="number of games to play")
+    parser.add_argument('--players', type=int, default=2, choices=(2, 3, 4), help="number of players in every game")
+    parser.add_argument('--policies', default='random', help=f"comma separated policies given to seats in order ({', '.join(POLICIES)})")
+    parser.add_argument('--processes', type=int, default=None, help="size of the pool (number of cpus by default)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first game (next games use the following seeds)")
+    parser.add_argument('--games-out', default=None, help="file to write statistics of every game to (json lines)")
+    args = parser.parse_args(argv)
+
+    policies = args.policies.split(',')
+    for policy in policies:
+        if policy not in POLICIES:
+            parser.error(f"unknown policy: {policy}")
+
+    games_out = open(args.games_out, 'w') if args.games_out else None
+    started = time.perf_counter()
+    results = []
+    for result in simulate(args.games, policies, args.players, args.processes, args.seed):
+        results.append(result)
+        if games_out is not None:
+            games_out.write(json.dumps(result) + '\n')
+    seconds = time.perf_counter() - started
+
+    if games_out is not None:
+        games_out.close()
+
+    json.dump(summarize(results, seconds), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()